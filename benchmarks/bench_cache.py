@@ -0,0 +1,70 @@
+""" Compares getting the statements of a program with a cold ASTCache,
+which scans, parses and stores them, against a warm one, which loads
+them. The programs are repeated --copies times to stand for larger
+scripts.
+
+Usage: python benchmarks/bench_cache.py [program.lox ...]
+                                        [--copies N] [--repeat N]
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "interpreter"))
+
+from lox import Lox
+from cache import ASTCache
+
+
+PROGRAMS = os.path.join(ROOT, "benchmarks", "programs", "*.lox")
+
+
+def time_parse(code, directory, repeat, warm):
+    best = None
+    for _ in range(repeat):
+        cache = ASTCache(directory)
+        if warm:
+            Lox(cache=cache).parse(code)
+        else:
+            cache.clear()
+        lox = Lox(cache=cache)
+        hits = cache.hits
+        start = time.perf_counter()
+        lox.parse(code)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        if cache.hits - hits != int(warm):
+            sys.exit("expected a cache {}".format("hit" if warm else "miss"))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("programs", nargs="*")
+    parser.add_argument("--copies", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="lox-cache-")
+    try:
+        print("{:<20}{:>10}{:>10}{:>10}{:>10}".format(
+            "program", "bytes", "cold", "warm", "speedup"))
+        for filename in args.programs or sorted(glob.glob(PROGRAMS)):
+            with open(filename, "r") as f:
+                code = f.read() * args.copies
+            cold = time_parse(code, directory, args.repeat, warm=False)
+            warm = time_parse(code, directory, args.repeat, warm=True)
+            print("{:<20}{:>10}{:>9.4f}s{:>9.4f}s{:>9.1f}x".format(
+                os.path.basename(filename), len(code), cold, warm,
+                cold / warm))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+""" Measures with tracemalloc the memory held by the tokens and the
+statements of a generated program of about --tokens tokens, for three
+layouts: Token and node classes with a __dict__ as they used to be, the
+__slots__ classes, and a TokenArray.
+
+Usage: python benchmarks/bench_memory.py [--tokens N]
+"""
+import argparse
+import contextlib
+import gc
+import os
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "interpreter"))
+
+import ast
+import parser
+import scanner
+import tokens
+from lox import Lox
+
+
+STATEMENTS = """var total{n} = {n} + count * (step - 2) / 4;
+if (total{n} > limit) {{ print "over " + name; }} else {{ count = count + 1; }}
+fun scale{n}(x, y) {{ return x * {n}.5 + y; }}
+"""
+
+
+def generate(count):
+    # Less the EOF token after the trailing newline
+    per_round = len(Lox().scanner.tokenize(STATEMENTS.format(n=0))) - 1
+    rounds = -(-count // per_round)
+    return "".join(STATEMENTS.format(n=n) for n in range(rounds))
+
+
+def with_dict(cls):
+    # Copy of a __slots__ class whose instances keep a __dict__
+    namespace = dict((name, value) for name, value in vars(cls).items()
+                     if name not in ("__slots__",) + cls.__slots__)
+    bases = tuple(base if base is object else with_dict(base)
+                  for base in cls.__bases__)
+    return type(cls.__name__, bases, namespace)
+
+
+@contextlib.contextmanager
+def dict_layout():
+    """ Swaps Token and the node classes for __dict__ based copies """
+    nodes = dict((name, value) for name, value in vars(ast).items()
+                 if isinstance(value, type) and issubclass(value, ast.AST))
+    token = tokens.Token
+    dict_token = with_dict(token)
+    try:
+        for name, cls in nodes.items():
+            setattr(ast, name, with_dict(cls))
+        scanner.Token = parser.Token = tokens.Token = dict_token
+        yield
+    finally:
+        for name, cls in nodes.items():
+            setattr(ast, name, cls)
+        scanner.Token = parser.Token = tokens.Token = token
+
+
+def traced(build):
+    # Memory still held by what build returns
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def measure(code, compact):
+    lox = Lox()
+    if compact:
+        tokenize = lox.scanner.tokenize_compact
+    else:
+        tokenize = lox.scanner.tokenize
+    token_list, token_size = traced(lambda: tokenize(code))
+    count = len(token_list)
+    _, ast_size = traced(lambda: lox.parser.parse(token_list))
+    if lox.has_lexical_error or lox.has_parsing_error:
+        sys.exit("generated program does not parse")
+    return count, token_size, ast_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=1000000)
+    args = parser.parse_args()
+    code = generate(args.tokens)
+
+    with dict_layout():
+        results = [("__dict__",) + measure(code, compact=False)]
+    results.append(("__slots__",) + measure(code, compact=False))
+    results.append(("TokenArray",) + measure(code, compact=True))
+
+    print("{} tokens, {} bytes of source".format(results[0][1], len(code)))
+    # Parsing a TokenArray creates the tokens the statements keep, so
+    # those count towards the statements rather than the tokens
+    print("{:<12}{:>12}{:>14}{:>12}{:>12}".format(
+        "layout", "tokens MiB", "bytes/token", "AST MiB", "total MiB"))
+    for name, count, token_size, ast_size in results:
+        print("{:<12}{:>12.1f}{:>14.1f}{:>12.1f}{:>12.1f}".format(
+            name, token_size / 2 ** 20, token_size / count,
+            ast_size / 2 ** 20, (token_size + ast_size) / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
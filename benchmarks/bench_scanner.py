@@ -0,0 +1,68 @@
+""" Compares the tokens per second of the character by character
+Scanner and the pattern based FastScanner on the benchmark programs,
+repeated until the source holds at least --tokens tokens.
+
+Usage: python benchmarks/bench_scanner.py [program.lox ...]
+                                          [--tokens N] [--repeat N]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "interpreter"))
+
+from lox import Lox
+from scanner import Scanner, FastScanner
+
+
+PROGRAMS = os.path.join(ROOT, "benchmarks", "programs", "*.lox")
+
+
+def time_scanner(scanner, code, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        scanner.tokenize(code)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("programs", nargs="*")
+    parser.add_argument("--tokens", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    source = ""
+    for filename in args.programs or sorted(glob.glob(PROGRAMS)):
+        with open(filename, "r") as f:
+            source += f.read() + "\n"
+    lox = Lox()
+    reference = Scanner(lox)
+    fast = FastScanner(lox)
+    per_copy = len(fast.tokenize(source))
+    code = source * max(1, -(-args.tokens // per_copy))
+
+    expected = [(t.text, t.type, t.line, t.value)
+                for t in reference.tokenize(code)]
+    tokens = [(t.text, t.type, t.line, t.value) for t in fast.tokenize(code)]
+    if tokens != expected:
+        sys.exit("FastScanner and Scanner tokens differ")
+
+    print("{} tokens, {} bytes".format(len(tokens), len(code)))
+    results = []
+    for name, scanner in (("Scanner", reference), ("FastScanner", fast)):
+        elapsed = time_scanner(scanner, code, args.repeat)
+        results.append(elapsed)
+        print("{:<12}{:>9.3f}s{:>12.0f} tokens/s".format(
+            name, elapsed, len(tokens) / elapsed))
+    print("speedup     {:>9.1f}x".format(results[0] / results[1]))
+
+
+if __name__ == '__main__':
+    main()
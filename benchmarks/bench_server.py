@@ -0,0 +1,106 @@
+""" Compares running scripts with a new process each, as
+`python interpreter/lox.py script.lox`, against sending them to a
+server started with --serve. Prints the throughput and the median and
+99th percentile latency of each, measured by the caller.
+
+Usage: python benchmarks/bench_server.py [program.lox ...]
+                                         [--requests N] [--pool N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+LOX = os.path.join(ROOT, "interpreter", "lox.py")
+sys.path.insert(0, os.path.join(ROOT, "interpreter"))
+
+from server import Client
+
+
+# Typical of the short scripts most requests run
+SCRIPT = """
+var total = 0;
+for (var i = 0; i < 100; i = i + 1) {
+  total = total + i;
+}
+print total;
+"""
+
+
+def percentile(latencies, fraction):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_processes(paths, requests):
+    latencies = []
+    for i in range(requests):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, LOX, paths[i % len(paths)]],
+                       stdout=subprocess.DEVNULL, check=False)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_server(sources, requests, pool):
+    directory = tempfile.mkdtemp(prefix="lox-server-")
+    path = os.path.join(directory, "lox.sock")
+    server = subprocess.Popen([sys.executable, LOX, "--serve", path,
+                               "--pool", str(pool)])
+    try:
+        while not os.path.exists(path):
+            time.sleep(0.01)
+        latencies = []
+        with Client(path) as client:
+            for i in range(requests):
+                start = time.perf_counter()
+                client.run(sources[i % len(sources)])
+                latencies.append(time.perf_counter() - start)
+        return latencies
+    finally:
+        server.terminate()
+        server.wait()
+        if os.path.exists(path):
+            os.remove(path)
+        os.rmdir(directory)
+
+
+def report(name, latencies):
+    print("{:<12}{:>10}{:>11.1f}/s{:>11.2f}ms{:>11.2f}ms".format(
+        name, len(latencies), len(latencies) / sum(latencies),
+        percentile(latencies, 0.5) * 1000,
+        percentile(latencies, 0.99) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("programs", nargs="*")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--pool", type=int, default=4)
+    args = parser.parse_args()
+
+    paths = args.programs
+    if not paths:
+        handle, script = tempfile.mkstemp(suffix=".lox")
+        with os.fdopen(handle, "w") as f:
+            f.write(SCRIPT)
+        paths = [script]
+    try:
+        sources = []
+        for path in paths:
+            with open(path, "r") as f:
+                sources.append(f.read())
+        print("{:<12}{:>10}{:>13}{:>13}{:>13}".format(
+            "model", "requests", "throughput", "p50", "p99"))
+        report("process", run_processes(paths, args.requests))
+        report("server", run_server(sources, args.requests, args.pool))
+    finally:
+        if not args.programs:
+            os.remove(script)
+
+
+if __name__ == '__main__':
+    main()
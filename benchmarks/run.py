@@ -0,0 +1,65 @@
+""" Times Lox programs end to end: scanning, parsing, resolving and
+interpreting. Program output is discarded.
+
+Usage: python benchmarks/run.py [program.lox ...] [--repeat N]
+                                [--engine tree|vm ...] [-O]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "interpreter"))
+
+from lox import Lox, ENGINES
+from optimizer import PASSES
+
+
+PROGRAMS = os.path.join(ROOT, "benchmarks", "programs", "*.lox")
+
+
+def time_program(code, repeat, engine, optimize=None):
+    best = None
+    stdout = sys.stdout
+    with open(os.devnull, "w") as devnull:
+        for _ in range(repeat):
+            lox = Lox(engine=engine, optimize=optimize)
+            sys.stdout = devnull
+            try:
+                start = time.perf_counter()
+                lox.run(code)
+                elapsed = time.perf_counter() - start
+            finally:
+                sys.stdout = stdout
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("programs", nargs="*")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--engine", action="append", choices=sorted(ENGINES),
+        help="engine to time, may be given several times (default: all)")
+    parser.add_argument("-O", "--optimize", action="store_true",
+        help="run every optimizer pass before timing")
+    args = parser.parse_args()
+    optimize = list(PASSES) if args.optimize else None
+    engines = args.engine or sorted(ENGINES)
+
+    print("{:<20}".format("program") +
+        "".join("{:>10}".format(engine) for engine in engines))
+    for filename in args.programs or sorted(glob.glob(PROGRAMS)):
+        with open(filename, "r") as f:
+            code = f.read()
+        row = "{:<20}".format(os.path.basename(filename))
+        for engine in engines:
+            best = time_program(code, args.repeat, engine, optimize)
+            row += "{:>9.3f}s".format(best)
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,83 +1,213 @@
 class AST:
     """ Abstract Syntax Tree with visitor pattern """
+    # Attributes holding child nodes, or lists of child nodes
+    fields = ()
+    # Nodes have no __dict__, every attribute they use is a slot
+    __slots__ = ()
+
     def visit(self, interpreter):
         visit_func = "visit{}".format(self.__class__.__name__)
         func = getattr(interpreter, visit_func)
         return func(self)
 
+    def children(self):
+        for field in self.fields:
+            child = getattr(self, field)
+            if isinstance(child, list):
+                for node in child:
+                    yield node
+            elif child is not None:
+                yield child
+
 class Grouping(AST):
+    fields = ('expr',)
+    __slots__ = ('expr',)
+
     def __init__(self, expr):
         self.expr = expr
 
 class Assignment(AST):
+    fields = ('expr',)
+    __slots__ = ('var', 'expr', 'depth', 'slot')
+
     def __init__(self, variable, expr):
         self.var = variable
         self.expr = expr
+        # Filled in by the Resolver, depth is None for globals
+        self.depth = None
+        self.slot = None
 
 class Logical(AST):
+    fields = ('left', 'right')
+    __slots__ = ('left', 'op', 'right')
+
     def __init__(self, left_expr, op_token, right_expr):
         self.left = left_expr
         self.op = op_token
         self.right = right_expr
 
 class Binary(AST):
+    fields = ('left', 'right')
+    __slots__ = ('left', 'op', 'right', 'quick', 'deopts')
+
     def __init__(self, left_expr, op_token, right_expr):
         self.left = left_expr
         self.op = op_token
         self.right = right_expr
+        # Set by the Interpreter, see Interpreter.binary
+        self.quick = None
+        self.deopts = 0
 
 class Unary(AST):
+    fields = ('operand',)
+    __slots__ = ('op', 'operand', 'quick', 'deopts')
+
     def __init__(self, op_token, operand_expr):
         self.op = op_token
         self.operand = operand_expr
+        self.quick = None
+        self.deopts = 0
 
 class Literal(AST):
+    __slots__ = ('value', 'line')
     def __init__(self, token):
         self.value = token.value
+        self.line = token.line
 
 class Variable(AST):
+    __slots__ = ('var', 'depth', 'slot')
     def __init__(self, token):
         self.var = token
+        # Filled in by the Resolver, depth is None for globals
+        self.depth = None
+        self.slot = None
 
 class Call(AST):
+    fields = ('callee', 'args')
+    __slots__ = ('callee', 'args')
+
     def __init__(self, callee, args):
         self.callee = callee
         self.args = args
 
 class ExprStmt(AST):
+    fields = ('expr',)
+    __slots__ = ('expr',)
+
     def __init__(self, expr):
         self.expr = expr
 
 class PrintStmt(AST):
+    fields = ('expr',)
+    __slots__ = ('expr',)
+
     def __init__(self, expr):
         self.expr = expr
 
 class BlockStmt(AST):
+    fields = ('stmts',)
+    __slots__ = ('stmts', 'names', 'scoped', 'reuse_frame')
+
     def __init__(self, stmts):
         self.stmts = stmts
+        # Names of the variables declared in the block, by slot
+        self.names = []
+        # Set by the Resolver: whether the block declares anything and
+        # runs in a Frame of its own, and whether a loop can run every
+        # iteration of it in the same Frame
+        self.scoped = True
+        self.reuse_frame = False
 
 class IfStmt(AST):
+    fields = ('if_cond', 'if_branch', 'else_branch')
+    __slots__ = ('if_cond', 'if_branch', 'else_branch')
+
     def __init__(self, if_cond, if_branch, else_branch=None):
         self.if_cond = if_cond
         self.if_branch = if_branch
         self.else_branch = else_branch
 
 class WhileStmt(AST):
+    fields = ('cond', 'body')
+    __slots__ = ('cond', 'body')
+
     def __init__(self, cond, body):
         self.cond = cond
         self.body = body
 
 class ReturnStmt(AST):
+    fields = ('expr',)
+    __slots__ = ('expr',)
+
     def __init__(self, expr):
         self.expr = expr
 
 class VarDecl(AST):
+    fields = ('expr',)
+    __slots__ = ('var', 'expr', 'slot')
+
     def __init__(self, var, expr=None):
         self.var = var
         self.expr = expr
+        self.slot = None
 
 class FunDecl(AST):
+    fields = ('params', 'body')
+    __slots__ = ('name', 'params', 'body', 'slot', 'names', 'pure')
+
     def __init__(self, name, params, body):
         self.name = name
         self.params = params
         self.body = body
+        self.slot = None
+        # Names of the parameters, by slot in the call frame
+        self.names = []
+        # Set by the Purity pass when calls to it can be memoized
+        self.pure = False
+
+class ImportStmt(AST):
+    __slots__ = ('keyword', 'path')
+
+    def __init__(self, keyword, path):
+        self.keyword = keyword
+        # STRING token, its value is the path of the module
+        self.path = path
+
+class Hoisted(AST):
+    """ Loop invariant expression, evaluated the first time it is
+    reached in a loop and then read back from the var temporary """
+    fields = ('expr',)
+    __slots__ = ('expr', 'var', 'depth', 'slot')
+
+    def __init__(self, expr, var):
+        self.expr = expr
+        self.var = var
+        # Filled in by the Resolver, the same as for Variable
+        self.depth = None
+        self.slot = None
+
+
+# Expressions can appear directly in a statement list, e.g. the
+# increment clause of a desugared for loop, possibly hoisted
+EXPRESSIONS = (
+    Grouping, Assignment, Logical, Binary, Unary, Literal, Variable, Call,
+    Hoisted
+)
+
+
+def first_line(node):
+    """ Smallest line of a token in node, statements keep no line of
+    their own """
+    line = None
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        for name in ("var", "name", "op"):
+            token = getattr(node, name, None)
+            if token is not None and (line is None or token.line < line):
+                line = token.line
+        node_line = getattr(node, "line", None)
+        if node_line is not None and (line is None or node_line < line):
+            line = node_line
+        pending.extend(node.children())
+    return line
@@ -0,0 +1,113 @@
+import glob
+import io
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from lox import Lox
+from output import Output, FLUSH_ON_EXIT
+
+
+# Exit code of a script stopped by its timeout, after the codes of Lox
+TIMEOUT_EXIT = 4
+# Exit code of a script that crashed the interpreter itself
+CRASH_EXIT = 5
+
+
+class ScriptTimeout(BaseException):
+    """ Raised in a worker when its script runs out of time. Not an
+    Exception, so that nothing in the interpreter catches it. """
+
+
+def find_scripts(pattern):
+    """ The .lox files in a directory, or the files matching a glob """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*.lox")
+    return sorted(path for path in glob.glob(pattern)
+                  if os.path.isfile(path))
+
+
+def run_script(job):
+    """ Runs one script on a fresh Lox in a worker and returns its
+    result, with what it printed """
+    path, options, timeout = job
+    stdout = io.StringIO()
+    lox = Lox(output=Output(stdout, FLUSH_ON_EXIT), **options["lox"])
+    result = {"file": path, "exit_code": 0, "timed_out": False,
+              "error": None}
+    start = time.perf_counter()
+    if timeout is not None:
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        lox.run_file(path, stream=options["stream"])
+    except SystemExit as exit:
+        result["exit_code"] = exit.code
+    except ScriptTimeout:
+        result["exit_code"] = TIMEOUT_EXIT
+        result["timed_out"] = True
+    except Exception as error:
+        result["exit_code"] = CRASH_EXIT
+        result["error"] = "{}: {}".format(error.__class__.__name__, error)
+    finally:
+        if timeout is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    result["seconds"] = time.perf_counter() - start
+    # Lox flushes after a run, but not after a timeout or crash
+    lox.output.flush()
+    result["stdout"] = stdout.getvalue()
+    return result
+
+
+def raise_timeout(signum, frame):
+    raise ScriptTimeout()
+
+
+def start_worker():
+    signal.signal(signal.SIGALRM, raise_timeout)
+
+
+def run_batch(paths, jobs=None, timeout=None, stream=False, **options):
+    """ Runs the scripts at paths on a pool of jobs worker processes,
+    one core each by default, and returns the summary of the batch.
+    Workers are forked where possible, so they start with the
+    interpreter already imported. options are passed to every Lox. """
+    options = {"lox": options, "stream": stream}
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+    start = time.perf_counter()
+    with context.Pool(jobs, initializer=start_worker) as pool:
+        results = list(pool.imap(
+            run_script, [(path, options, timeout) for path in paths]))
+    return summarize(results, time.perf_counter() - start)
+
+
+def summarize(results, seconds):
+    exit_codes = {}
+    for result in results:
+        code = str(result["exit_code"])
+        exit_codes[code] = exit_codes.get(code, 0) + 1
+    return {
+        "scripts": len(results),
+        "failed": sum(1 for result in results if result["exit_code"]),
+        "timed_out": sum(1 for result in results if result["timed_out"]),
+        "exit_codes": exit_codes,
+        "seconds": seconds,
+        # Time spent running scripts, over all the workers
+        "script_seconds": sum(result["seconds"] for result in results),
+        "results": results
+    }
+
+
+def write_summary(summary, path):
+    # "-" writes to stdout
+    text = json.dumps(summary, indent=2) + "\n"
+    if path == "-":
+        sys.stdout.write(text)
+        return
+    with open(path, "w") as f:
+        f.write(text)
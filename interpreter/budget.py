@@ -0,0 +1,77 @@
+import ast as nodes
+from data_structures import Rope, concat
+from errors import BudgetExceeded
+
+
+# Estimated bytes of a call frame, and of each variable in it
+FRAME_BYTES = 64
+SLOT_BYTES = 8
+
+
+class Budget:
+    """ Limits on what one run of a program can do, for untrusted code.
+    Every loop iteration and call is a step. Memory is an estimate of
+    the bytes allocated over the run, freed or not: the characters
+    copied by string concatenation and the frames of calls. None is no
+    limit.
+
+    The engines hold None instead of a Budget when there are no limits,
+    and only check for it where steps are taken and memory allocated. """
+    def __init__(self, max_steps=None, max_memory=None):
+        self.max_steps = max_steps
+        self.max_memory = max_memory
+        self.reset()
+
+    def reset(self):
+        self.steps = 0
+        self.memory = 0
+        # Counters are compared with these, so a missing limit costs
+        # the same as a set one
+        self.step_limit = float("inf") if self.max_steps is None \
+            else self.max_steps
+        self.memory_limit = float("inf") if self.max_memory is None \
+            else self.max_memory
+
+    def step(self, where):
+        """ Counts a loop iteration or call. where is the node, token or
+        (Chunk, offset) pair it is reported at """
+        self.steps += 1
+        if self.steps > self.step_limit:
+            raise BudgetExceeded(line_of(where),
+                "Step budget of {} exceeded".format(self.max_steps))
+
+    def allocate(self, size, where):
+        self.memory += size
+        if self.memory > self.memory_limit:
+            raise BudgetExceeded(line_of(where),
+                "Memory budget of {} bytes exceeded".format(self.max_memory))
+
+    def call(self, names, where):
+        # Step and frame of a call to a function with these names
+        self.step(where)
+        self.allocate(FRAME_BYTES + SLOT_BYTES * len(names), where)
+
+    def too_deep(self, where):
+        """ Error for calls nested deeper than the Python stack allows,
+        on the engines whose Lox calls are Python calls. They run out of
+        it before the memory budget does. """
+        return BudgetExceeded(line_of(where),
+            "Calls nested deeper than the Python stack allows")
+
+    def concat(self, left, right, where):
+        # Appending to a Rope only stores right, otherwise both are
+        # copied into the result
+        if type(left) is Rope:
+            self.allocate(len(right), where)
+        else:
+            self.allocate(len(left) + len(right), where)
+        return concat(left, right)
+
+
+def line_of(where):
+    if isinstance(where, nodes.AST):
+        return nodes.first_line(where)
+    if type(where) is tuple:
+        chunk, offset = where
+        return chunk.line_at(offset)
+    return getattr(where, "line", None)
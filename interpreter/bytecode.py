@@ -0,0 +1,111 @@
+from tokens import enum
+
+
+OpCodes = enum(
+    'OpCodes',
+    # Stack and constants
+    'CONSTANT', 'POP', 'DUP',
+
+    # Variables, the operands are a constant index for globals and a
+    # (depth, slot) pair or a slot in the current frame for locals
+    'GET_GLOBAL', 'SET_GLOBAL', 'DEFINE_GLOBAL',
+    'GET_LOCAL', 'SET_LOCAL', 'GET_ENCLOSING', 'SET_ENCLOSING',
+    'PUSH_SCOPE', 'POP_SCOPE',
+
+    # Operators
+    'ADD', 'SUBTRACT', 'MULTIPLY', 'DIVIDE',
+    'EQUAL', 'NOT_EQUAL', 'GREATER', 'GREATER_EQUAL', 'LESS', 'LESS_EQUAL',
+    'NOT', 'NEGATE',
+
+    # Control flow, jump operands are absolute offsets
+    'JUMP', 'JUMP_IF_FALSE', 'JUMP_IF_FALSE_OR_POP', 'JUMP_IF_TRUE_OR_POP',
+    'JUMP_IF_NOT_NIL_OR_POP',
+
+    # Functions, MEMOIZE stores the value of a call in a MemoCache
+    'MAKE_FUNCTION', 'CALL', 'RETURN', 'MEMOIZE',
+
+    # The operand is the index of the ImportStmt in the constants
+    'PRINT', 'IMPORT'
+)
+
+# Number of operands following each opcode in Chunk.code
+operand_counts = {
+    OpCodes.CONSTANT: 1, OpCodes.GET_GLOBAL: 1, OpCodes.SET_GLOBAL: 1,
+    OpCodes.DEFINE_GLOBAL: 1, OpCodes.GET_LOCAL: 1, OpCodes.SET_LOCAL: 1,
+    OpCodes.GET_ENCLOSING: 2, OpCodes.SET_ENCLOSING: 2,
+    OpCodes.PUSH_SCOPE: 1, OpCodes.JUMP: 1, OpCodes.JUMP_IF_FALSE: 1,
+    OpCodes.JUMP_IF_FALSE_OR_POP: 1, OpCodes.JUMP_IF_TRUE_OR_POP: 1,
+    OpCodes.JUMP_IF_NOT_NIL_OR_POP: 1,
+    OpCodes.MAKE_FUNCTION: 1, OpCodes.CALL: 1, OpCodes.MEMOIZE: 1,
+    OpCodes.IMPORT: 1
+}
+
+op_names = dict(
+    (value, name) for name, value in vars(OpCodes).items()
+    if not name.startswith('_')
+)
+
+
+class Chunk:
+    """ Compiled code of a single function or script.
+
+    code is a flat list of opcodes each followed by its operands,
+    constants holds literal values, tokens and function prototypes,
+    lines is a run-length line table of (offset, line) pairs, and
+    tokens maps the offset of instructions that can fail at runtime
+    to the token used to report the error. """
+    def __init__(self):
+        self.code = []
+        self.constants = []
+        self.lines = []
+        self.tokens = {}
+
+    def emit(self, line, op, *operands):
+        offset = len(self.code)
+        if line is not None and (not self.lines or self.lines[-1][1] != line):
+            self.lines.append((offset, line))
+        self.code.append(op)
+        self.code.extend(operands)
+        return offset
+
+    def add_constant(self, value):
+        self.constants.append(value)
+        return len(self.constants) - 1
+
+    def line_at(self, offset):
+        line = None
+        for start, start_line in self.lines:
+            if start > offset:
+                break
+            line = start_line
+        return line
+
+    def disassemble(self, name="<script>"):
+        lines = ["== {} ==".format(name)]
+        offset = 0
+        while offset < len(self.code):
+            op = self.code[offset]
+            count = operand_counts.get(op, 0)
+            operands = self.code[offset + 1:offset + 1 + count]
+            text = "{:04d} {:>4} {:<20} {}".format(
+                offset, self.line_at(offset) or "", op_names[op],
+                " ".join(str(o) for o in operands)
+            )
+            if op in (OpCodes.CONSTANT, OpCodes.GET_GLOBAL,
+                      OpCodes.SET_GLOBAL, OpCodes.DEFINE_GLOBAL):
+                constant = self.constants[operands[0]]
+                text += " ({})".format(getattr(constant, 'text', constant))
+            lines.append(text)
+            offset += 1 + count
+        return "\n".join(lines)
+
+
+class FunctionProto:
+    """ Compiled FunDecl, turned into a VMFunction at runtime by
+    MAKE_FUNCTION with the environment it is declared in """
+    def __init__(self, declaration):
+        self.declaration = declaration
+        self.name = declaration.name
+        self.params = declaration.params
+        self.names = declaration.names
+        self.chunk = Chunk()
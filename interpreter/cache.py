@@ -0,0 +1,114 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import zlib
+
+
+# The modules producing the cached trees, a change to any of them
+# invalidates every entry
+FRONTEND_MODULES = ("tokens.py", "scanner.py", "ast.py", "parser.py")
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "lox")
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+SUFFIX = ".loxc"
+
+
+def interpreter_version():
+    digest = hashlib.sha256()
+    here = os.path.dirname(os.path.realpath(__file__))
+    for name in FRONTEND_MODULES:
+        with open(os.path.join(here, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+class ASTCache:
+    """ On-disk cache of parsed programs, keyed by the hash of the
+    source and of the interpreter version. Entries are pickled lists of
+    statements as returned by Parser.parse, before the Optimizer and
+    Resolver change them, compressed with zlib. Once the files in
+    directory add up to more than max_size bytes, the least recently
+    used ones are removed. """
+    def __init__(self, directory=DEFAULT_DIR, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.version = interpreter_version()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, source):
+        digest = hashlib.sha256(self.version.encode())
+        digest.update(source.encode("utf-8", "surrogatepass"))
+        return os.path.join(self.directory, digest.hexdigest() + SUFFIX)
+
+    def get(self, source):
+        path = self.path(source)
+        try:
+            with open(path, "rb") as f:
+                stmts = pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            # Truncated or otherwise unreadable, parse again
+            self.misses += 1
+            self.remove(path)
+            return None
+        # The modification time orders entries for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return stmts
+
+    def put(self, source, stmts):
+        try:
+            data = pickle.dumps(stmts, pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            # Too deeply nested to pickle, leave it uncached
+            return
+        data = zlib.compress(data)
+        os.makedirs(self.directory, exist_ok=True)
+        # Written under a temporary name so readers never see part of it
+        fd, temp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self.path(source))
+        except OSError:
+            self.remove(temp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            self.remove(path)
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith(SUFFIX):
+                    self.remove(os.path.join(self.directory, name))
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,421 @@
+import ast as nodes
+import functools
+import operator
+from data_structures import LoxCallable, MAX_PARAMS, STRING_TYPES, concat, \
+    value_type
+from environment import Frame
+from errors import RuntimeException, locate
+from tokens import Types
+
+
+NUMERIC_TYPES = (float, int)
+
+numeric_ops = {
+    Types.MINUS: operator.sub, Types.STAR: operator.mul,
+    Types.SLASH: operator.truediv, Types.GT: operator.gt,
+    Types.GTE: operator.ge, Types.LT: operator.lt, Types.LTE: operator.le
+}
+
+
+class CompiledFunction(LoxCallable):
+    def __init__(self, declaration, body, closure, memo=None):
+        self.declaration = declaration
+        self.params = declaration.params
+        self.names = declaration.names
+        # Token budget errors are reported at for calls through call(),
+        # the name of the function in its declaration
+        self.name = declaration.name
+        self.body = body
+        self.closure = closure
+        self.memo = memo
+
+    def call(self, interpreter, args):
+        memo = self.memo
+        if memo is not None:
+            key = memo.key(args)
+            value = memo.get(key)
+            if value is not memo.MISSING:
+                return value
+            value = self.run(interpreter, args)
+            memo.put(key, value)
+            return value
+        return self.run(interpreter, args)
+
+    def run(self, interpreter, args):
+        if interpreter.budget is not None:
+            interpreter.budget.call(self.names, self.name)
+        environment = Frame(self.closure, self.names)
+        values = environment.values
+        for i in range(len(self.params)):
+            values[i] = args[i]
+        debug = interpreter.debug
+        if debug is not None:
+            debug.print(environment.sym_table)
+        completion = self.body(environment)
+        if completion is not None:
+            return completion[0]
+
+
+def numeric_error(op):
+    return RuntimeException(op,
+        "{} operator expected numeric operands".format(op.value))
+
+
+class ClosureCompiler:
+    """ Walks resolved statements once and turns every node into a
+    Python closure specialized for that node: operators, slots and
+    constants are bound when the closure is built, so running the
+    program is plain function calls with no per-node dispatch.
+
+    Expression closures take the current environment and return a
+    value. Statement closures take the environment and return None,
+    or a 1-tuple holding the value of a return statement. """
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+
+    def compile(self, stmts):
+        return self.block([self.statement(stmt) for stmt in stmts])
+
+    def expression(self, node):
+        return node.visit(self)
+
+    def statement(self, node):
+        if isinstance(node, nodes.ExprStmt):
+            node = node.expr
+        if isinstance(node, nodes.EXPRESSIONS):
+            # Expression statements complete normally whatever they return
+            expr = self.expression(node)
+
+            def expr_stmt(env):
+                expr(env)
+            return expr_stmt
+        return node.visit(self)
+
+    def block(self, stmts):
+        stmts = tuple(stmts)
+
+        def run_block(env):
+            for stmt in stmts:
+                completion = stmt(env)
+                if completion is not None:
+                    return completion
+        return run_block
+
+    def visitLiteral(self, ast):
+        value = ast.value
+        return lambda env: value
+
+    def visitGrouping(self, ast):
+        return self.expression(ast.expr)
+
+    def visitAssignment(self, ast):
+        expr = self.expression(ast.expr)
+        slot = ast.slot
+        if ast.depth is None:
+            token = ast.var
+            name = token.value
+            env_globals = self.interpreter.globals
+            table = env_globals.sym_table
+
+            def assign_global(env):
+                val = expr(env)
+                if name in table:
+                    table[name] = val
+                else:
+                    env_globals.assign(token, val)
+            return assign_global
+
+        if ast.depth == 0:
+            def assign_local(env):
+                env.values[slot] = expr(env)
+            return assign_local
+
+        depth = ast.depth
+
+        def assign_enclosing(env):
+            env.assign_at(depth, slot, expr(env))
+        return assign_enclosing
+
+    def visitLogical(self, ast):
+        left = self.expression(ast.left)
+        right = self.expression(ast.right)
+        if ast.op.type == Types.LOGIC_OR:
+            def logic_or(env):
+                val = left(env)
+                if val is None or val is False:
+                    return right(env)
+                return val
+            return logic_or
+
+        def logic_and(env):
+            val = left(env)
+            if val is None or val is False:
+                return val
+            return right(env)
+        return logic_and
+
+    def visitBinary(self, ast):
+        left = self.expression(ast.left)
+        right = self.expression(ast.right)
+        op = ast.op
+        numeric = NUMERIC_TYPES
+
+        if op.type == Types.PLUS:
+            strings = STRING_TYPES
+            budget = self.interpreter.budget
+            if budget is None:
+                concat_strings = concat
+            else:
+                concat_strings = functools.partial(budget.concat, where=op)
+
+            def add(env):
+                a = left(env)
+                b = right(env)
+                if type(a) in numeric and type(b) in numeric:
+                    return a + b
+                if type(a) in strings and type(b) in strings:
+                    return concat_strings(a, b)
+                raise RuntimeException(op,
+                    "Unsupported operand type(s) {} and {} for {}".format(
+                        value_type(a), value_type(b), op.text
+                    ))
+            return add
+
+        if op.type == Types.EQUAL_EQUAL:
+            def equal(env):
+                a = left(env)
+                b = right(env)
+                return b is None if a is None else a == b
+            return equal
+
+        if op.type == Types.BANG_EQUAL:
+            def not_equal(env):
+                a = left(env)
+                b = right(env)
+                return b is not None if a is None else not a == b
+            return not_equal
+
+        # The remaining operators only take numbers
+        apply = numeric_ops[op.type]
+
+        def numeric_binary(env):
+            a = left(env)
+            b = right(env)
+            if type(a) not in numeric or type(b) not in numeric:
+                raise numeric_error(op)
+            return apply(a, b)
+        return numeric_binary
+
+    def visitUnary(self, ast):
+        operand = self.expression(ast.operand)
+        op = ast.op
+        if op.type == Types.BANG:
+            def logic_not(env):
+                val = operand(env)
+                return val is None or val is False
+            return logic_not
+
+        numeric = NUMERIC_TYPES
+
+        def negate(env):
+            val = operand(env)
+            if type(val) not in numeric:
+                raise numeric_error(op)
+            return -val
+        return negate
+
+    def visitCall(self, ast):
+        callee = self.expression(ast.callee)
+        args = tuple(self.expression(arg) for arg in ast.args)
+        interpreter = self.interpreter
+        debug = interpreter.debug
+        budget = interpreter.budget
+
+        def call(env):
+            function = callee(env)
+            if type(function) is CompiledFunction and function.memo is None:
+                # Inlined CompiledFunction.call
+                arg_values = [arg(env) for arg in args]
+                if budget is not None:
+                    budget.call(function.names, ast)
+                environment = Frame(function.closure, function.names)
+                values = environment.values
+                for i in range(len(function.params)):
+                    values[i] = arg_values[i]
+                if debug is not None:
+                    debug.print(environment.sym_table)
+                completion = function.body(environment)
+                if completion is not None:
+                    return completion[0]
+                return None
+            if not isinstance(function, LoxCallable):
+                raise Exception("Not a callable")
+            arg_values = [arg(env) for arg in args]
+            try:
+                return function.call(interpreter, arg_values)
+            except RuntimeException as error:
+                raise locate(error, ast)
+        if budget is None:
+            return call
+
+        def call_in_budget(env):
+            try:
+                return call(env)
+            except RecursionError:
+                raise budget.too_deep(ast)
+        return call_in_budget
+
+    def visitVariable(self, ast):
+        slot = ast.slot
+        if ast.depth is None:
+            token = ast.var
+            name = token.value
+            env_globals = self.interpreter.globals
+            table = env_globals.sym_table
+
+            def get_global(env):
+                if name in table:
+                    return table[name]
+                return env_globals.get(token)
+            return get_global
+
+        if ast.depth == 0:
+            return lambda env: env.values[slot]
+
+        if ast.depth == 1:
+            return lambda env: env.enclosing.values[slot]
+
+        depth = ast.depth
+        return lambda env: env.get_at(depth, slot)
+
+    def visitHoisted(self, ast):
+        # The temporary holds nil until the loop first evaluates it
+        get = self.visitVariable(ast)
+        assign = self.visitAssignment(ast)
+
+        def hoisted(env):
+            val = get(env)
+            if val is None:
+                assign(env)
+                val = get(env)
+            return val
+        return hoisted
+
+    def visitPrintStmt(self, ast):
+        expr = self.expression(ast.expr)
+        write = self.interpreter.output.print
+
+        def print_stmt(env):
+            write(expr(env))
+        return print_stmt
+
+    def visitIfStmt(self, ast):
+        cond = self.expression(ast.if_cond)
+        if_branch = self.statement(ast.if_branch)
+        if ast.else_branch is None:
+            def if_stmt(env):
+                val = cond(env)
+                if val is not None and val is not False:
+                    return if_branch(env)
+            return if_stmt
+
+        else_branch = self.statement(ast.else_branch)
+
+        def if_else_stmt(env):
+            val = cond(env)
+            if val is not None and val is not False:
+                return if_branch(env)
+            return else_branch(env)
+        return if_else_stmt
+
+    def visitWhileStmt(self, ast):
+        cond = self.expression(ast.cond)
+        if type(ast.body) is nodes.BlockStmt and ast.body.reuse_frame:
+            return self.loop_in_frame(ast, cond)
+        body = self.statement(ast.body)
+        budget = self.interpreter.budget
+
+        def while_stmt(env):
+            while True:
+                val = cond(env)
+                if val is None or val is False:
+                    return
+                if budget is not None:
+                    budget.step(ast)
+                completion = body(env)
+                if completion is not None:
+                    return completion
+        return while_stmt
+
+    def loop_in_frame(self, ast, cond):
+        # Every iteration of the body runs in the same Frame
+        block = ast.body
+        run_block = self.block(self.statement(stmt) for stmt in block.stmts)
+        names = block.names
+        budget = self.interpreter.budget
+
+        def while_stmt(env):
+            frame = Frame(env, names)
+            while True:
+                val = cond(env)
+                if val is None or val is False:
+                    return
+                if budget is not None:
+                    budget.step(ast)
+                completion = run_block(frame)
+                if completion is not None:
+                    return completion
+        return while_stmt
+
+    def visitBlockStmt(self, ast):
+        run_block = self.block(self.statement(stmt) for stmt in ast.stmts)
+        if not ast.scoped:
+            return run_block
+        names = ast.names
+
+        def block_stmt(env):
+            return run_block(Frame(env, names))
+        return block_stmt
+
+    def visitReturnStmt(self, ast):
+        expr = self.expression(ast.expr)
+        return lambda env: (expr(env),)
+
+    def define(self, slot, token, expr):
+        if slot is None:
+            table = self.interpreter.globals.sym_table
+            name = token.value
+
+            def define_global(env):
+                table[name] = expr(env)
+            return define_global
+
+        def define_local(env):
+            env.values[slot] = expr(env)
+        return define_local
+
+    def visitVarDecl(self, ast):
+        if ast.expr is not None:
+            expr = self.expression(ast.expr)
+        else:
+            expr = lambda env: None
+        return self.define(ast.slot, ast.var, expr)
+
+    def visitImportStmt(self, ast):
+        lox = self.interpreter.lox
+
+        def import_stmt(env):
+            lox.import_module(ast)
+        return import_stmt
+
+    def visitFunDecl(self, ast):
+        body = self.statement(ast.body)
+        decl = ast
+        lox = self.interpreter.lox
+
+        def make_function(env):
+            if len(decl.params) > MAX_PARAMS:
+                raise RuntimeException(decl.params[-1].var,
+                    "Maximum number of parameters exceeded")
+            return CompiledFunction(decl, body, env, lox.memo_cache(decl))
+        return self.define(ast.slot, ast.name, make_function)
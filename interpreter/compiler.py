@@ -0,0 +1,211 @@
+import ast
+from ast import first_line
+from bytecode import OpCodes, Chunk, FunctionProto
+from tokens import Types
+
+
+binary_ops = {
+    Types.PLUS: OpCodes.ADD, Types.MINUS: OpCodes.SUBTRACT,
+    Types.STAR: OpCodes.MULTIPLY, Types.SLASH: OpCodes.DIVIDE,
+    Types.EQUAL_EQUAL: OpCodes.EQUAL, Types.BANG_EQUAL: OpCodes.NOT_EQUAL,
+    Types.GT: OpCodes.GREATER, Types.GTE: OpCodes.GREATER_EQUAL,
+    Types.LT: OpCodes.LESS, Types.LTE: OpCodes.LESS_EQUAL
+}
+
+# Value of a program that ran to its end, rather than to a return
+# statement outside of functions
+END = object()
+
+
+class Compiler:
+    """ Compiles resolved statements into bytecode for the VM. Local
+    variables use the (depth, slot) pairs computed by the Resolver,
+    so the Resolver must run first. """
+    def __init__(self, lox):
+        self.lox = lox
+        self.chunk = None
+        self.line = None
+
+    def compile(self, stmts):
+        self.chunk = Chunk()
+        self.line = None
+        for stmt in stmts:
+            self.statement(stmt)
+        self.emit(OpCodes.CONSTANT, self.chunk.add_constant(END))
+        self.emit(OpCodes.RETURN)
+        return self.chunk
+
+    def emit(self, op, *operands):
+        return self.chunk.emit(self.line, op, *operands)
+
+    def emit_failable(self, token, op, *operands):
+        # Record the token so runtime errors report like the Interpreter
+        self.line = token.line
+        offset = self.emit(op, *operands)
+        self.chunk.tokens[offset] = token
+        return offset
+
+    def emit_jump(self, op):
+        # Returns the position of the operand to patch
+        return self.emit(op, None) + 1
+
+    def patch_jump(self, position):
+        self.chunk.code[position] = len(self.chunk.code)
+
+    def constant(self, value):
+        return self.chunk.add_constant(value)
+
+    def expression(self, node):
+        node.visit(self)
+
+    def statement(self, node):
+        if isinstance(node, ast.Assignment):
+            # Skip pushing the value of the assignment only to pop it
+            self.assign(node)
+        elif isinstance(node, ast.EXPRESSIONS):
+            self.expression(node)
+            self.emit(OpCodes.POP)
+        else:
+            node.visit(self)
+
+    def assign(self, node):
+        self.expression(node.expr)
+        self.store(node)
+
+    def store(self, node):
+        self.line = node.var.line
+        if node.depth is None:
+            self.emit_failable(node.var, OpCodes.SET_GLOBAL,
+                self.constant(node.var))
+        elif node.depth == 0:
+            self.emit(OpCodes.SET_LOCAL, node.slot)
+        else:
+            self.emit(OpCodes.SET_ENCLOSING, node.depth, node.slot)
+
+    def define(self, slot, token):
+        self.line = token.line
+        if slot is None:
+            self.emit(OpCodes.DEFINE_GLOBAL, self.constant(token))
+        else:
+            self.emit(OpCodes.SET_LOCAL, slot)
+
+    def visitLiteral(self, ast):
+        self.emit(OpCodes.CONSTANT, self.constant(ast.value))
+
+    def visitGrouping(self, ast):
+        self.expression(ast.expr)
+
+    def visitAssignment(self, ast):
+        # An assignment evaluates to nil, as in the Interpreter
+        self.assign(ast)
+        self.emit(OpCodes.CONSTANT, self.constant(None))
+
+    def visitLogical(self, ast):
+        self.expression(ast.left)
+        if ast.op.type == Types.LOGIC_OR:
+            end = self.emit_jump(OpCodes.JUMP_IF_TRUE_OR_POP)
+        else:
+            end = self.emit_jump(OpCodes.JUMP_IF_FALSE_OR_POP)
+        self.expression(ast.right)
+        self.patch_jump(end)
+
+    def visitBinary(self, ast):
+        self.expression(ast.left)
+        self.expression(ast.right)
+        self.emit_failable(ast.op, binary_ops[ast.op.type])
+
+    def visitUnary(self, ast):
+        self.expression(ast.operand)
+        if ast.op.type == Types.BANG:
+            self.emit(OpCodes.NOT)
+        else:
+            self.emit_failable(ast.op, OpCodes.NEGATE)
+
+    def visitCall(self, ast):
+        self.expression(ast.callee)
+        for arg in ast.args:
+            self.expression(arg)
+        self.emit(OpCodes.CALL, len(ast.args))
+
+    def visitVariable(self, ast):
+        self.line = ast.var.line
+        if ast.depth is None:
+            self.emit_failable(ast.var, OpCodes.GET_GLOBAL,
+                self.constant(ast.var))
+        elif ast.depth == 0:
+            self.emit(OpCodes.GET_LOCAL, ast.slot)
+        else:
+            self.emit(OpCodes.GET_ENCLOSING, ast.depth, ast.slot)
+
+    def visitHoisted(self, ast):
+        # The temporary holds nil until the loop first evaluates it
+        self.visitVariable(ast)
+        end = self.emit_jump(OpCodes.JUMP_IF_NOT_NIL_OR_POP)
+        self.expression(ast.expr)
+        self.emit(OpCodes.DUP)
+        self.store(ast)
+        self.patch_jump(end)
+
+    def visitExprStmt(self, ast):
+        self.statement(ast.expr)
+
+    def visitPrintStmt(self, ast):
+        self.expression(ast.expr)
+        self.emit(OpCodes.PRINT)
+
+    def visitIfStmt(self, ast):
+        self.expression(ast.if_cond)
+        else_jump = self.emit_jump(OpCodes.JUMP_IF_FALSE)
+        self.statement(ast.if_branch)
+        if ast.else_branch is None:
+            self.patch_jump(else_jump)
+            return
+        end_jump = self.emit_jump(OpCodes.JUMP)
+        self.patch_jump(else_jump)
+        self.statement(ast.else_branch)
+        self.patch_jump(end_jump)
+
+    def visitWhileStmt(self, ast):
+        loop_start = len(self.chunk.code)
+        self.expression(ast.cond)
+        exit_jump = self.emit_jump(OpCodes.JUMP_IF_FALSE)
+        self.statement(ast.body)
+        # Budgets count iterations at this jump, reported at the loop
+        self.line = first_line(ast)
+        self.emit(OpCodes.JUMP, loop_start)
+        self.patch_jump(exit_jump)
+
+    def visitBlockStmt(self, ast):
+        if ast.scoped:
+            self.emit(OpCodes.PUSH_SCOPE, self.constant(ast.names))
+        for stmt in ast.stmts:
+            self.statement(stmt)
+        if ast.scoped:
+            self.emit(OpCodes.POP_SCOPE)
+
+    def visitReturnStmt(self, ast):
+        self.expression(ast.expr)
+        self.emit(OpCodes.RETURN)
+
+    def visitVarDecl(self, ast):
+        if ast.expr is not None:
+            self.expression(ast.expr)
+        else:
+            self.emit(OpCodes.CONSTANT, self.constant(None))
+        self.define(ast.slot, ast.var)
+
+    def visitImportStmt(self, ast):
+        self.emit(OpCodes.IMPORT, self.constant(ast))
+
+    def visitFunDecl(self, ast):
+        proto = FunctionProto(ast)
+        enclosing = self.chunk
+        self.chunk = proto.chunk
+        self.statement(ast.body)
+        # Falling off the end of a function returns nil
+        self.emit(OpCodes.CONSTANT, self.constant(None))
+        self.emit(OpCodes.RETURN)
+        self.chunk = enclosing
+
+        self.emit(OpCodes.MAKE_FUNCTION, self.constant(proto))
+        self.define(ast.slot, ast.name)
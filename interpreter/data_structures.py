@@ -1,5 +1,135 @@
-from environment import Environment
-from errors import ReturnException
+import math
+from collections import OrderedDict
+from environment import Frame
+
+
+MAX_PARAMS = 16
+DEFAULT_MEMO_SIZE = 1024
+# Length from which concatenating two strings makes a Rope rather than
+# copying them into a new str
+ROPE_THRESHOLD = 256
+
+# Returned by Interpreter.execute_block for a return statement calling a
+# LoxFunction, which LoxFunction.call then makes in place of the current
+# call. The function and arguments are left in Interpreter.tail_call.
+TAIL_CALL = object()
+
+
+class MemoStats:
+    """ Hits and misses of the memo caches of one function declaration,
+    shared by the functions made from it """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+
+class MemoCache:
+    """ Results of a pure function by arguments, keeping the max_size
+    most recently used ones """
+    # Returned by get for arguments without a result, which can be nil
+    MISSING = object()
+
+    def __init__(self, max_size, stats):
+        self.max_size = max_size
+        self.results = OrderedDict()
+        self.stats = stats
+
+    def key(self, args):
+        # With the types, as true == 1 and 1 and true hash the same, and
+        # the signs of the zeros, as 0.0 == -0.0
+        key = tuple(args) + tuple(map(type, args))
+        if 0 in args:
+            key += tuple(math.copysign(1.0, arg) for arg in args
+                         if type(arg) is float and arg == 0)
+        return key
+
+    def get(self, key):
+        result = self.results.get(key, self.MISSING)
+        if result is self.MISSING:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+            self.results.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        self.results[key] = result
+        if len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+
+    def disable(self):
+        """ Keeps no more results, for a function that must run on
+        every call from now on """
+        self.results.clear()
+        self.max_size = 0
+
+
+class Rope:
+    """ Lox string made by concatenation, holding its pieces in a list
+    that is only joined when the string is observed: printed, compared
+    or hashed. The joined str is kept and replaces the pieces.
+
+    Ropes made by appending share the list, each knowing how many of its
+    pieces are its own. Appending to the Rope owning the whole list adds
+    to it in place, so building a string in a loop is linear instead of
+    copying the string every time. """
+    __slots__ = ('parts', 'count', 'length')
+
+    def __init__(self, parts, length):
+        self.parts = parts
+        self.count = len(parts)
+        self.length = length
+
+    def __str__(self):
+        if self.count > 1:
+            self.parts = ["".join(self.parts[:self.count])]
+            self.count = 1
+        return self.parts[0]
+
+    def __eq__(self, other):
+        if type(other) is Rope or type(other) is str:
+            return str(self) == str(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        if type(other) is Rope or type(other) is str:
+            return str(self) != str(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return repr(str(self))
+
+
+STRING_TYPES = (str, Rope)
+
+
+def concat(left, right):
+    """ Lox string left + right, both str or Rope """
+    if type(left) is Rope:
+        parts = left.parts
+        if left.count != len(parts):
+            # Another Rope appended to these pieces already
+            parts = [str(left)]
+    elif len(left) + len(right) < ROPE_THRESHOLD and type(right) is str:
+        return left + right
+    else:
+        parts = [left]
+    parts.append(str(right))
+    return Rope(parts, len(left) + len(right))
+
+
+def value_type(value):
+    # Type of a value in error messages, Ropes are strings to Lox
+    if type(value) is Rope:
+        return str
+    return type(value)
+
 
 class LoxCallable:
     def arity(self):
@@ -9,17 +139,45 @@ class LoxCallable:
         pass
 
 class LoxFunction(LoxCallable):
-    def __init__(self, declaration, closure):
+    def __init__(self, declaration, closure, memo=None):
+        self.declaration = declaration
         self.params = declaration.params
         self.body = declaration.body
+        self.names = declaration.names
         self.closure = closure
+        # MemoCache of a pure function, None when its calls always run
+        self.memo = memo
 
     def call(self, interpreter, args):
-        # Create a new environment for the function object
-        # whose parent is the environment in which it was defined
-        environment = Environment(self.closure)
-        for i in range(len(self.params)):
-            environment.define(self.params[i].var, args[i])
-        # Pass this function's environment to the interpreter
-        # Which will set and exit the function's environment after the call
-        return interpreter.execute_block(self.body, environment)
+        memo = self.memo
+        if memo is not None:
+            key = memo.key(args)
+            value = memo.get(key)
+            if value is not memo.MISSING:
+                return value
+            value = self.run(interpreter, args)
+            memo.put(key, value)
+            return value
+        return self.run(interpreter, args)
+
+    def run(self, interpreter, args):
+        function = self
+        budget = interpreter.budget
+        # Tail calls loop here instead of nesting, so tail recursion runs
+        # in constant Python stack depth. They skip the memo of the
+        # function they call, only the value of the first call is kept
+        while True:
+            if budget is not None:
+                budget.call(function.names, function.body)
+            # Create a new environment for the function object
+            # whose parent is the environment in which it was defined
+            environment = Frame(function.closure, function.names)
+            values = environment.values
+            for i in range(len(function.params)):
+                values[i] = args[i]
+            # Pass this function's environment to the interpreter
+            # Which will set and exit the function's environment after the call
+            value = interpreter.execute_block(function.body, environment)
+            if value is not TAIL_CALL:
+                return value
+            function, args = interpreter.tail_call
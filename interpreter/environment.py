@@ -33,3 +33,72 @@ class Environment:
 
     def define(self, var, initial_val=None):
         self.sym_table[var.value] = initial_val
+
+
+class Globals(Environment):
+    """ Environment of the global variables, that loads the modules
+    imported by the program only once a name is not found in it.
+    natives are the names it starts with. """
+    def __init__(self, natives=None):
+        Environment.__init__(self)
+        if natives is not None:
+            self.sym_table.update(natives)
+        # Callables defining the names of each module imported and not
+        # loaded yet, in the order of the imports
+        self.imports = []
+
+    def get(self, var):
+        if var.value in self.sym_table:
+            return self.sym_table[var.value]
+        if self.imports and self.load_imports(var.value):
+            return self.sym_table[var.value]
+        raise RuntimeException(
+            var,
+            "Variable \'{}\' is undefined".format(var.value)
+        )
+
+    def assign(self, var, val):
+        if var.value in self.sym_table or \
+                self.imports and self.load_imports(var.value):
+            self.sym_table[var.value] = val
+            return
+        raise RuntimeException(
+            var,
+            "Variable \'{}\' is undefined".format(var.value)
+        )
+
+    def load_imports(self, name):
+        """ Loads the modules imported last first, as their names win,
+        until one defines name. Returns whether one did. """
+        while self.imports and name not in self.sym_table:
+            self.imports.pop()()
+        return name in self.sym_table
+
+
+class Frame:
+    """ Local scope laid out by the Resolver. Variables live in a
+    fixed-size list and are addressed by (depth, slot) instead of
+    by name, so lookups never probe a dict or recurse. """
+    def __init__(self, env, names):
+        self.enclosing = env
+        self.names = names
+        self.values = [None] * len(names)
+
+    @property
+    def sym_table(self):
+        # Only used for debugging output
+        return dict(zip(self.names, self.values))
+
+    def get_at(self, depth, slot):
+        env = self
+        while depth:
+            env = env.enclosing
+            depth -= 1
+        return env.values[slot]
+
+    def assign_at(self, depth, slot, val):
+        env = self
+        while depth:
+            env = env.enclosing
+            depth -= 1
+        env.values[slot] = val
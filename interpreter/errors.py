@@ -1,6 +1,5 @@
-class ReturnException(Exception):
-    def __init__(self, val):
-        self.value = val
+from ast import first_line
+
 
 class RuntimeException(Exception):
     def __init__(self, token, msg=None):
@@ -9,3 +8,29 @@ class RuntimeException(Exception):
         super(RuntimeException, self).__init__(msg)
         self.token = token
         self.line = token.line
+
+
+class BudgetExceeded(RuntimeException):
+    """ Raised when a program runs out of the steps or memory of its
+    Budget. Loops and calls have no token of their own, only a line. """
+    def __init__(self, line, msg):
+        Exception.__init__(self, msg)
+        self.token = None
+        self.line = line
+
+
+class NativeError(RuntimeException):
+    """ Raised by a native function, which does not know where it is
+    called from. The engine calling it sets the line of the call. """
+    def __init__(self, msg):
+        Exception.__init__(self, msg)
+        self.token = None
+        self.line = None
+
+
+def locate(error, call):
+    """ Sets the line of an error raised in the Call node call, if it
+    has none, as for the errors of natives """
+    if error.line is None:
+        error.line = first_line(call)
+    return error
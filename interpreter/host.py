@@ -0,0 +1,57 @@
+import time
+
+
+# Nodes a program visits before giving the event loop a turn
+DEFAULT_SLICE_STEPS = 1000
+
+
+class TaskStats:
+    """ Steps and timings of one Lox.run_async. A slice is the time the
+    program holds the event loop between two turns given to the others,
+    so max_slice_seconds is the longest it delayed them. """
+    def __init__(self):
+        self.steps = 0
+        self.slices = 0
+        self.run_seconds = 0.0
+        self.max_slice_seconds = 0.0
+        self.started = time.perf_counter()
+        self.finished = None
+        # Start of the current slice, None between slices
+        self.resumed = None
+
+    def resume(self):
+        self.resumed = time.perf_counter()
+
+    def pause(self, steps):
+        if self.resumed is None:
+            return
+        seconds = time.perf_counter() - self.resumed
+        self.resumed = None
+        self.steps = steps
+        self.slices += 1
+        self.run_seconds += seconds
+        if seconds > self.max_slice_seconds:
+            self.max_slice_seconds = seconds
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def wall_seconds(self):
+        end = time.perf_counter() if self.finished is None else self.finished
+        return end - self.started
+
+    @property
+    def waited_seconds(self):
+        # Time spent while other tasks held the loop
+        return self.wall_seconds - self.run_seconds
+
+    def as_dict(self):
+        return {
+            "steps": self.steps,
+            "slices": self.slices,
+            "run_seconds": self.run_seconds,
+            "max_slice_seconds": self.max_slice_seconds,
+            "wall_seconds": self.wall_seconds,
+            "waited_seconds": self.waited_seconds
+        }
@@ -1,18 +1,61 @@
+import ast as nodes
+import functools
+import operator
 from tokens import Types
-from data_structures import LoxCallable, LoxFunction
-from environment import Environment
-from errors import ReturnException, RuntimeException
-
-
-MAX_PARAMS = 16
+from closure_compiler import ClosureCompiler
+from data_structures import LoxCallable, LoxFunction, MAX_PARAMS, TAIL_CALL, \
+    STRING_TYPES, concat, value_type
+from environment import Globals, Frame
+from errors import RuntimeException, locate
+from natives import NATIVES
+
+
+# Completion of a statement that executed a return, whose value is left
+# in Interpreter.return_value. Other statements complete normally.
+RETURN = object()
+
+NUMERIC_TYPES = (float, int)
+
+# Operations of quickened Binary nodes, for two numbers or two strings
+NUMERIC_OPERATIONS = {
+    Types.PLUS: operator.add, Types.MINUS: operator.sub,
+    Types.STAR: operator.mul, Types.SLASH: operator.truediv,
+    Types.GT: operator.gt, Types.GTE: operator.ge,
+    Types.LT: operator.lt, Types.LTE: operator.le,
+    Types.EQUAL_EQUAL: operator.eq, Types.BANG_EQUAL: operator.ne
+}
+STRING_OPERATIONS = {
+    Types.PLUS: concat,
+    Types.EQUAL_EQUAL: operator.eq, Types.BANG_EQUAL: operator.ne
+}
+# Times a Binary or Unary node can fall back to the generic operation
+# before it stops being quickened
+MAX_DEOPTS = 4
 
 
 class Interpreter:
-    def __init__(self, lox):
+    def __init__(self, lox, compiled=False):
         self.lox = lox
-        self.globals = Environment()
+        self.reset_globals()
+        # When set, statements are turned into closures once by the
+        # ClosureCompiler and run directly instead of being visited
+        self.compiled = compiled
+        self.return_value = None
+        self.tail_call = None
+        # Output for print statements, and for the debug dumps or None
+        self.output = lox.output
+        self.debug = lox.debug
+        # Checked where steps are taken and memory allocated, if any
+        self.budget = lox.budget
+
+    def reset_globals(self):
+        self.globals = Globals(NATIVES)
         self.current_env = self.globals
 
+    def functions_installed(self, functions):
+        """ Called with the functions another Lox made that a Snapshot
+        defines in the globals, for tracers """
+
     def evaluate(self, ast):
         return ast.visit(self)
 
@@ -22,26 +65,24 @@ class Interpreter:
     def execute_block(self, stmt, environment):
         prev_env = self.current_env
         self.current_env = environment
-        print(environment.sym_table)
-        # Use ReturnException to unwind the statement call stacks
-        # when a return statement is evaluated. Note that the exception
-        # handling should be done here so that the environment is always
-        # reset after a function exits; if exception handling is done at
-        # a higher level, i.e. at the LoxFunction.call() level, then
-        # exceptions raised will cause execute_block() to never reset
-        # the environment to what it was previously
+        if self.debug is not None:
+            self.debug.print(environment.sym_table)
+        # A return statement completes every statement enclosing it with
+        # RETURN up to here, where the function's value is picked up.
+        # The environment is reset here, even on a runtime error, so
+        # that it is always the caller's after a function exits
         try:
-            return_val = self.execute(stmt)
-        except ReturnException as return_object:
-            return_val = return_object.value
-        self.current_env = prev_env
-        return return_val
+            if self.execute(stmt) is RETURN:
+                return self.return_value
+            return None
+        finally:
+            self.current_env = prev_env
 
     def check_numeric(self, val):
         return type(val) == int or type(val) == float
 
     def check_string(self, val):
-        return type(val) == str
+        return type(val) in STRING_TYPES
 
     def check_numeric_operands(self, op, *operands):
         for o in operands:
@@ -68,9 +109,20 @@ class Interpreter:
         return isinstance(call_val, LoxCallable)
 
     def interpret(self, stmts):
+        # Returns RETURN when a return statement ended the program
         try:
+            if self.compiled:
+                if ClosureCompiler(self).compile(stmts)(self.globals) \
+                        is not None:
+                    return RETURN
+                return
             for ast in stmts:
-                self.execute(ast)
+                if self.execute(ast) is RETURN:
+                    # A return outside of a function ends the program
+                    if self.return_value is TAIL_CALL:
+                        function, args = self.tail_call
+                        function.call(self, args)
+                    return RETURN
         except RuntimeException as error:
             """ Catch runtime exception and leave the
             implementation up to the Lox program. """
@@ -84,7 +136,13 @@ class Interpreter:
 
     def visitAssignment(self, ast):
         val = self.evaluate(ast.expr)
-        self.current_env.assign(ast.var, val)
+        self.assign(ast, val)
+
+    def assign(self, ast, val):
+        if ast.depth is None:
+            self.globals.assign(ast.var, val)
+        else:
+            self.current_env.assign_at(ast.depth, ast.slot, val)
 
     def visitLogical(self, ast):
         # Code for logical and binary expressions differ
@@ -106,7 +164,43 @@ class Interpreter:
         """ For binary expressions """
         left = self.evaluate(ast.left)
         right = self.evaluate(ast.right)
+        return self.binary(ast, left, right)
+
+    def binary(self, ast, left, right):
+        """ Quickened Binary nodes hold in ast.quick the operand types
+        they were specialized for and the operation for those types,
+        guarded here with a type check. A failing guard deoptimizes the
+        node back to the generic operation, until it has done so
+        MAX_DEOPTS times and stays generic. """
+        quick = ast.quick
+        if quick is not None:
+            if type(left) is quick[0] and type(right) is quick[1]:
+                return quick[2](left, right)
+            ast.quick = None
+            ast.deopts += 1
+        elif ast.deopts < MAX_DEOPTS:
+            self.quicken_binary(ast, left, right)
+        return self.generic_binary(ast, left, right)
+
+    def quicken_binary(self, ast, left, right):
+        left_type = type(left)
+        right_type = type(right)
+        if left_type in NUMERIC_TYPES and right_type in NUMERIC_TYPES:
+            operation = NUMERIC_OPERATIONS.get(ast.op.type)
+        elif left_type in STRING_TYPES and right_type in STRING_TYPES:
+            operation = STRING_OPERATIONS.get(ast.op.type)
+            if operation is concat and self.budget is not None:
+                operation = functools.partial(self.budget.concat,
+                                              where=ast.op)
+        else:
+            operation = None
+        if operation is None:
+            # The generic operation raises, or compares nil
+            ast.deopts += 1
+        else:
+            ast.quick = (left_type, right_type, operation)
 
+    def generic_binary(self, ast, left, right):
         if ast.op.type == Types.STAR:
             self.check_numeric_operands(ast.op, left, right)
             return left * right
@@ -124,11 +218,13 @@ class Interpreter:
                 return left + right
 
             if self.check_string(left) and self.check_string(right):
-                return left + right
+                if self.budget is not None:
+                    return self.budget.concat(left, right, ast.op)
+                return concat(left, right)
 
             raise RuntimeException(ast.op,
                 "Unsupported operand type(s) {} and {} for {}".format(
-                    type(left), type(right), ast.op.text
+                    value_type(left), value_type(right), ast.op.text
                 ))
 
         if ast.op.type == Types.BANG_EQUAL:
@@ -154,12 +250,34 @@ class Interpreter:
             return left < right
 
     def visitUnary(self, ast):
+        return self.unary(ast, self.evaluate(ast.operand))
+
+    def unary(self, ast, val):
+        """ Quickened like Binary nodes, for negating a number and
+        negating a boolean """
+        quick = ast.quick
+        if quick is not None:
+            if type(val) is quick[0]:
+                return quick[1](val)
+            ast.quick = None
+            ast.deopts += 1
+        elif ast.deopts < MAX_DEOPTS:
+            self.quicken_unary(ast, val)
+        return self.generic_unary(ast, val)
+
+    def quicken_unary(self, ast, val):
+        if ast.op.type == Types.MINUS and type(val) in NUMERIC_TYPES:
+            ast.quick = (type(val), operator.neg)
+        elif ast.op.type == Types.BANG and type(val) is bool:
+            ast.quick = (bool, operator.not_)
+        else:
+            ast.deopts += 1
+
+    def generic_unary(self, ast, val):
         if ast.op.type == Types.BANG:
-            val = self.evaluate(ast.operand)
             return not self.is_truthy(val)
 
         if ast.op.type == Types.MINUS:
-            val = self.evaluate(ast.operand)
             if self.check_numeric_operands(ast.op, val):
                 return -val
 
@@ -169,10 +287,43 @@ class Interpreter:
             raise Exception("Not a callable")
 
         args = [self.evaluate(arg) for arg in ast.args]
-        return callee.call(self, args)
+        try:
+            return callee.call(self, args)
+        except RuntimeException as error:
+            raise locate(error, ast)
+        except RecursionError:
+            if self.budget is None:
+                raise
+            raise self.budget.too_deep(ast)
+
+    def tail_call_value(self, ast):
+        # Evaluates a call in tail position like visitCall, but leaves a
+        # call to a LoxFunction for LoxFunction.call to make
+        callee = self.evaluate(ast.callee)
+        if not self.is_callable(callee):
+            raise Exception("Not a callable")
+
+        args = [self.evaluate(arg) for arg in ast.args]
+        if type(callee) is not LoxFunction:
+            try:
+                return callee.call(self, args)
+            except RuntimeException as error:
+                raise locate(error, ast)
+        self.tail_call = (callee, args)
+        return TAIL_CALL
 
     def visitVariable(self, ast):
-        return self.current_env.get(ast.var)
+        if ast.depth is None:
+            return self.globals.get(ast.var)
+        return self.current_env.get_at(ast.depth, ast.slot)
+
+    def visitHoisted(self, ast):
+        # The temporary holds nil until the loop first evaluates it
+        val = self.visitVariable(ast)
+        if val is None:
+            val = self.evaluate(ast.expr)
+            self.assign(ast, val)
+        return val
 
     def visitExprStmt(self, ast):
         value = self.evaluate(ast.expr)
@@ -180,7 +331,7 @@ class Interpreter:
 
     def visitPrintStmt(self, ast):
         value = self.evaluate(ast.expr)
-        print(value)
+        self.output.print(value)
 
     def visitIfStmt(self, ast):
         if self.is_truthy(self.evaluate(ast.if_cond)):
@@ -189,36 +340,83 @@ class Interpreter:
             return self.execute(ast.else_branch)
 
     def visitWhileStmt(self, ast):
+        body = ast.body
+        if type(body) is nodes.BlockStmt and body.reuse_frame:
+            return self.loop_in_frame(ast)
+        budget = self.budget
         while self.is_truthy(self.evaluate(ast.cond)):
-            self.execute(ast.body)
+            if budget is not None:
+                budget.step(ast)
+            if self.execute(body) is RETURN:
+                return RETURN
+
+    def loop_in_frame(self, ast):
+        # Runs every iteration of the body in one Frame, which the
+        # Resolver found to be safe
+        enclosing = self.current_env
+        frame = Frame(enclosing, ast.body.names)
+        stmts = ast.body.stmts
+        budget = self.budget
+        while self.is_truthy(self.evaluate(ast.cond)):
+            if budget is not None:
+                budget.step(ast)
+            self.current_env = frame
+            for stmt in stmts:
+                if self.execute(stmt) is RETURN:
+                    self.current_env = enclosing
+                    return RETURN
+            self.current_env = enclosing
 
     def visitBlockStmt(self, ast):
+        if not ast.scoped:
+            for stmt in ast.stmts:
+                if self.execute(stmt) is RETURN:
+                    return RETURN
+            return None
+
         # Initialize a new scope tied to the block
-        self.current_env = Environment(self.current_env)
+        enclosing = self.current_env
+        self.current_env = Frame(enclosing, ast.names)
 
         for stmt in ast.stmts:
-            self.execute(stmt)
+            if self.execute(stmt) is RETURN:
+                self.current_env = enclosing
+                return RETURN
 
-        self.current_env = self.current_env.enclosing
+        self.current_env = enclosing
 
     def visitReturnStmt(self, ast):
-        # Raise an exception through the statement call stack
-        return_value = self.evaluate(ast.expr)
-        raise ReturnException(return_value)
+        # Complete with RETURN through the enclosing statements
+        if type(ast.expr) is nodes.Call:
+            self.return_value = self.tail_call_value(ast.expr)
+        else:
+            self.return_value = self.evaluate(ast.expr)
+        return RETURN
+
+    def define(self, slot, var, val=None):
+        # Declarations outside of any local scope go to the globals
+        if slot is None:
+            self.globals.define(var, val)
+        else:
+            self.current_env.values[slot] = val
 
     def visitVarDecl(self, ast):
         if ast.expr is not None:
-            self.current_env.define(ast.var, self.evaluate(ast.expr))
+            self.define(ast.slot, ast.var, self.evaluate(ast.expr))
             return
-        self.current_env.define(ast.var)
+        self.define(ast.slot, ast.var)
+
+    def visitImportStmt(self, ast):
+        self.lox.import_module(ast)
 
     def visitFunDecl(self, func_decl):
         # Create a LoxFunction object that will be stored
         # Pass the declaration to set its parameters and executable body
         # Pass the current environment to the LoxFunction to enable closure
         if len(func_decl.params) > MAX_PARAMS:
-            last_token = func_decl.params[-1]
+            last_token = func_decl.params[-1].var
             raise RuntimeException(last_token,
                 "Maximum number of parameters exceeded")
-        func = LoxFunction(func_decl, self.current_env)
-        self.current_env.define(func_decl.name, func)
+        func = LoxFunction(func_decl, self.current_env,
+            self.lox.memo_cache(func_decl))
+        self.define(func_decl.slot, func_decl.name, func)
@@ -1,32 +1,247 @@
-from scanner import Scanner
+from scanner import FastScanner, LexicalError
 from parser import Parser
-from interpreter import Interpreter
+from resolver import Resolver
+from purity import Purity
+from optimizer import Optimizer, PASSES
+from interpreter import Interpreter, RETURN
+from stack_interpreter import StackInterpreter
+from vm import VM
+from profiler import Profiler
+from tracing import Metrics, install
+from budget import Budget
+from snapshot import take_snapshot, load_snapshot
+from modules import import_module
+from host import TaskStats, DEFAULT_SLICE_STEPS
+from cache import ASTCache, DEFAULT_DIR, DEFAULT_MAX_SIZE
+from data_structures import MemoCache, MemoStats, DEFAULT_MEMO_SIZE
+from output import Output, FLUSH_POLICIES, FLUSH_BY_SIZE, FLUSH_BY_LINE, \
+    DEFAULT_BUFFER_SIZE
 
+import argparse
+import atexit
+import functools
 import sys
+import weakref
 
 
 LEXICAL_EXIT = 1
 PARSING_EXIT = 2
 RUNTIME_EXIT = 3
+# The globals of a prelude cannot be saved with --save-snapshot
+SNAPSHOT_EXIT = 6
+
+# Lox instances a server keeps, the scripts it runs at once
+DEFAULT_POOL_SIZE = 4
+
+# Characters read at a time when streaming a file, rounded up to a line
+STREAM_CHUNK_SIZE = 1 << 16
+
+ENGINES = {
+    "tree": Interpreter,
+    "closure": functools.partial(Interpreter, compiled=True),
+    "vm": VM,
+    "stack": StackInterpreter
+}
 
 
 class Lox:
-    def __init__(self):
+    def __init__(self, engine="tree", optimize=None, cache=None,
+                 compact_tokens=False, memoize=True,
+                 memo_size=DEFAULT_MEMO_SIZE, output=None, debug=None,
+                 max_steps=None, max_memory=None):
         self.has_lexical_error = False
         self.has_parsing_error = False
         self.has_runtime_error = False
         self.interpreter_mode = True
         self.filename = "stdin"
         self.module = "module"
-        self.scanner = Scanner(self)
+        # Options the Lox of each module imported is created with
+        self.options = {
+            "engine": engine, "optimize": optimize, "cache": cache,
+            "compact_tokens": compact_tokens, "memoize": memoize,
+            "memo_size": memo_size, "max_steps": max_steps,
+            "max_memory": max_memory
+        }
+        self.scanner = FastScanner(self)
         self.parser = Parser(self)
-        self.interpreter = Interpreter(self)
+        self.resolver = Resolver(self)
+        # Output printed to, flushed after every run, and the Output of
+        # the debug dumps of each environment entered, None leaves them
+        # out
+        self.output = Output() if output is None else output
+        self.debug = debug
+        # Budget of every run, None when there are no limits
+        self.budget = None
+        if max_steps is not None or max_memory is not None:
+            self.budget = Budget(max_steps, max_memory)
+        # Names of the Optimizer passes to run, None skips the optimizer
+        self.optimizer = None
+        if optimize is not None:
+            self.optimizer = Optimizer(self, **dict(
+                (name, name in optimize) for name in PASSES
+            ))
+        # Memoizing the calls of pure functions needs the whole program,
+        # run_stream and run_interpreter leave it off
+        self.purity = Purity(self) if memoize else None
+        self.memo_size = memo_size
+        # MemoStats by FunDecl of the memoized functions
+        self.memo_stats = {}
+        # MemoCaches of the functions made so far
+        self.memos = weakref.WeakSet()
+        self.interpreter = ENGINES[engine](self)
+        # ASTCache for parsed programs, None parses every time
+        self.cache = cache
+        # Scan into a TokenArray rather than a list of Token objects
+        self.compact_tokens = compact_tokens
+        # TaskStats of the last run_async
+        self.task_stats = None
+
+    def parse(self, text):
+        if self.cache is not None:
+            stmts = self.cache.get(text)
+            if stmts is not None:
+                return stmts
+        if self.compact_tokens:
+            tokens = self.scanner.tokenize_compact(text)
+        else:
+            tokens = self.scanner.tokenize(text)
+        stmts = self.parser.parse(tokens)
+        if self.cache is not None and not self.has_lexical_error and \
+                not self.has_parsing_error:
+            self.cache.put(text, stmts)
+        return stmts
 
     def run(self, text):
-        tokens = self.scanner.tokenize(text)
-        ast = self.parser.parse(tokens)
-        value = self.interpreter.interpret(ast)
-        print("Expression evaluates to: {}".format(value))
+        if self.budget is not None:
+            self.budget.reset()
+        try:
+            value = self.execute(text)
+            self.output.print("Expression evaluates to: {}".format(value))
+        finally:
+            self.flush()
+
+    def execute(self, text):
+        """ Runs text without printing its value, as modules are """
+        self.interpreter.interpret(self.prepare(text))
+
+    def prepare(self, text):
+        """ The statements of text, parsed and through the passes that
+        run before a whole program does """
+        self.forget_memos()
+        ast = self.parse(text)
+        if self.optimizer is not None:
+            ast = self.optimizer.optimize(ast)
+        self.resolver.resolve(ast)
+        if self.purity is not None:
+            self.purity.analyze(ast)
+        return ast
+
+    async def run_async(self, text, slice_steps=DEFAULT_SLICE_STEPS):
+        """ Like run, but a coroutine for an asyncio event loop, that
+        gives the other tasks a turn after every slice_steps nodes the
+        program visits, so that programs each on their own Lox share the
+        loop fairly. Needs the stack engine, which can stop anywhere in
+        a program. Returns the TaskStats of the run. """
+        if not isinstance(self.interpreter, StackInterpreter):
+            raise ValueError("run_async needs the stack engine")
+        if self.budget is not None:
+            self.budget.reset()
+        self.task_stats = stats = TaskStats()
+        try:
+            value = await self.interpreter.interpret_async(
+                self.prepare(text), slice_steps, stats)
+            self.output.print("Expression evaluates to: {}".format(value))
+        finally:
+            stats.finish()
+            self.flush()
+        return stats
+
+    def run_stream(self, chunks):
+        """ Like run, but takes the source as an iterable of pieces
+        ending at line breaks and executes each top level declaration
+        as soon as it is parsed, so memory use is bounded by the largest
+        declaration rather than by the source. Declarations before a
+        lexical or parsing error have already run when it is reported.
+        """
+        if self.budget is not None:
+            self.budget.reset()
+        self.forget_memos()
+        tokens = self.scanner.tokenize_stream(chunks)
+        value = None
+        try:
+            for stmt in self.parser.parse_stream(tokens):
+                stmts = [stmt]
+                if self.optimizer is not None:
+                    stmts = self.optimizer.optimize(stmts)
+                self.resolver.resolve(stmts)
+                # A return outside of functions ends the program too
+                if self.interpreter.interpret(stmts) is RETURN or \
+                        self.has_runtime_error:
+                    break
+        except LexicalError as error:
+            self.lexical_error(error)
+        finally:
+            self.output.print("Expression evaluates to: {}".format(value))
+            self.flush()
+
+    def reset(self):
+        """ Forgets the errors and globals of earlier runs, so that an
+        unrelated program can run on this Lox """
+        self.has_lexical_error = False
+        self.has_parsing_error = False
+        self.has_runtime_error = False
+        self.memo_stats = {}
+        self.interpreter.reset_globals()
+
+    def import_module(self, stmt):
+        import_module(self, stmt)
+
+    def snapshot(self):
+        """ Snapshot of the globals, to start other sessions from """
+        return take_snapshot(self)
+
+    def exit_code(self):
+        # Exit status of the runs so far, 0 without errors
+        if self.has_lexical_error:
+            return LEXICAL_EXIT
+        if self.has_parsing_error:
+            return PARSING_EXIT
+        if self.has_runtime_error:
+            return RUNTIME_EXIT
+        return 0
+
+    def flush(self):
+        self.output.flush()
+        if self.debug is not None:
+            self.debug.flush()
+
+    def memo_cache(self, declaration):
+        """ MemoCache for a function made from declaration, or None if
+        its calls are not memoized """
+        if not declaration.pure:
+            return None
+        stats = self.memo_stats.get(declaration)
+        if stats is None:
+            stats = self.memo_stats[declaration] = MemoStats()
+        memo = MemoCache(self.memo_size, stats)
+        self.memos.add(memo)
+        return memo
+
+    def forget_memos(self):
+        # Purity only saw the program that declared a function, a later
+        # one run on this Lox can assign the globals it reads
+        for memo in self.memos:
+            memo.disable()
+        self.memos.clear()
+
+    def memo_report(self):
+        lines = ["{:<24}{:>10}{:>10}".format("function", "hits", "misses")]
+        for declaration, stats in self.memo_stats.items():
+            name = "{} (line {})".format(
+                declaration.name.text, declaration.name.line)
+            lines.append("{:<24}{:>10}{:>10}".format(
+                name, stats.hits, stats.misses))
+        return "\n".join(lines)
 
     def is_in_interpreter_mode(self):
         return self.interpreter_mode
@@ -44,42 +259,242 @@ class Lox:
         self.report(error)
 
     def report(self, error):
-        print("File <{}>: line {} in <{}>".format(
+        # Through the Output, to keep errors after what the program
+        # printed before them
+        self.output.print("File <{}>: line {} in <{}>".format(
             self.filename, error.line, self.module
         ))
         if getattr(error, 'token'):
-            print("\"Token {}\"".format(error.token.text))
-        print("{}: {}".format(
+            self.output.print("\"Token {}\"".format(error.token.text))
+        self.output.print("{}: {}".format(
             error.__class__.__name__, error.__str__()
         ))
 
-    def run_file(self, filename):
+    def run_file(self, filename, stream=False):
         self.interpreter_mode = False
         self.filename = filename
         with open(filename, 'r') as f:
-            lines = f.readlines()
-            code = "".join(lines)
-            self.run(code)
-            if self.has_lexical_error:
-                sys.exit(LEXICAL_EXIT)
-
-            if self.has_parsing_error:
-                sys.exit(PARSING_EXIT)
-
-            if self.has_runtime_error:
-                sys.exit(RUNTIME_EXIT)
+            if stream:
+                self.run_stream(read_chunks(f))
+            else:
+                self.run(f.read())
+            code = self.exit_code()
+            if code:
+                sys.exit(code)
 
-    def run_interpreter(self):
+    def run_interpreter(self, snapshot=None):
+        # Start from the globals of snapshot, e.g. those of a prelude
+        if snapshot is not None:
+            snapshot.restore(self)
         self.interpreter_mode = True
+        # A later line can change what a function declared earlier reads
+        self.purity = None
         while True:
             line = raw_input(">>>")
             self.run(line)
 
+def read_chunks(f, size=STREAM_CHUNK_SIZE):
+    # Pieces of about size characters, each completed to a line break
+    while True:
+        chunk = f.read(size)
+        if not chunk:
+            return
+        if not chunk.endswith("\n"):
+            chunk += f.readline()
+        yield chunk
+
+
+def save_snapshot(lox, path):
+    """ Saves the globals of lox to path, after a prelude ran without
+    errors. Returns the exit code. """
+    code = lox.exit_code()
+    if code:
+        return code
+    try:
+        snapshot = lox.snapshot()
+    except ValueError as error:
+        sys.stderr.write("Cannot save a snapshot of <{}>: {}\n".format(
+            lox.filename, error))
+        return SNAPSHOT_EXIT
+    snapshot.save(path)
+    return 0
+
+
+def write_profile(profiler, folded_path=None):
+    sys.stderr.write(profiler.report() + "\n")
+    if folded_path is not None:
+        with open(folded_path, "w") as f:
+            f.write(profiler.folded())
+
+
 if __name__ == '__main__':
-    lox = Lox()
-    if len(sys.argv) > 1:
-        filename = sys.argv[1]
-        print(filename)
-        lox.run_file(filename)
+    arg_parser = argparse.ArgumentParser(description="Lox interpreter")
+    arg_parser.add_argument("filename", nargs="?")
+    arg_parser.add_argument("--engine", choices=sorted(ENGINES),
+        default="tree", help="execution engine: tree-walker, compiled "
+             "closures, bytecode vm or tree-walker keeping its own stack "
+             "for deep nesting")
+    arg_parser.add_argument("-O", "--optimize", action="store_true",
+        help="run the AST optimizer")
+    arg_parser.add_argument("--passes", default=",".join(PASSES),
+        help="comma separated optimizer passes to run (default: {})".format(
+            ",".join(PASSES)))
+    arg_parser.add_argument("--stream", action="store_true",
+        help="execute each top level declaration as soon as it is parsed")
+    arg_parser.add_argument("--compact-tokens", action="store_true",
+        help="hold tokens in parallel arrays instead of Token objects")
+    arg_parser.add_argument("--cache", action="store_true",
+        help="load parsed programs from the on-disk cache")
+    arg_parser.add_argument("--cache-dir", default=DEFAULT_DIR,
+        help="cache directory (default: {})".format(DEFAULT_DIR))
+    arg_parser.add_argument("--cache-size", type=int,
+        default=DEFAULT_MAX_SIZE // (1024 * 1024),
+        help="cache size in MiB before least recently used entries are "
+             "removed (default: %(default)s)")
+    arg_parser.add_argument("--optimizer-stats", action="store_true",
+        help="print how many nodes each optimizer pass removed to stderr")
+    arg_parser.add_argument("--profile", action="store_true",
+        help="print the time spent in each function and the statements "
+             "executed by line to stderr, with the tree engine")
+    arg_parser.add_argument("--profile-output", metavar="FILE",
+        help="with --profile, also write the time of each call stack to "
+             "FILE in the folded format of flamegraph tools")
+    arg_parser.add_argument("--metrics", action="store_true",
+        help="print the nodes visited by type, environments created, "
+             "calls and maximum call depth to stderr, with the tree engine")
+    arg_parser.add_argument("--output", metavar="FILE",
+        help="write what the program prints to FILE instead of stdout")
+    arg_parser.add_argument("--flush", choices=FLUSH_POLICIES,
+        default=FLUSH_BY_SIZE,
+        help="when printed output is written: at exit, once the buffer is "
+             "full or after every line (default: %(default)s)")
+    arg_parser.add_argument("--buffer-size", type=int,
+        default=DEFAULT_BUFFER_SIZE,
+        help="characters of output buffered with --flush size "
+             "(default: %(default)s)")
+    arg_parser.add_argument("--debug", action="store_true",
+        help="print the variables of every environment entered to stderr")
+    arg_parser.add_argument("--batch", metavar="DIR_OR_GLOB",
+        help="run the .lox files of a directory, or the files matching a "
+             "glob, on a pool of worker processes and write a JSON summary")
+    arg_parser.add_argument("--jobs", type=int,
+        help="worker processes for --batch (default: one per CPU)")
+    arg_parser.add_argument("--timeout", type=float,
+        help="seconds each script of --batch can run before it is stopped")
+    arg_parser.add_argument("--summary", default="-", metavar="FILE",
+        help="file the JSON summary of --batch is written to "
+             "(default: stdout)")
+    arg_parser.add_argument("--serve", metavar="SOCKET",
+        help="keep running and answer the scripts sent to the Unix socket "
+             "SOCKET, or framed on stdin with -, with a pool of Lox "
+             "instances")
+    arg_parser.add_argument("--pool", type=int, default=DEFAULT_POOL_SIZE,
+        help="Lox instances of --serve, the scripts run at once "
+             "(default: %(default)s)")
+    arg_parser.add_argument("--snapshot", metavar="FILE",
+        help="start from the globals saved in FILE by --save-snapshot")
+    arg_parser.add_argument("--save-snapshot", metavar="FILE",
+        help="after running the script, save its globals to FILE")
+    arg_parser.add_argument("--max-steps", type=int,
+        help="stop the program with a runtime error after this many loop "
+             "iterations and calls")
+    arg_parser.add_argument("--max-memory", type=int, metavar="BYTES",
+        help="stop the program with a runtime error once the strings and "
+             "call frames it allocated add up to about this many bytes")
+    arg_parser.add_argument("--no-memoize", action="store_true",
+        help="always run calls to pure functions instead of reusing "
+             "their results")
+    arg_parser.add_argument("--memo-size", type=int,
+        default=DEFAULT_MEMO_SIZE,
+        help="results kept per pure function (default: %(default)s)")
+    arg_parser.add_argument("--memo-stats", action="store_true",
+        help="print the memo cache hits and misses of pure functions "
+             "to stderr")
+    args = arg_parser.parse_args()
+
+    optimize = None
+    if args.optimize:
+        optimize = [name for name in args.passes.split(",") if name]
+        for name in optimize:
+            if name not in PASSES:
+                arg_parser.error("unknown optimizer pass {}".format(name))
+
+    if (args.profile or args.metrics) and args.engine != "tree":
+        arg_parser.error("--profile and --metrics only work with "
+                         "--engine tree")
+
+    cache = None
+    if args.cache:
+        cache = ASTCache(args.cache_dir, args.cache_size * 1024 * 1024)
+
+    snapshot = None
+    if args.snapshot is not None:
+        snapshot = load_snapshot(args.snapshot)
+
+    if args.batch is not None:
+        # Imported here as batch imports this module for its workers
+        from batch import find_scripts, run_batch, write_summary
+        summary = run_batch(find_scripts(args.batch), jobs=args.jobs,
+                            timeout=args.timeout, stream=args.stream,
+                            engine=args.engine, optimize=optimize,
+                            cache=cache, compact_tokens=args.compact_tokens,
+                            memoize=not args.no_memoize,
+                            memo_size=args.memo_size,
+                            max_steps=args.max_steps,
+                            max_memory=args.max_memory)
+        write_summary(summary, args.summary)
+        sys.exit(1 if summary["failed"] else 0)
+
+    if args.serve is not None:
+        from server import LoxPool, serve_socket, serve_stdio
+        pool = LoxPool(args.pool, snapshot, engine=args.engine,
+                       optimize=optimize, cache=cache,
+                       compact_tokens=args.compact_tokens,
+                       memoize=not args.no_memoize,
+                       memo_size=args.memo_size, max_steps=args.max_steps,
+                       max_memory=args.max_memory)
+        if args.serve == "-":
+            serve_stdio(pool)
+        else:
+            serve_socket(args.serve, pool)
+        sys.exit(0)
+
+    stream = None
+    if args.output is not None:
+        stream = open(args.output, "w")
+        atexit.register(stream.close)
+    debug = None
+    if args.debug:
+        debug = Output(sys.stderr, FLUSH_BY_LINE)
+
+    lox = Lox(engine=args.engine, optimize=optimize, cache=cache,
+              compact_tokens=args.compact_tokens,
+              memoize=not args.no_memoize, memo_size=args.memo_size,
+              output=Output(stream, args.flush, args.buffer_size),
+              debug=debug, max_steps=args.max_steps,
+              max_memory=args.max_memory)
+    if args.filename is not None:
+        print(args.filename)
+        if args.optimizer_stats and lox.optimizer is not None:
+            atexit.register(
+                lambda: sys.stderr.write(lox.optimizer.report() + "\n"))
+        if args.memo_stats:
+            atexit.register(
+                lambda: sys.stderr.write(lox.memo_report() + "\n"))
+        if args.profile:
+            profiler = Profiler()
+            profiler.install(lox.interpreter)
+            atexit.register(write_profile, profiler, args.profile_output)
+        if args.metrics:
+            metrics = install(lox.interpreter, Metrics())
+            atexit.register(
+                lambda: sys.stderr.write(metrics.report() + "\n"))
+        if snapshot is not None:
+            snapshot.restore(lox)
+        lox.run_file(args.filename, stream=args.stream)
+        if args.save_snapshot is not None:
+            code = save_snapshot(lox, args.save_snapshot)
+            if code:
+                sys.exit(code)
     else:
-        lox.run_interpreter()
+        lox.run_interpreter(snapshot)
@@ -0,0 +1,78 @@
+import functools
+import os
+import threading
+
+from errors import RuntimeException
+from snapshot import take_snapshot, engine_of
+
+
+# Snapshot of the globals of every module run by this process, by path
+# and kind of engine
+MODULES = {}
+# Paths of the modules running, for circular imports
+LOADING = set()
+# Held while running a module, by one thread of a server at a time
+LOCK = threading.RLock()
+
+
+def import_module(lox, stmt):
+    """ Runs an ImportStmt: the module is only loaded once the program
+    uses a name it does not define itself, see Globals """
+    path = module_path(lox, stmt.path.value)
+    lox.interpreter.globals.imports.append(
+        functools.partial(install_module, lox, path, stmt.keyword))
+
+
+def module_path(lox, path):
+    # Relative to the directory of the importing file
+    if lox.filename == "stdin":
+        directory = os.getcwd()
+    else:
+        directory = os.path.dirname(os.path.abspath(lox.filename))
+    return os.path.realpath(os.path.join(directory, path))
+
+
+def install_module(lox, path, keyword):
+    # Names the program defined itself win over those of the module
+    load_module(lox, path, keyword).install(lox, overwrite=False)
+
+
+def load_module(lox, path, keyword):
+    """ Snapshot of the globals of the module at path, which is run on
+    a Lox of its own the first time this process imports it. What it
+    prints goes to the output of lox. """
+    key = (path, engine_of(lox.interpreter))
+    with LOCK:
+        snapshot = MODULES.get(key)
+        if snapshot is not None:
+            return snapshot
+        if path in LOADING:
+            raise RuntimeException(keyword,
+                "Circular import of {}".format(path))
+        try:
+            with open(path, "r") as f:
+                source = f.read()
+        except OSError as error:
+            raise RuntimeException(keyword,
+                "Cannot import {}: {}".format(path, error.strerror))
+
+        module = type(lox)(output=lox.output, debug=lox.debug,
+                           **lox.options)
+        module.interpreter_mode = False
+        module.filename = path
+        LOADING.add(path)
+        try:
+            module.execute(source)
+        finally:
+            LOADING.discard(path)
+        # Its errors are already reported
+        if module.exit_code():
+            raise RuntimeException(keyword,
+                "Errors in module {}".format(path))
+        try:
+            snapshot = take_snapshot(module)
+        except ValueError as error:
+            raise RuntimeException(keyword, "Cannot import {}: {}".format(
+                path, error))
+        MODULES[key] = snapshot
+        return snapshot
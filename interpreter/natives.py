@@ -0,0 +1,169 @@
+import operator
+from array import array
+from itertools import repeat
+
+from data_structures import LoxCallable, STRING_TYPES, value_type
+from errors import NativeError
+
+
+NUMERIC_TYPES = (float, int)
+# Estimated bytes of an item of an array, for budgets
+ITEM_BYTES = 8
+
+
+class LoxArray:
+    """ Array value of Lox. Numbers are kept unboxed in an array('d'),
+    which the bulk natives run over in C, until a value of another type
+    is stored, from when the items are a list. Arrays are the only Lox
+    values changed in place. """
+    __slots__ = ('items',)
+
+    def __init__(self, items):
+        self.items = items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __str__(self):
+        return "[{}]".format(", ".join(str(item) for item in self.items))
+
+    def items_for(self, value):
+        """ The items, made a list first if value is not a number """
+        if type(self.items) is array and type(value) not in NUMERIC_TYPES:
+            self.items = list(self.items)
+        return self.items
+
+
+class NativeFunction(LoxCallable):
+    """ Function of the interpreter callable from Lox, function takes
+    the interpreter and then the arguments """
+    def __init__(self, name, params, function):
+        self.name = name
+        self.params = params
+        self.function = function
+
+    def arity(self):
+        return self.params
+
+    def call(self, interpreter, args):
+        if len(args) != self.params:
+            raise NativeError("{}() takes {} arguments but {} were given"
+                .format(self.name, self.params, len(args)))
+        return self.function(interpreter, *args)
+
+
+def check_array(value, name):
+    if type(value) is not LoxArray:
+        raise NativeError("{}() expects an array, got {}".format(
+            name, value_type(value)))
+    return value
+
+
+def check_numbers(value, name):
+    check_array(value, name)
+    if type(value.items) is not array:
+        raise NativeError("{}() expects an array of numbers".format(name))
+    return value.items
+
+
+def check_number(value, name):
+    if type(value) not in NUMERIC_TYPES:
+        raise NativeError("{}() expects a number, got {}".format(
+            name, value_type(value)))
+    return value
+
+
+def check_index(lox_array, index, name):
+    # Lox numbers are floats, an index must be a whole one in bounds.
+    # The remainder of infinity or nan is nan, which is true
+    check_number(index, name)
+    if index % 1 or not 0 <= index < len(lox_array.items):
+        raise NativeError("Index {} out of bounds for array of length {}"
+            .format(index, len(lox_array.items)))
+    return int(index)
+
+
+def allocate(interpreter, count):
+    if interpreter.budget is not None:
+        interpreter.budget.allocate(ITEM_BYTES * count, None)
+
+
+def native_array(interpreter, size):
+    """ Array of size zeros """
+    check_number(size, "array")
+    if size % 1 or size < 0:
+        raise NativeError("array() expects a size of 0 or more, got {}"
+            .format(size))
+    allocate(interpreter, int(size))
+    return LoxArray(array('d', [0.0]) * int(size))
+
+
+def native_push(interpreter, lox_array, value):
+    check_array(lox_array, "push")
+    allocate(interpreter, 1)
+    lox_array.items_for(value).append(value)
+
+
+def native_get(interpreter, lox_array, index):
+    check_array(lox_array, "get")
+    return lox_array.items[check_index(lox_array, index, "get")]
+
+
+def native_set(interpreter, lox_array, index, value):
+    check_array(lox_array, "set")
+    index = check_index(lox_array, index, "set")
+    lox_array.items_for(value)[index] = value
+
+
+def native_len(interpreter, lox_array):
+    return float(len(check_array(lox_array, "len").items))
+
+
+def native_sum(interpreter, lox_array):
+    return sum(check_numbers(lox_array, "sum"), 0.0)
+
+
+def native_map_add(interpreter, lox_array, value):
+    """ New array of the items of lox_array plus value """
+    items = check_numbers(lox_array, "map_add")
+    check_number(value, "map_add")
+    allocate(interpreter, len(items))
+    return LoxArray(array('d', map(operator.add, items, repeat(value))))
+
+
+def native_dot(interpreter, left, right):
+    left_items = check_numbers(left, "dot")
+    right_items = check_numbers(right, "dot")
+    if len(left_items) != len(right_items):
+        raise NativeError("dot() expects arrays of the same length, got "
+            "{} and {}".format(len(left_items), len(right_items)))
+    return sum(map(operator.mul, left_items, right_items), 0.0)
+
+
+def native_sort(interpreter, lox_array):
+    """ Sorts lox_array in place, its items must all be numbers or all
+    strings """
+    items = check_array(lox_array, "sort").items
+    if type(items) is array:
+        lox_array.items = array('d', sorted(items))
+    elif all(type(item) in STRING_TYPES for item in items):
+        lox_array.items = sorted(items, key=str)
+    elif all(type(item) in NUMERIC_TYPES for item in items):
+        lox_array.items = sorted(items)
+    else:
+        raise NativeError("sort() expects an array of numbers or of "
+                          "strings")
+
+
+# Names every program starts with
+NATIVES = dict((native.name, native) for native in (
+    NativeFunction("array", 1, native_array),
+    NativeFunction("push", 2, native_push),
+    NativeFunction("get", 2, native_get),
+    NativeFunction("set", 3, native_set),
+    NativeFunction("len", 1, native_len),
+    NativeFunction("sum", 1, native_sum),
+    NativeFunction("map_add", 2, native_map_add),
+    NativeFunction("dot", 2, native_dot),
+    NativeFunction("sort", 1, native_sort)
+))
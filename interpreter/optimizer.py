@@ -0,0 +1,280 @@
+import ast
+from data_structures import Rope
+from errors import RuntimeException
+from interpreter import Interpreter
+from tokens import Types, Token
+
+
+PASSES = ("fold_constants", "eliminate_dead_branches", "hoist_invariants")
+
+# Expressions without side effects, provided their operands have none
+PURE_EXPRESSIONS = (
+    ast.Grouping, ast.Logical, ast.Binary, ast.Unary, ast.Literal,
+    ast.Variable
+)
+OPERATORS = (ast.Logical, ast.Binary, ast.Unary)
+
+
+def walk(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node.children())
+
+
+def count_nodes(node):
+    if node is None:
+        return 0
+    return sum(1 for _ in walk(node))
+
+
+def is_truthy(val):
+    return val is not None and val is not False
+
+
+class Optimizer:
+    """ Optional rewriting stage run on the parsed statements before
+    the Resolver. Every pass can be switched off; stats counts the
+    nodes each pass took out of the program, or for hoisting, out of
+    every loop iteration.
+
+    fold_constants evaluates operators on literals at compile time,
+    eliminate_dead_branches drops if/while branches whose condition is
+    a literal, and hoist_invariants caches pure loop expressions whose
+    variables the loop never changes. A hoisted expression is still
+    evaluated where it stands the first time it is reached, so errors
+    happen at the same point, and is read from a temporary after. """
+    def __init__(self, lox, fold_constants=True,
+                 eliminate_dead_branches=True, hoist_invariants=True):
+        self.lox = lox
+        self.fold_constants = fold_constants
+        self.eliminate_dead_branches = eliminate_dead_branches
+        self.hoist_invariants = hoist_invariants
+        self.stats = dict.fromkeys(PASSES, 0)
+        # Evaluates foldable nodes with the interpreter's own semantics
+        self.evaluator = Interpreter(lox)
+        self.temporaries = 0
+
+    def optimize(self, stmts):
+        return self.statements(stmts)
+
+    def report(self):
+        return "\n".join(
+            "{}: {} nodes removed".format(name, self.stats[name])
+            for name in PASSES
+        )
+
+    def expression(self, node):
+        return node.visit(self)
+
+    def statement(self, node, required=False):
+        # Removed statements come back as None, which is fine in a list
+        # of statements but not where a statement is required
+        node = node.visit(self)
+        if node is None and required:
+            return ast.BlockStmt([])
+        return node
+
+    def statements(self, stmts):
+        result = []
+        for stmt in stmts:
+            stmt = self.statement(stmt)
+            if stmt is not None:
+                result.append(stmt)
+        return result
+
+    def fold(self, node, line):
+        # Operators raising at runtime are left for the runtime
+        try:
+            value = self.evaluator.evaluate(node)
+        except (RuntimeException, ArithmeticError):
+            return node
+        self.stats["fold_constants"] += count_nodes(node) - 1
+        if type(value) is Rope:
+            value = str(value)
+        return ast.Literal(Token(str(value), Types.NUMBER, line, value))
+
+    def visitLiteral(self, ast):
+        return ast
+
+    def visitVariable(self, ast):
+        return ast
+
+    def visitHoisted(self, ast):
+        return ast
+
+    def visitGrouping(self, node):
+        node.expr = self.expression(node.expr)
+        if self.fold_constants and isinstance(node.expr, ast.Literal):
+            self.stats["fold_constants"] += 1
+            return node.expr
+        return node
+
+    def visitAssignment(self, ast):
+        ast.expr = self.expression(ast.expr)
+        return ast
+
+    def visitLogical(self, node):
+        node.left = self.expression(node.left)
+        node.right = self.expression(node.right)
+        if not self.fold_constants or not isinstance(node.left, ast.Literal):
+            return node
+        # A literal on the left decides whether the right side is needed
+        if is_truthy(node.left.value) == (node.op.type == Types.LOGIC_OR):
+            self.stats["fold_constants"] += count_nodes(node.right) + 1
+            return node.left
+        self.stats["fold_constants"] += 2
+        return node.right
+
+    def visitBinary(self, node):
+        node.left = self.expression(node.left)
+        node.right = self.expression(node.right)
+        if self.fold_constants and isinstance(node.left, ast.Literal) and \
+                isinstance(node.right, ast.Literal):
+            return self.fold(node, node.op.line)
+        return node
+
+    def visitUnary(self, node):
+        node.operand = self.expression(node.operand)
+        if self.fold_constants and isinstance(node.operand, ast.Literal):
+            return self.fold(node, node.op.line)
+        return node
+
+    def visitCall(self, ast):
+        ast.callee = self.expression(ast.callee)
+        ast.args = [self.expression(arg) for arg in ast.args]
+        return ast
+
+    def visitExprStmt(self, ast):
+        ast.expr = self.expression(ast.expr)
+        return ast
+
+    def visitPrintStmt(self, ast):
+        ast.expr = self.expression(ast.expr)
+        return ast
+
+    def visitReturnStmt(self, ast):
+        ast.expr = self.expression(ast.expr)
+        return ast
+
+    def visitVarDecl(self, ast):
+        if ast.expr is not None:
+            ast.expr = self.expression(ast.expr)
+        return ast
+
+    def visitImportStmt(self, ast):
+        return ast
+
+    def visitFunDecl(self, ast):
+        ast.body = self.statement(ast.body, required=True)
+        return ast
+
+    def visitBlockStmt(self, ast):
+        ast.stmts = self.statements(ast.stmts)
+        return ast
+
+    def visitIfStmt(self, node):
+        node.if_cond = self.expression(node.if_cond)
+        node.if_branch = self.statement(node.if_branch, required=True)
+        if node.else_branch is not None:
+            node.else_branch = self.statement(node.else_branch)
+        if not self.eliminate_dead_branches or \
+                not isinstance(node.if_cond, ast.Literal):
+            return node
+
+        if is_truthy(node.if_cond.value):
+            kept = node.if_branch
+        else:
+            kept = node.else_branch
+        self.stats["eliminate_dead_branches"] += \
+            count_nodes(node) - count_nodes(kept)
+        return kept
+
+    def visitWhileStmt(self, node):
+        node.cond = self.expression(node.cond)
+        node.body = self.statement(node.body, required=True)
+        if self.eliminate_dead_branches and \
+                isinstance(node.cond, ast.Literal) and \
+                not is_truthy(node.cond.value):
+            self.stats["eliminate_dead_branches"] += count_nodes(node)
+            return None
+        if self.hoist_invariants:
+            return self.hoist(node)
+        return node
+
+    def hoist(self, loop):
+        # A declaration as the loop body belongs to the enclosing scope,
+        # so the loop cannot be wrapped in a block for the temporaries
+        if isinstance(loop.body, (ast.VarDecl, ast.FunDecl)):
+            return loop
+
+        assigned = set()
+        for node in walk(loop):
+            if isinstance(node, ast.Call):
+                # The callee could change any variable
+                return loop
+            if isinstance(node, (ast.Assignment, ast.VarDecl)):
+                assigned.add(node.var.value)
+            elif isinstance(node, ast.FunDecl):
+                assigned.add(node.name.value)
+                for param in node.params:
+                    assigned.add(param.var.value)
+
+        temporaries = []
+        self.replace_invariants(loop, assigned, temporaries)
+        if not temporaries:
+            return loop
+        # The temporaries start out nil every time the loop is entered
+        decls = [ast.VarDecl(temporary) for temporary in temporaries]
+        return ast.BlockStmt(decls + [loop])
+
+    def replace_invariants(self, node, assigned, temporaries):
+        # Returns True when node is a pure expression reading only
+        # variables that the loop leaves untouched. Otherwise its
+        # invariant children are replaced with Hoisted nodes
+        if isinstance(node, (ast.FunDecl, ast.Hoisted)):
+            return False
+        if isinstance(node, ast.Variable):
+            return node.var.value not in assigned
+
+        invariant = isinstance(node, PURE_EXPRESSIONS)
+        children = []
+        for field in node.fields:
+            child = getattr(node, field)
+            if isinstance(child, list):
+                for i, item in enumerate(child):
+                    children.append((field, i, item))
+            elif child is not None:
+                children.append((field, None, child))
+        flags = [
+            self.replace_invariants(child, assigned, temporaries)
+            for _, _, child in children
+        ]
+        if invariant and all(flags):
+            return True
+
+        for (field, i, child), flag in zip(children, flags):
+            if not flag or not any(
+                    isinstance(n, OPERATORS) for n in walk(child)):
+                continue
+            hoisted = self.make_hoisted(child, temporaries)
+            if i is None:
+                setattr(node, field, hoisted)
+            else:
+                getattr(node, field)[i] = hoisted
+        return False
+
+    def make_hoisted(self, expr, temporaries):
+        name = "$invariant{}".format(self.temporaries)
+        self.temporaries += 1
+        line = 0
+        for node in walk(expr):
+            token = getattr(node, "op", None) or getattr(node, "var", None)
+            if token is not None:
+                line = token.line
+                break
+        temporary = Token(name, Types.IDENTIFIER, line, name)
+        temporaries.append(temporary)
+        self.stats["hoist_invariants"] += count_nodes(expr)
+        return ast.Hoisted(expr, temporary)
@@ -0,0 +1,63 @@
+import sys
+
+
+# When an Output writes what it holds to its stream
+FLUSH_ON_EXIT = "exit"
+FLUSH_BY_SIZE = "size"
+FLUSH_BY_LINE = "line"
+FLUSH_POLICIES = (FLUSH_ON_EXIT, FLUSH_BY_SIZE, FLUSH_BY_LINE)
+
+# Characters held before a FLUSH_BY_SIZE Output writes them
+DEFAULT_BUFFER_SIZE = 1 << 16
+
+
+class Output:
+    """ Sink for what a Lox program prints. Text is kept in a list and
+    written to the stream in one call when the policy says so:
+    FLUSH_ON_EXIT only when flush() is called, which Lox does after each
+    run, FLUSH_BY_SIZE once buffer_size characters are held and
+    FLUSH_BY_LINE after every write, for interactive use.
+
+    The stream is any file-like object, e.g. an open file or an
+    io.StringIO when embedding. None writes to sys.stdout as it is when
+    flushing, so that redirecting sys.stdout still works. """
+    def __init__(self, stream=None, policy=FLUSH_BY_SIZE,
+                 buffer_size=DEFAULT_BUFFER_SIZE):
+        if policy not in FLUSH_POLICIES:
+            raise ValueError("unknown flush policy {}".format(policy))
+        self.stream = stream
+        self.policy = policy
+        self.parts = []
+        self.size = 0
+        # Characters held before flushing, a single comparison for
+        # every policy
+        if policy == FLUSH_ON_EXIT:
+            self.limit = float("inf")
+        elif policy == FLUSH_BY_LINE:
+            self.limit = 1
+        else:
+            self.limit = buffer_size
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.limit:
+            self.flush()
+
+    def print(self, value):
+        """ Writes value on a line like the print builtin """
+        text = "{}\n".format(value)
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.limit:
+            self.flush()
+
+    def flush(self):
+        stream = self.stream
+        if stream is None:
+            stream = sys.stdout
+        if self.parts:
+            stream.write("".join(self.parts))
+            self.parts = []
+            self.size = 0
+        stream.flush()
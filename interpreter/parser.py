@@ -1,5 +1,29 @@
 import ast
-from tokens import Types
+from scanner import EOF
+from tokens import Types, Token
+
+
+# Kinds of the entries waiting on the stack of Parser.expression
+UNARY, GROUPING, CALL, BINARY, ASSIGN = range(5)
+
+# Binary operators from the loosest to the tightest binding
+PRECEDENCES = (
+    (Types.LOGIC_OR,),
+    (Types.LOGIC_AND,),
+    (Types.EQUAL_EQUAL, Types.BANG_EQUAL),
+    (Types.LTE, Types.GTE, Types.LT, Types.GT),
+    (Types.PLUS, Types.MINUS),
+    (Types.STAR, Types.SLASH)
+)
+binary_precedence = dict(
+    (token_type, precedence)
+    for precedence, token_types in enumerate(PRECEDENCES)
+    for token_type in token_types
+)
+# Operators up to this one build Logical nodes, the others Binary
+LOGIC_AND_PRECEDENCE = binary_precedence[Types.LOGIC_AND]
+
+CALL_PAREN = "Expected \')\' after function call"
 
 
 class ParseError(Exception):
@@ -10,17 +34,73 @@ class ParseError(Exception):
         self.msg = msg
 
 
+class TokenTypes:
+    """ Types of the tokens in a sequence that does not keep them """
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def __getitem__(self, index):
+        return self.tokens[index].type
+
+
+class TokenStream:
+    """ List-like window over an iterator of tokens for parsing a
+    stream. Tokens are pulled from the iterator as the parser indexes
+    past the window, and discard() drops the ones it is done with. An
+    EOF token is added if the iterator ends without one. """
+    def __init__(self, tokens):
+        self.source = iter(tokens)
+        self.window = []
+        # Index of the first token in the window
+        self.start = 0
+        self.done = False
+        self.types = TokenTypes(self)
+
+    def fill(self, index):
+        while not self.done and index >= self.start + len(self.window):
+            token = next(self.source, None)
+            if token is None:
+                self.done = True
+                if not self.window or self.window[-1].type != Types.EOF:
+                    line = self.window[-1].line if self.window else 1
+                    self.window.append(Token(EOF, Types.EOF, line))
+            else:
+                self.window.append(token)
+
+    def __getitem__(self, index):
+        if index < 0:
+            # Only the parser's final tokens are ever indexed this way
+            while not self.done:
+                self.fill(self.start + len(self.window))
+            return self.window[index]
+        self.fill(index)
+        return self.window[index - self.start]
+
+    def discard(self, index):
+        del self.window[:index - self.start]
+        self.start = index
+
+
 class Parser:
     def __init__(self, lox):
         self.lox = lox
         self.pos = 0
         self.statements = []
 
+    def set_tokens(self, tokens):
+        # Tokens are only created when the parser keeps them, the type
+        # checks read the types of a TokenArray or TokenStream directly
+        self.tokens = tokens
+        self.types = getattr(tokens, "types", None)
+        if self.types is None:
+            self.types = [token.type for token in tokens]
+        self.pos = 0
+        self.statements = []
+
     def advance(self):
         if not self.is_at_end():
-            token = self.tokens[self.pos]
             self.pos += 1
-            return token
+            return self.tokens[self.pos - 1]
 
     def peek(self):
         return self.tokens[self.pos + 1]
@@ -34,15 +114,21 @@ class Parser:
         return self.tokens[self.pos - 1]
 
     def is_at_end(self):
-        return self.tokens[self.pos].type == Types.EOF
+        return self.types[self.pos] == Types.EOF
+
+    def current_type(self):
+        if self.is_at_end():
+            return self.types[-1]
+        return self.types[self.pos]
 
     def check(self, *token_types):
         # Matching without advancing for looping
-        return self.current().type in token_types
+        return self.current_type() in token_types
 
     def match(self, *token_types):
-        if self.current().type in token_types:
-            self.advance()
+        if self.current_type() in token_types:
+            if not self.is_at_end():
+                self.pos += 1
             return True
         return False
 
@@ -58,98 +144,91 @@ class Parser:
     def error(self, token, msg):
         return ParseError(token, msg)
 
-    def multi_pattern(self, prec_rule, ast_type, *valid_token_types):
-        """ Helper method for building 0 or more left deep  """
-        prec_func = getattr(self, prec_rule)
-        left = prec_func()
-        while self.match(*valid_token_types):
-            op = self.previous()
-            left = ast_type(left, op,
-                prec_func())
-
-        return left
-
     def expression(self):
-        return self.assignment()
-
-    def assignment(self):
-        # let the var evaluate to an assignable value
-        var = self.logic_or()
-
-        if self.match(Types.EQUAL):
-            # for error purposes
-            equals = self.previous()
-            # right hand could be another assignment expr
-            expr = self.expression()
-            if self.is_valid_lvalue(var):
-                var_token = var.var
-                return ast.Assignment(var_token, expr)
-
-            raise self.error(equals, "Invalid assignment target")
-
-        return var
-
-    def logic_or(self):
-        return self.multi_pattern(
-            "logic_and",
-            ast.Logical,
-            Types.LOGIC_OR)
-
-    def logic_and(self):
-        return self.multi_pattern(
-            "equality",
-            ast.Logical,
-            Types.LOGIC_AND
-        )
-
-    def equality(self):
-        return self.multi_pattern(
-            "comparison",
-            ast.Binary,
-            Types.EQUAL_EQUAL,
-            Types.BANG_EQUAL
-        )
-
-    def comparison(self):
-        return self.multi_pattern(
-            "addition",
-            ast.Binary,
-            Types.LTE,
-            Types.GTE,
-            Types.LT,
-            Types.GT
-        )
-
-    def addition(self):
-        return self.multi_pattern(
-            "multiplication",
-            ast.Binary,
-            Types.PLUS,
-            Types.MINUS
-        )
-
-    def multiplication(self):
-        return self.multi_pattern(
-            "unary",
-            ast.Binary,
-            Types.STAR,
-            Types.SLASH
-        )
-
-    def unary(self):
-        if self.match(Types.MINUS, Types.BANG):
-            op = self.previous()
-            operand = self.unary()
-            return ast.Unary(op, operand)
-        return self.call()
-
-    def call(self):
-        callee = self.primary()
-        while self.match(Types.LPAREN):
-            args = self.arguments()
-            callee = ast.Call(callee, args)
-            self.consume(Types.RPAREN, "Expected \')\' after function call")
-        return callee
+        """ Parses an expression of the grammar
+
+            expression     -> assignment
+            assignment     -> logic_or ( "=" assignment )?
+            logic_or       -> logic_and ( "||" logic_and )*
+            logic_and      -> equality ( "&&" equality )*
+            equality       -> comparison ( ( "==" | "!=" ) comparison )*
+            comparison     -> addition ( ( "<=" | ">=" | "<" | ">" ) addition )*
+            addition       -> multiplication ( ( "+" | "-" ) multiplication )*
+            multiplication -> unary ( ( "*" | "/" ) unary )*
+            unary          -> ( "-" | "!" ) unary | call
+            call           -> primary ( "(" arguments? ")" )*
+            primary        -> "(" expression ")" | literal | IDENTIFIER
+
+        without recursing. Operators, and the parentheses, calls and
+        assignments waiting for an inner expression, are kept on a list
+        until their operands are parsed, so the nesting depth is only
+        limited by memory. The trees and errors are the same as those
+        of the recursive descent the grammar reads as. """
+        stack = []
+        while True:
+            # Start of an operand
+            while self.match(Types.MINUS, Types.BANG):
+                stack.append((UNARY, self.previous()))
+            if self.match(Types.LPAREN):
+                stack.append((GROUPING,))
+                continue
+            node = self.primary()
+
+            while True:
+                # node is a complete primary
+                if self.match(Types.LPAREN):
+                    if not self.check(Types.RPAREN):
+                        stack.append((CALL, node, []))
+                        break
+                    node = ast.Call(node, [])
+                    self.consume(Types.RPAREN, CALL_PAREN)
+                    continue
+                while stack and stack[-1][0] == UNARY:
+                    node = ast.Unary(stack.pop()[1], node)
+
+                precedence = binary_precedence.get(self.current_type())
+                if precedence is not None:
+                    # Operators of the same or a higher precedence to the
+                    # left take node as their right operand
+                    while stack and stack[-1][0] == BINARY and \
+                            stack[-1][3] >= precedence:
+                        node = self.binary(stack.pop(), node)
+                    stack.append((BINARY, node, self.advance(), precedence))
+                    break
+                while stack and stack[-1][0] == BINARY:
+                    node = self.binary(stack.pop(), node)
+
+                if self.match(Types.EQUAL):
+                    stack.append((ASSIGN, node, self.previous()))
+                    break
+                # End of an expression
+                while stack and stack[-1][0] == ASSIGN:
+                    _, var, equals = stack.pop()
+                    if not self.is_valid_lvalue(var):
+                        raise self.error(equals, "Invalid assignment target")
+                    node = ast.Assignment(var.var, node)
+
+                if not stack:
+                    return node
+                if stack[-1][0] == GROUPING:
+                    stack.pop()
+                    self.consume(Types.RPAREN, "Expected closing parenthesis )")
+                    node = ast.Grouping(node)
+                    continue
+                # An argument
+                _, callee, args = stack[-1]
+                args.append(node)
+                if self.match(Types.COMMA):
+                    break
+                stack.pop()
+                node = ast.Call(callee, args)
+                self.consume(Types.RPAREN, CALL_PAREN)
+
+    def binary(self, pending, right):
+        _, left, op, precedence = pending
+        if precedence <= LOGIC_AND_PRECEDENCE:
+            return ast.Logical(left, op, right)
+        return ast.Binary(left, op, right)
 
     def arguments(self):
         # Parsing function arguments
@@ -162,12 +241,14 @@ class Parser:
         return args
 
     def primary(self):
-        if self.match(Types.LPAREN):
-            expr = self.expression()
-            self.consume(Types.RPAREN, "Expected closing parenthesis )")
-            return ast.Grouping(expr)
+        # Parenthesized expressions are handled by expression()
         if self.match(Types.NUMBER, Types.STRING, Types.NIL):
             return ast.Literal(self.previous())
+        if self.match(Types.TRUE, Types.FALSE):
+            # Keyword tokens carry no value, so build the boolean here
+            token = self.previous()
+            return ast.Literal(Token(token.text, token.type, token.line,
+                token.type == Types.TRUE))
         if self.match(Types.IDENTIFIER):
             return ast.Variable(self.previous())
 
@@ -280,6 +361,8 @@ class Parser:
             return self.var_declaration()
         if self.match(Types.FUN):
             return self.fun_declaration("function")
+        if self.match(Types.IMPORT):
+            return self.import_declaration()
         return self.statement()
 
     def var_declaration(self):
@@ -303,13 +386,32 @@ class Parser:
         body = self.statement()
         return ast.FunDecl(name, params, body)
 
+    def import_declaration(self):
+        keyword = self.previous()
+        self.consume(Types.STRING, "Expected module path after \'import\'")
+        path = self.previous()
+        self.consume(Types.SEMICOLON, "Expected semicolon")
+        return ast.ImportStmt(keyword, path)
+
     def parse(self, tokens):
-        self.tokens = tokens
-        self.pos = 0
-        self.statements = []
+        self.set_tokens(tokens)
         try:
             while not self.is_at_end():
                 self.statements.append(self.declaration())
         except ParseError as error:
             self.lox.parsing_error(error)
         return self.statements
+
+    def parse_stream(self, tokens):
+        """ Generator version of parse, taking any iterable of tokens
+        and yielding each top level declaration as soon as it is parsed.
+        Only the tokens of the current declaration are kept. """
+        self.set_tokens(TokenStream(tokens))
+        try:
+            while not self.is_at_end():
+                stmt = self.declaration()
+                # Keep the previous token, errors may point at it
+                self.tokens.discard(self.pos - 1)
+                yield stmt
+        except ParseError as error:
+            self.lox.parsing_error(error)
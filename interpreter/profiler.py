@@ -0,0 +1,137 @@
+import collections
+import time
+
+import tracing
+from ast import first_line
+
+
+# Interpreter visits of statements, counted by line
+STATEMENT_VISITS = (
+    "visitExprStmt", "visitPrintStmt", "visitIfStmt", "visitWhileStmt",
+    "visitBlockStmt", "visitReturnStmt", "visitVarDecl", "visitFunDecl"
+)
+SCRIPT = "<script>"
+
+
+class FunctionProfile:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        # Seconds in calls, with and without the functions they call
+        self.inclusive = 0.0
+        self.exclusive = 0.0
+        # Calls currently running, recursive calls only count once
+        # towards inclusive time
+        self.active = 0
+
+
+class Profiler(tracing.Tracer):
+    """ Tracer recording the calls, inclusive and exclusive time of
+    every Lox function run by an Interpreter, the time of each distinct
+    call stack, and how many statements were executed on each line. """
+    visits = STATEMENT_VISITS
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.functions = {}
+        self.lines = collections.Counter()
+        # Call stacks are numbered by (caller's stack, name of the
+        # function), and stack_names holds that pair by number
+        self.stack_numbers = {}
+        self.stack_names = []
+        # Exclusive seconds by call stack number
+        self.stacks = collections.defaultdict(float)
+        # Running calls as [profile, stack, start, seconds in callees]
+        self.frames = []
+        # FunDecl -> name in the report
+        self.names = {}
+        self.statement_lines = {}
+
+    def install(self, interpreter):
+        # The whole program is timed as a call too
+        interpret = interpreter.interpret
+
+        def interpret_profiled(stmts):
+            self.enter(None, SCRIPT)
+            try:
+                return interpret(stmts)
+            finally:
+                self.exit()
+        interpreter.interpret = interpret_profiled
+        return tracing.install(interpreter, self)
+
+    def enter(self, key, name):
+        profile = self.functions.get(key)
+        if profile is None:
+            profile = self.functions[key] = FunctionProfile(name)
+        profile.calls += 1
+        profile.active += 1
+        key = (self.frames[-1][1] if self.frames else None, name)
+        stack = self.stack_numbers.get(key)
+        if stack is None:
+            stack = self.stack_numbers[key] = len(self.stack_names)
+            self.stack_names.append(key)
+        self.frames.append([profile, stack, self.clock(), 0.0])
+
+    def exit(self):
+        profile, stack, start, callees = self.frames.pop()
+        elapsed = self.clock() - start
+        profile.active -= 1
+        if not profile.active:
+            profile.inclusive += elapsed
+        profile.exclusive += elapsed - callees
+        self.stacks[stack] += elapsed - callees
+        if self.frames:
+            self.frames[-1][3] += elapsed
+
+    def enter_call(self, declaration, environment):
+        name = self.names.get(declaration)
+        if name is None:
+            name = self.names[declaration] = "{}:{}".format(
+                declaration.name.text, declaration.name.line)
+        self.enter(declaration, name)
+
+    def exit_call(self, declaration):
+        self.exit()
+
+    def visit(self, node):
+        try:
+            line = self.statement_lines[node]
+        except KeyError:
+            line = self.statement_lines[node] = first_line(node)
+        self.lines[line] += 1
+
+    def report(self, limit=20):
+        """ Functions by exclusive time and the lines executing the
+        most statements, as text """
+        lines = ["{:<28}{:>10}{:>16}{:>16}".format(
+            "function", "calls", "inclusive ms", "exclusive ms")]
+        profiles = sorted(self.functions.values(),
+                          key=lambda profile: profile.exclusive, reverse=True)
+        for profile in profiles[:limit]:
+            lines.append("{:<28}{:>10}{:>16.3f}{:>16.3f}".format(
+                profile.name, profile.calls, profile.inclusive * 1000,
+                profile.exclusive * 1000))
+        lines.append("")
+        lines.append("{:<10}{:>12}".format("line", "statements"))
+        for line, count in self.lines.most_common(limit):
+            # Statements without any token, like an empty block
+            if line is None:
+                line = "?"
+            lines.append("{:<10}{:>12}".format(line, count))
+        return "\n".join(lines)
+
+    def folded(self):
+        """ Exclusive time of every call stack in microseconds, one
+        stack per line as "outer;inner count", the folded format read
+        by flamegraph.pl, inferno and speedscope """
+        folded = []
+        for stack, seconds in self.stacks.items():
+            names = []
+            while stack is not None:
+                stack, name = self.stack_names[stack]
+                names.append(name)
+            folded.append("{} {}\n".format(
+                ";".join(reversed(names)), int(round(seconds * 1e6))))
+        return "".join(sorted(folded))
+
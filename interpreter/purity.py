@@ -0,0 +1,180 @@
+import ast as nodes
+
+
+class FunctionInfo:
+    """ What the body of one FunDecl does outside of its own scopes """
+    def __init__(self, declaration, scope_depth):
+        self.declaration = declaration
+        # Index in Purity.scopes of the function's own frame
+        self.scope_depth = scope_depth
+        self.impure = False
+        # Bindings read, and the subset called, from enclosing scopes
+        self.reads = set()
+        self.calls = set()
+
+
+class Purity:
+    """ Static pass run after the Resolver on a whole program, setting
+    FunDecl.pure on the functions whose calls can be memoized.
+
+    A function is pure when its body prints nothing, declares no
+    functions, assigns only its own variables and calls only pure
+    functions. The variables it reads from enclosing scopes must be
+    bound once and never assigned, and for locals bound before it is
+    declared, so every call with the same arguments sees the same
+    values. A binding is a global name, or the id of the names of a
+    frame and a slot in it. """
+    def __init__(self, lox):
+        self.lox = lox
+
+    def analyze(self, stmts):
+        # Names lists of the frames enclosing the current node
+        self.scopes = []
+        self.functions = []
+        # Binding -> FunDecl binding it, for the pure function check
+        self.declarations = {}
+        # Binding -> number of times it is bound
+        self.bound = {}
+        # Binding or FunDecl -> position in the program, for locals
+        # read by a function before they are bound
+        self.order = {}
+        self.assigned = set()
+        self.function = None
+        self.statements(stmts)
+
+        pure = set()
+        for info in self.functions:
+            if not info.impure and all(
+                    self.is_constant(binding, info)
+                    for binding in info.reads):
+                pure.add(info.declaration)
+        # Drop the functions calling something not pure until none do,
+        # so that recursive functions can be pure
+        changed = True
+        while changed:
+            changed = False
+            for info in self.functions:
+                if info.declaration in pure and not all(
+                        self.declarations.get(binding) in pure
+                        for binding in info.calls):
+                    pure.discard(info.declaration)
+                    changed = True
+        for info in self.functions:
+            info.declaration.pure = info.declaration in pure
+        return stmts
+
+    def is_constant(self, binding, info):
+        if binding in self.assigned or self.bound.get(binding) != 1:
+            return False
+        # Reading a global before it is defined is an error, but a local
+        # frame slot reads nil until its declaration runs
+        return isinstance(binding, str) or \
+            self.order[binding] < self.order[info.declaration]
+
+    def binding(self, token, depth, slot):
+        # depth counts frames up from the innermost one, None is global
+        if depth is None:
+            return token.value
+        return (id(self.scopes[-1 - depth]), slot)
+
+    def bind(self, token, slot, in_list):
+        # Declares token in the innermost frame, or as a global
+        binding = self.binding(token, None if slot is None else 0, slot)
+        self.bound[binding] = self.bound.get(binding, 0) + 1
+        self.order[binding] = len(self.order)
+        if not in_list:
+            # Declared by the body of an if or while, which can run
+            # any number of times in the same frame
+            self.assigned.add(binding)
+        return binding
+
+    def is_own(self, depth):
+        # Whether a variable at depth is in a frame of the function
+        return depth is not None and \
+            len(self.scopes) - 1 - depth >= self.function.scope_depth
+
+    def statements(self, stmts):
+        for stmt in stmts:
+            self.statement(stmt, True)
+
+    def statement(self, node, in_list=False):
+        if isinstance(node, nodes.EXPRESSIONS):
+            self.expression(node)
+        elif isinstance(node, nodes.ExprStmt):
+            self.expression(node.expr)
+        elif isinstance(node, nodes.PrintStmt):
+            if self.function is not None:
+                self.function.impure = True
+            self.expression(node.expr)
+        elif isinstance(node, nodes.ReturnStmt):
+            self.expression(node.expr)
+        elif isinstance(node, nodes.IfStmt):
+            self.expression(node.if_cond)
+            self.statement(node.if_branch)
+            if node.else_branch is not None:
+                self.statement(node.else_branch)
+        elif isinstance(node, nodes.WhileStmt):
+            self.expression(node.cond)
+            self.statement(node.body)
+        elif isinstance(node, nodes.BlockStmt):
+            if not node.scoped:
+                # Declares nothing, the statements run in the enclosing
+                # Frame
+                self.statements(node.stmts)
+                return
+            self.scopes.append(node.names)
+            self.statements(node.stmts)
+            self.scopes.pop()
+        elif isinstance(node, nodes.VarDecl):
+            if node.expr is not None:
+                self.expression(node.expr)
+            self.bind(node.var, node.slot, in_list)
+        elif isinstance(node, nodes.FunDecl):
+            self.fun_declaration(node, in_list)
+
+    def fun_declaration(self, node, in_list):
+        node.pure = False
+        if self.function is not None:
+            self.function.impure = True
+        binding = self.bind(node.name, node.slot, in_list)
+        self.declarations[binding] = node
+        self.order[node] = len(self.order)
+
+        enclosing = self.function
+        self.scopes.append(node.names)
+        self.function = FunctionInfo(node, len(self.scopes) - 1)
+        self.functions.append(self.function)
+        for slot, param in enumerate(node.params):
+            self.bind(param.var, slot, True)
+        self.statement(node.body)
+        self.scopes.pop()
+        self.function = enclosing
+
+    def expression(self, node):
+        # Walked with a list like in the Resolver, expressions can be
+        # nested deeper than the Python stack
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, (nodes.Assignment, nodes.Hoisted)):
+                if self.function is not None and \
+                        not self.is_own(node.depth):
+                    self.function.impure = True
+                self.assigned.add(
+                    self.binding(node.var, node.depth, node.slot))
+            elif isinstance(node, nodes.Variable):
+                if self.function is not None and \
+                        not self.is_own(node.depth):
+                    self.function.reads.add(
+                        self.binding(node.var, node.depth, node.slot))
+            elif isinstance(node, nodes.Call) and self.function is not None:
+                callee = node.callee
+                if isinstance(callee, nodes.Variable) and \
+                        not self.is_own(callee.depth):
+                    self.function.calls.add(
+                        self.binding(callee.var, callee.depth, callee.slot))
+                else:
+                    # Calls through a parameter or an expression could
+                    # be to anything
+                    self.function.impure = True
+            stack.extend(node.children())
@@ -0,0 +1,130 @@
+import ast as nodes
+
+
+class Resolver:
+    """ Static pass run between parsing and interpreting. It binds
+    every local variable reference to the (depth, slot) of the frame
+    declaring it; depth counts the frames to walk up from the current
+    one. Names not found in any local scope are left as globals. """
+    def __init__(self, lox):
+        self.lox = lox
+        # Stack of (name -> slot, names by slot) pairs, one per frame
+        self.scopes = []
+        # FunDecls resolved so far, to find the blocks containing one
+        self.functions = 0
+
+    def resolve(self, stmts):
+        self.scopes = []
+        for stmt in stmts:
+            self.resolve_node(stmt)
+        return stmts
+
+    def resolve_node(self, node):
+        if isinstance(node, nodes.EXPRESSIONS):
+            self.resolve_expression(node)
+        elif node is not None:
+            node.visit(self)
+
+    def resolve_expression(self, node):
+        # Expressions declare nothing, only the references in them are
+        # looked up, so they are walked with a list instead of recursing
+        # and can be nested as deeply as memory allows
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, (nodes.Variable, nodes.Assignment,
+                                 nodes.Hoisted)):
+                self.lookup(node)
+            stack.extend(node.children())
+
+    def begin_scope(self, names):
+        self.scopes.append(({}, names))
+
+    def end_scope(self):
+        self.scopes.pop()
+
+    def declare(self, token, new_slot=False):
+        # Returns the slot for the name in the innermost scope, or None
+        # at global scope. Redeclaring a name reuses its slot, the same
+        # way define() used to overwrite the key in the symbol table
+        if not self.scopes:
+            return None
+        slots, names = self.scopes[-1]
+        if token.value in slots and not new_slot:
+            return slots[token.value]
+        slot = len(names)
+        names.append(token.value)
+        slots[token.value] = slot
+        return slot
+
+    def lookup(self, node):
+        depth = 0
+        for slots, _ in reversed(self.scopes):
+            if node.var.value in slots:
+                node.depth = depth
+                node.slot = slots[node.var.value]
+                return
+            depth += 1
+        node.depth = None
+        node.slot = None
+
+    def visitExprStmt(self, ast):
+        self.resolve_node(ast.expr)
+
+    def visitPrintStmt(self, ast):
+        self.resolve_node(ast.expr)
+
+    def visitIfStmt(self, ast):
+        self.resolve_node(ast.if_cond)
+        self.resolve_node(ast.if_branch)
+        self.resolve_node(ast.else_branch)
+
+    def visitWhileStmt(self, ast):
+        self.resolve_node(ast.cond)
+        self.resolve_node(ast.body)
+
+    def visitBlockStmt(self, ast):
+        # Blocks declaring nothing run in the enclosing Frame. The branch
+        # of an if or body of a while is a statement, not a declaration,
+        # so only the statements of the block itself can declare
+        declares = any(isinstance(stmt, (nodes.VarDecl, nodes.FunDecl))
+                       for stmt in ast.stmts)
+        ast.names = []
+        ast.scoped = declares
+        functions = self.functions
+        if declares:
+            self.begin_scope(ast.names)
+        for stmt in ast.stmts:
+            self.resolve_node(stmt)
+        if declares:
+            self.end_scope()
+        # The Frame of a loop body can be kept from one iteration to the
+        # next when no function can capture it: the statements of each
+        # iteration declare its variables again before reading them
+        ast.reuse_frame = declares and self.functions == functions
+
+    def visitReturnStmt(self, ast):
+        self.resolve_node(ast.expr)
+
+    def visitVarDecl(self, ast):
+        # Resolve the initializer first so that `var a = a;` still
+        # reads the enclosing a, as it did with dynamic lookups
+        self.resolve_node(ast.expr)
+        ast.slot = self.declare(ast.var)
+
+    def visitImportStmt(self, ast):
+        pass
+
+    def visitFunDecl(self, ast):
+        # Declare the name before the body so the function can recurse
+        ast.slot = self.declare(ast.name)
+        self.functions += 1
+        ast.names = []
+        self.begin_scope(ast.names)
+        for param in ast.params:
+            # Every parameter gets its own slot so that arguments can
+            # be copied into the call frame by position
+            self.declare(param.var, new_slot=True)
+        self.resolve_node(ast.body)
+        self.end_scope()
+
@@ -1,8 +1,42 @@
-from tokens import Types, Token, single_char_types, \
+import re
+from tokens import Types, Token, TokenArray, single_char_types, \
                    one_two_char_types, reserved_kw_types
 
 EOF = '\0'
 
+# The ASCII characters str.isspace() accepts
+SPACE = " \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f"
+
+# Every match is the whitespace before a token, the token and the
+# character following it. Anything else, including an unterminated
+# string, matches as a single character of other
+TOKEN_PATTERN = re.compile(r"""
+    ([ \t\n\r\x0b\x0c\x1c-\x1f]*)
+    (?:
+        ([0-9]+(?:\.[0-9]*)?)                   # number
+      | ([A-Za-z_][A-Za-z0-9_]*)                # identifier or keyword
+      | ("[^"\x00]*"|'[^'\x00]*')               # string
+      | ([!=<>]=?|&&|\|\||[(){}+\-,.;/*\x00])  # symbol
+      | (.)                                     # other
+      | \Z
+    )
+    (?=(.?))
+""", re.VERBOSE | re.DOTALL)
+
+# Characters that may directly follow a number
+NUMBER_END = frozenset(SPACE).union(
+    key for key in list(single_char_types) + list(one_two_char_types)
+    if len(key) == 1
+)
+
+symbol_types = dict(
+    (text, getattr(Types, name)) for text, name in
+    list(single_char_types.items()) + list(one_two_char_types.items())
+)
+keyword_types = dict(
+    (text, getattr(Types, name)) for text, name in reserved_kw_types.items()
+)
+
 
 class LexicalError(Exception):
     def __init__(self, msg, line):
@@ -100,7 +134,7 @@ class Scanner:
     def get_alphanumeric(self):
         s = self.advance()
         while self.current_char.isalpha() or \
-            self.current_char.isdigit():
+            self.current_char.isdigit() or self.current_char == "_":
             # Note, don't need EOF check since "\0" is not alphanumeric
             s += self.advance()
 
@@ -121,7 +155,7 @@ class Scanner:
         if char.isdigit():
             return self.get_number()
 
-        if char.isalpha():
+        if char.isalpha() or char == "_":
             return self.get_alphanumeric()
 
         if char in ("\"", "\'"):
@@ -132,7 +166,10 @@ class Scanner:
             type_map = single_char_types
 
         elif char in one_two_char_types:
-            result = char + self.advance() if self.check('=') else char
+            result = char
+            if self.check('='):
+                self.advance()
+                result += self.current_char
 
         elif char == "&" and self.check("&"):
             result = char + self.advance()
@@ -161,3 +198,171 @@ class Scanner:
             return self.tokens
         except LexicalError as error:
             self.lox.lexical_error(error)
+
+
+class FastScanner(Scanner):
+    """ Scanner splitting the whole source into tokens with a single
+    compiled pattern, instead of building each token up a character at
+    a time. It produces the same tokens and lines as Scanner, and hands
+    the source over to Scanner when it holds a lexical error or a
+    non-ASCII character outside of a string, as those go through the
+    unicode aware str.isalpha(), str.isdigit() and str.isspace(). """
+
+    def tokenize(self, text):
+        self.reset()
+        self.text = text
+        if self.scan(text) is not None:
+            return self.tokens
+        return Scanner.tokenize(self, text)
+
+    def tokenize_compact(self, text):
+        """ Like tokenize, but returns a TokenArray and creates no Token
+        objects, unless the source needs Scanner """
+        self.reset()
+        self.text = text
+        tokens = TokenArray()
+        if self.scan_compact(text, tokens):
+            return tokens
+        if Scanner.tokenize(self, text) is None:
+            return None
+        tokens = TokenArray(self.tokens)
+        self.tokens = []
+        return tokens
+
+    def scan_compact(self, text, tokens):
+        # The same as scan, appending to a TokenArray
+        add = tokens.append
+        symbols = symbol_types
+        keywords = keyword_types
+        newlines = -1 if text[:1] == '\n' else 0
+        for space, number, name, string, symbol, other, after in \
+                TOKEN_PATTERN.findall(text):
+            if space:
+                newlines += space.count('\n')
+            if string:
+                newlines += string.count('\n')
+            line = newlines + 2 if after == '\n' else newlines + 1
+
+            if symbol:
+                add(symbol, symbols[symbol], line)
+            elif name:
+                if after > '\x7f':
+                    return False
+                if name in keywords:
+                    add(name, keywords[name], line)
+                else:
+                    add(name, Types.IDENTIFIER, line, name)
+            elif number:
+                if after and after not in NUMBER_END:
+                    return False
+                add(number, Types.NUMBER, line, float(number))
+            elif string:
+                string = string[1:-1]
+                add(string, Types.STRING, line, string)
+            elif other:
+                return False
+            elif space:
+                add(EOF, Types.EOF, line)
+        return True
+
+    def tokenize_stream(self, chunks):
+        """ Generator version of tokenize for sources too large to hold
+        in memory at once. chunks is an iterable of consecutive pieces
+        of the source, each ending with a line break but the last, and
+        the tokens of a piece are yielded as soon as it is scanned. A
+        string running over several pieces waits for its closing quote.
+        Lexical errors are raised, as earlier tokens may be in use. """
+        self.reset()
+        newlines = 0
+        first = True
+        pending = ""
+        chunks = iter(chunks)
+        chunk = next(chunks, None)
+        while chunk is not None:
+            following = next(chunks, None)
+            last = following is None
+            text = pending + chunk
+            self.tokens = []
+            try:
+                count = self.scan(text, newlines, first, last)
+                if count is None:
+                    self.tokens = []
+                    count = self.scan_reference(text, newlines, first, last)
+            except LexicalError as error:
+                if error.msg != "Unterminated string" or last:
+                    raise
+                pending = text
+                chunk = following
+                continue
+            yield from self.tokens
+            self.tokens = []
+            pending = ""
+            newlines = count
+            first = False
+            chunk = following
+
+    def scan_reference(self, text, newlines, first, last):
+        # Runs Scanner over a piece of a stream, raising lexical errors.
+        # A space stands in for the line break ending the previous piece
+        # so that a newline starting this one is counted
+        scanner = Scanner(self.lox)
+        scanner.text = text if first else " " + text
+        scanner.current_char = scanner.text[0]
+        try:
+            while scanner.current < len(scanner.text):
+                token = scanner.get_next_token()
+                token.line += newlines
+                self.tokens.append(token)
+        except LexicalError as error:
+            error.line += newlines
+            raise
+        if not last and self.tokens and self.tokens[-1].type == Types.EOF:
+            # Emitted for the trailing line break of the piece
+            self.tokens.pop()
+        if first and text[:1] == '\n':
+            newlines -= 1
+        return newlines + text.count('\n')
+
+    def scan(self, text, newlines=0, first=True, last=True):
+        # Appends the tokens of text to self.tokens and returns the count
+        # of newlines, or None if text needs the character by character
+        # Scanner. Scanner counts a newline when it advances onto it and
+        # never advances onto the first character or past the last, so
+        # the line of a token includes a newline right after it
+        append = self.tokens.append
+        make_token = Token
+        symbols = symbol_types
+        keywords = keyword_types
+        identifier = Types.IDENTIFIER
+        if first and text[:1] == '\n':
+            newlines -= 1
+        for space, number, name, string, symbol, other, after in \
+                TOKEN_PATTERN.findall(text):
+            if space:
+                newlines += space.count('\n')
+            if string:
+                newlines += string.count('\n')
+            line = newlines + 2 if after == '\n' else newlines + 1
+
+            if symbol:
+                append(make_token(symbol, symbols[symbol], line))
+            elif name:
+                if after > '\x7f':
+                    return None
+                if name in keywords:
+                    append(make_token(name, keywords[name], line))
+                else:
+                    append(make_token(name, identifier, line, name))
+            elif number:
+                if after and after not in NUMBER_END:
+                    return None
+                append(make_token(number, Types.NUMBER, line, float(number)))
+            elif string:
+                string = string[1:-1]
+                append(make_token(string, Types.STRING, line, string))
+            elif other:
+                return None
+            elif space and last:
+                # Whitespace running to the end of the source
+                append(make_token(EOF, Types.EOF, line))
+        return newlines
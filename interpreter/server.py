@@ -0,0 +1,164 @@
+import io
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import time
+
+from lox import Lox, DEFAULT_POOL_SIZE
+from output import Output, FLUSH_ON_EXIT
+from batch import CRASH_EXIT
+
+
+# Every message is a JSON object after its length in bytes
+HEADER = struct.Struct(">I")
+# Largest message read, to not allocate whatever a bad header says
+MAX_MESSAGE = 64 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def read_message(stream):
+    """ The next message from a binary stream, None at its end """
+    header = stream.read(HEADER.size)
+    if not header:
+        return None
+    if len(header) < HEADER.size:
+        raise ProtocolError("truncated header")
+    size, = HEADER.unpack(header)
+    if size > MAX_MESSAGE:
+        raise ProtocolError("message of {} bytes is too large".format(size))
+    body = stream.read(size)
+    if len(body) < size:
+        raise ProtocolError("truncated message")
+    return json.loads(body.decode("utf-8"))
+
+
+def write_message(stream, message):
+    body = json.dumps(message).encode("utf-8")
+    stream.write(HEADER.pack(len(body)) + body)
+    stream.flush()
+
+
+class LoxPool:
+    """ Lox instances built once and lent to one request at a time.
+    Each is reset before a run, so a program never sees the globals of
+    the one before it. Requests wait for a free instance, so size is
+    how many run at once. Requests start from the globals of snapshot,
+    if any. options are passed to every Lox. """
+    def __init__(self, size=DEFAULT_POOL_SIZE, snapshot=None, **options):
+        self.snapshot = snapshot
+        self.idle = queue.Queue()
+        for _ in range(size):
+            self.idle.put(Lox(output=Output(None, FLUSH_ON_EXIT), **options))
+
+    def run(self, source, filename="request"):
+        lox = self.idle.get()
+        try:
+            return run_source(lox, source, filename, self.snapshot)
+        finally:
+            self.idle.put(lox)
+
+
+def run_source(lox, source, filename, snapshot=None):
+    """ Runs source on lox and returns the result of the request, with
+    the exit code run_file would have exited with """
+    stdout = io.StringIO()
+    lox.output.stream = stdout
+    lox.reset()
+    if snapshot is not None:
+        snapshot.restore(lox)
+    lox.interpreter_mode = False
+    lox.filename = filename
+    result = {"exit_code": 0, "error": None}
+    start = time.perf_counter()
+    try:
+        lox.run(source)
+        result["exit_code"] = lox.exit_code()
+    except Exception as error:
+        result["exit_code"] = CRASH_EXIT
+        result["error"] = "{}: {}".format(error.__class__.__name__, error)
+        lox.output.flush()
+    result["seconds"] = time.perf_counter() - start
+    result["stdout"] = stdout.getvalue()
+    return result
+
+
+def handle(pool, request):
+    return pool.run(request["source"], request.get("filename", "request"))
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    # Requests of a connection are answered in order
+    def handle(self):
+        while True:
+            request = read_message(self.rfile)
+            if request is None:
+                return
+            write_message(self.wfile, handle(self.server.pool, request))
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Answers the requests of every connection to a Unix socket on
+    its own thread, so a short script does not wait for a long one to
+    finish, only for a free Lox of the pool """
+    daemon_threads = True
+
+    def __init__(self, path, pool):
+        self.pool = pool
+        socketserver.UnixStreamServer.__init__(self, path, RequestHandler)
+
+
+def serve_socket(path, pool):
+    # A socket left by a server that did not exit cleanly
+    if os.path.exists(path):
+        os.remove(path)
+    with Server(path, pool) as server:
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(path)
+
+
+def serve_stdio(pool, stdin=None, stdout=None):
+    """ Answers the requests framed on stdin on stdout, one at a time,
+    for a parent process that talks to the server through pipes """
+    stdin = sys.stdin.buffer if stdin is None else stdin
+    stdout = sys.stdout.buffer if stdout is None else stdout
+    while True:
+        request = read_message(stdin)
+        if request is None:
+            return
+        write_message(stdout, handle(pool, request))
+
+
+class Client:
+    """ Connection to a server listening on the Unix socket at path """
+    def __init__(self, path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self.stream = self.socket.makefile("rwb")
+
+    def run(self, source, filename="request"):
+        """ The result of running source: its stdout, exit_code, the
+        error if the interpreter crashed, and the seconds it ran """
+        write_message(self.stream, {"source": source, "filename": filename})
+        result = read_message(self.stream)
+        if result is None:
+            raise ProtocolError("server closed the connection")
+        return result
+
+    def close(self):
+        self.stream.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,182 @@
+import copy
+import pickle
+import zlib
+
+import ast as nodes
+from cache import interpreter_version
+from data_structures import LoxCallable, Rope
+from natives import LoxArray, NativeFunction
+from vm import VM
+
+
+# Held by a name make_function found undefined
+MISSING = object()
+
+
+class Snapshot:
+    """ The globals of a Lox after it ran a prelude, that sessions start
+    from instead of scanning, parsing, resolving and running it again.
+    Functions are kept with their resolved FunDecls, so they must be
+    declared at the top level, and their calls are not memoized, as a
+    session can assign the globals they read.
+
+    Restored on the engine it was taken with, a session shares every
+    value, functions included, and only copies the table of names and
+    the arrays, the only Lox values changed in place. Other engines,
+    snapshots loaded from a file and sessions with a budget make the
+    functions again from their declarations, which costs what running
+    the fun statements does. """
+    def __init__(self, values, declarations, engine=None, functions=None):
+        # Globals other than functions by name
+        self.values = values
+        # FunDecl of the function in each of the other globals
+        self.declarations = declarations
+        # Function objects by name and the engine that made them, None
+        # when they are made again on every restore
+        self.engine = engine
+        self.functions = functions
+
+    def restore(self, lox):
+        """ Replaces the globals of lox with those of the snapshot """
+        lox.interpreter.reset_globals()
+        self.install(lox)
+
+    def install(self, lox, overwrite=True):
+        """ Defines the globals of the snapshot in lox, keeping those
+        lox already has unless overwrite """
+        interpreter = lox.interpreter
+        table = interpreter.globals.sym_table
+        if self.functions is not None and lox.budget is None and \
+                engine_of(interpreter) == self.engine:
+            functions = self.functions
+            interpreter.functions_installed(functions.values())
+        else:
+            functions = {}
+            made = {}
+            for name, declaration in self.declarations.items():
+                if declaration not in made:
+                    made[declaration] = make_function(lox, declaration)
+                functions[name] = made[declaration]
+        values = copy_arrays(self.values)
+        if overwrite:
+            table.update(functions)
+            table.update(values)
+            return
+        for values in (functions, values):
+            for name, value in values.items():
+                if name not in table:
+                    table[name] = value
+
+    def save(self, path):
+        """ Writes the snapshot to path, compressed, for load_snapshot """
+        data = (interpreter_version(), self.values, self.declarations)
+        with open(path, "wb") as f:
+            f.write(zlib.compress(pickle.dumps(data)))
+
+
+def take_snapshot(lox):
+    """ Snapshot of the globals of lox """
+    interpreter = lox.interpreter
+    # Modules imported and not used yet are part of the globals too
+    interpreter.globals.load_imports(None)
+    values = {}
+    declarations = {}
+    functions = {}
+    detached = {}
+    for name, value in interpreter.globals.sym_table.items():
+        if type(value) is NativeFunction:
+            values[name] = value
+        elif isinstance(value, LoxCallable):
+            if value.closure is not interpreter.globals:
+                raise ValueError("the function in {} is not declared at "
+                                 "the top level".format(name))
+            if value.declaration not in detached:
+                detached[value.declaration] = (
+                    detach(value.declaration), unmemoized(value))
+            declarations[name], functions[name] = \
+                detached[value.declaration]
+        elif type(value) is Rope:
+            values[name] = str(value)
+        else:
+            values[name] = value
+    values = copy_arrays(values)
+    engine = engine_of(interpreter)
+    # Function bodies quickened with a budget charge it in every session
+    if engine is None or lox.budget is not None:
+        functions = None
+    return Snapshot(values, declarations, engine, functions)
+
+
+def load_snapshot(path):
+    with open(path, "rb") as f:
+        version, values, declarations = pickle.loads(
+            zlib.decompress(f.read()))
+    if version != interpreter_version():
+        raise ValueError("{} was saved by another version of the "
+                         "interpreter".format(path))
+    return Snapshot(values, declarations)
+
+
+def make_function(lox, declaration):
+    # Runs declaration alone, which defines the function it declares,
+    # and puts back what the name held
+    if lox.budget is not None:
+        # Nodes quickened by another session can hold its Budget
+        declaration = detach(declaration)
+    table = lox.interpreter.globals.sym_table
+    name = declaration.name.value
+    held = table.pop(name, MISSING)
+    lox.interpreter.interpret([declaration])
+    function = table.pop(name)
+    if held is not MISSING:
+        table[name] = held
+    return function
+
+
+def engine_of(interpreter):
+    """ Kind of the function objects interpreter makes, None for
+    compiled closures, which hold the globals they were made with """
+    if isinstance(interpreter, VM):
+        return "vm"
+    if interpreter.compiled:
+        return None
+    return "tree"
+
+
+def copy_arrays(values):
+    """ Copy of the dict values with copies of the arrays in it and in
+    those arrays, keeping which ones are the same array """
+    copies = {}
+
+    def copy_value(value):
+        if type(value) is not LoxArray:
+            return value
+        copied = copies.get(id(value))
+        if copied is None:
+            copied = copies[id(value)] = LoxArray(value.items[:])
+            if type(copied.items) is list:
+                copied.items = [copy_value(item) for item in copied.items]
+        return copied
+    return dict((name, copy_value(value)) for name, value in values.items())
+
+
+def unmemoized(function):
+    function = copy.copy(function)
+    function.memo = None
+    return function
+
+
+def detach(declaration):
+    """ Copy of declaration for other programs, without the operations
+    the Interpreter cached. It is not memoized, as they can assign the
+    globals it reads. """
+    declaration = copy.deepcopy(declaration)
+    declaration.pure = False
+    pending = [declaration]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, (nodes.Binary, nodes.Unary)):
+            node.quick = None
+            node.deopts = 0
+        pending.extend(node.children())
+    return declaration
@@ -0,0 +1,276 @@
+from types import GeneratorType, coroutine
+
+import ast as nodes
+from data_structures import LoxFunction
+from environment import Frame
+from errors import RuntimeException, locate
+from interpreter import Interpreter, RETURN
+from tokens import Types
+
+
+class StackInterpreter(Interpreter):
+    """ Interpreter that keeps its own stack instead of the Python one.
+
+    The visits of nodes with children are generators: they yield each
+    child to evaluate, or a generator to run, and are resumed by run()
+    with the result. run() keeps the suspended visits in a list, so
+    deeply nested expressions and deep recursion in the Lox program
+    only use memory. An exception is thrown into the visit below the
+    one raising it, so try/finally in a visit works as it does in the
+    Interpreter. Leaf visits are the plain Interpreter methods. """
+
+    def __init__(self, lox):
+        super(StackInterpreter, self).__init__(lox)
+        # Nodes visited by steps() with a slice, for the TaskStats
+        self.step_count = 0
+
+    def evaluate(self, ast):
+        return self.run(ast)
+
+    def execute(self, stmt):
+        return self.run(stmt)
+
+    def execute_block(self, stmt, environment):
+        # Only called for a LoxFunction called from outside of run()
+        return self.run(self.call_block(stmt, environment))
+
+    def run(self, node):
+        # Without a slice the steps never yield
+        try:
+            next(self.steps(node))
+        except StopIteration as stop:
+            return stop.value
+
+    def steps(self, node, slice_steps=None):
+        """ Generator running node, that yields after every slice_steps
+        nodes visited so that something else can run in between, and
+        returns the value of node """
+        stack = []
+        value = None
+        error = None
+        # Visits left before yielding, never 0 without a slice
+        left = -1 if slice_steps is None else slice_steps
+        # What to start evaluating next, if anything
+        child = node
+        while True:
+            if child is not None:
+                left -= 1
+                if not left:
+                    self.step_count += slice_steps
+                    yield
+                    left = slice_steps
+                if type(child) is GeneratorType:
+                    stack.append(child)
+                    value = None
+                else:
+                    try:
+                        value = child.visit(self)
+                    except Exception as exc:
+                        error = exc
+                    else:
+                        if type(value) is GeneratorType:
+                            stack.append(value)
+                            value = None
+                child = None
+            if not stack:
+                if slice_steps is not None:
+                    self.step_count += slice_steps - left
+                if error is not None:
+                    raise error
+                return value
+
+            visit = stack[-1]
+            try:
+                if error is None:
+                    child = visit.send(value)
+                else:
+                    exc, error = error, None
+                    child = visit.throw(exc)
+            except StopIteration as stop:
+                stack.pop()
+                value = stop.value
+            except Exception as exc:
+                stack.pop()
+                error = exc
+
+    async def interpret_async(self, stmts, slice_steps, stats):
+        """ interpret() as a coroutine, giving the event loop a turn
+        after every slice_steps nodes visited. Top level statements
+        shorter than a slice add up to one. """
+        self.step_count = 0
+        yielded = 0
+        stats.resume()
+        try:
+            for ast in stmts:
+                steps = self.steps(ast, slice_steps)
+                while True:
+                    try:
+                        next(steps)
+                    except StopIteration as stop:
+                        completion = stop.value
+                        break
+                    await self.yield_turn(stats)
+                    yielded = self.step_count
+                if completion is RETURN:
+                    # A return outside of a function ends the program
+                    return
+                if self.step_count - yielded >= slice_steps:
+                    await self.yield_turn(stats)
+                    yielded = self.step_count
+        except RuntimeException as error:
+            self.lox.runtime_error(error)
+        finally:
+            stats.pause(self.step_count)
+
+    async def yield_turn(self, stats):
+        stats.pause(self.step_count)
+        await yield_now()
+        stats.resume()
+
+    def call_block(self, stmt, environment):
+        prev_env = self.current_env
+        self.current_env = environment
+        if self.debug is not None:
+            self.debug.print(environment.sym_table)
+        try:
+            if (yield stmt) is RETURN:
+                return self.return_value
+            return None
+        finally:
+            self.current_env = prev_env
+
+    def visitGrouping(self, ast):
+        return (yield ast.expr)
+
+    def visitAssignment(self, ast):
+        self.assign(ast, (yield ast.expr))
+
+    def visitLogical(self, ast):
+        left_val = yield ast.left
+        if ast.op.type == Types.LOGIC_OR:
+            if self.is_truthy(left_val):
+                return left_val
+        elif not self.is_truthy(left_val):
+            return left_val
+        return (yield ast.right)
+
+    def visitBinary(self, ast):
+        left = yield ast.left
+        right = yield ast.right
+        return self.binary(ast, left, right)
+
+    def visitUnary(self, ast):
+        return self.unary(ast, (yield ast.operand))
+
+    def visitCall(self, ast):
+        callee = yield ast.callee
+        if not self.is_callable(callee):
+            raise Exception("Not a callable")
+
+        args = []
+        for arg in ast.args:
+            args.append((yield arg))
+        if type(callee) is not LoxFunction:
+            try:
+                return callee.call(self, args)
+            except RuntimeException as error:
+                raise locate(error, ast)
+        # LoxFunction.call without the Python call
+        memo = callee.memo
+        if memo is not None:
+            key = memo.key(args)
+            value = memo.get(key)
+            if value is not memo.MISSING:
+                return value
+        if self.budget is not None:
+            self.budget.call(callee.names, ast)
+        environment = Frame(callee.closure, callee.names)
+        values = environment.values
+        for i in range(len(callee.params)):
+            values[i] = args[i]
+        value = yield self.call_block(callee.body, environment)
+        if memo is not None:
+            memo.put(key, value)
+        return value
+
+    def visitHoisted(self, ast):
+        val = self.visitVariable(ast)
+        if val is None:
+            val = yield ast.expr
+            self.assign(ast, val)
+        return val
+
+    def visitExprStmt(self, ast):
+        return (yield ast.expr)
+
+    def visitPrintStmt(self, ast):
+        self.output.print((yield ast.expr))
+
+    def visitIfStmt(self, ast):
+        if self.is_truthy((yield ast.if_cond)):
+            return (yield ast.if_branch)
+        elif ast.else_branch is not None:
+            return (yield ast.else_branch)
+
+    def visitWhileStmt(self, ast):
+        body = ast.body
+        if type(body) is nodes.BlockStmt and body.reuse_frame:
+            return (yield self.loop_in_frame(ast))
+        budget = self.budget
+        while self.is_truthy((yield ast.cond)):
+            if budget is not None:
+                budget.step(ast)
+            if (yield body) is RETURN:
+                return RETURN
+
+    def loop_in_frame(self, ast):
+        enclosing = self.current_env
+        frame = Frame(enclosing, ast.body.names)
+        stmts = ast.body.stmts
+        budget = self.budget
+        while self.is_truthy((yield ast.cond)):
+            if budget is not None:
+                budget.step(ast)
+            self.current_env = frame
+            for stmt in stmts:
+                if (yield stmt) is RETURN:
+                    self.current_env = enclosing
+                    return RETURN
+            self.current_env = enclosing
+
+    def visitBlockStmt(self, ast):
+        if not ast.scoped:
+            for stmt in ast.stmts:
+                if (yield stmt) is RETURN:
+                    return RETURN
+            return None
+
+        enclosing = self.current_env
+        self.current_env = Frame(enclosing, ast.names)
+
+        for stmt in ast.stmts:
+            if (yield stmt) is RETURN:
+                self.current_env = enclosing
+                return RETURN
+
+        self.current_env = enclosing
+
+    def visitReturnStmt(self, ast):
+        # No tail calls needed, calls do not nest on the Python stack
+        self.return_value = yield ast.expr
+        return RETURN
+
+    def visitVarDecl(self, ast):
+        if ast.expr is not None:
+            self.define(ast.slot, ast.var, (yield ast.expr))
+            return
+        self.define(ast.slot, ast.var)
+
+
+@coroutine
+def yield_now():
+    """ Awaited to let the event loop run its other tasks, like
+    asyncio.sleep(0), which also yields nothing to the loop. asyncio is
+    not imported, as this directory's ast module hides the standard one
+    it needs. """
+    yield
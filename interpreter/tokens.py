@@ -1,3 +1,6 @@
+from array import array
+
+
 def enum(name, *args, **kwargs):
     """ Helper method for creating a class grouping of constants """
     enums = dict(zip(args, range(len(args))), **kwargs)
@@ -24,7 +27,7 @@ Types = enum(
     # Keywords
     'AND', 'CLASS', 'ELSE', 'FALSE', 'FUN', 'IF', 'NIL',
     'OR', 'PRINT', 'RETURN', 'SUPER', 'TRUE', 'VAR', 'WHILE',
-    'FOR'
+    'FOR', 'IMPORT'
 )
 
 single_char_types = {
@@ -44,10 +47,12 @@ reserved_kw_types = {
     'False': 'FALSE', 'fun': 'FUN', 'if': 'IF',
     'nil': 'NIL', 'or': 'OR', 'print': 'PRINT',
     'return': 'RETURN', 'super': 'SUPER', 'True': 'TRUE',
-    'var': 'VAR', 'while': 'WHILE', 'for': 'FOR'
+    'var': 'VAR', 'while': 'WHILE', 'for': 'FOR', 'import': 'IMPORT'
 }
 
 class Token:
+    __slots__ = ('value', 'type', 'line', 'text')
+
     def __init__(self, text, typespec, line, value=None):
         self.value = value
         self.type = typespec
@@ -58,3 +63,45 @@ class Token:
         return "Token type: {}, text: {}, line: {}".format(
             self.type, self.text, self.line
         )
+
+
+class TokenArray:
+    """ Struct-of-arrays token stream. The type and line of the i-th
+    token are types[i] and lines[i], and its text and value are shared
+    by every token of the same lexeme, stored once in texts and values
+    at index lexemes[i]. Indexing builds a Token, so a parser reading
+    the types directly only creates the tokens it keeps. """
+    def __init__(self, tokens=()):
+        self.types = array('B')
+        self.lines = array('I')
+        self.lexemes = array('I')
+        self.texts = []
+        self.values = []
+        # Lexeme numbers by text, strings are apart as their text can
+        # be that of a number, keyword or symbol
+        self.lexeme_numbers = {}
+        self.string_numbers = {}
+        for token in tokens:
+            self.append(token.text, token.type, token.line, token.value)
+
+    def append(self, text, ttype, line, value=None):
+        if ttype == Types.STRING:
+            numbers = self.string_numbers
+        else:
+            numbers = self.lexeme_numbers
+        lexeme = numbers.get(text)
+        if lexeme is None:
+            lexeme = numbers[text] = len(self.texts)
+            self.texts.append(text)
+            self.values.append(value)
+        self.types.append(ttype)
+        self.lines.append(line)
+        self.lexemes.append(lexeme)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        lexeme = self.lexemes[index]
+        return Token(self.texts[lexeme], self.types[index],
+            self.lines[index], self.values[lexeme])
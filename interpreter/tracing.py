@@ -0,0 +1,130 @@
+import collections
+
+
+class Tracer:
+    """ Receives the events of the Interpreter it is installed on. The
+    methods here do nothing, subclasses override the ones they need. """
+    # Names of the Interpreter visits reported to visit(), or None for
+    # all of them
+    visits = None
+
+    def visit(self, node):
+        """ Called before the Interpreter visits node """
+
+    def environment_created(self):
+        """ Called for every Frame created, by a block or a call """
+
+    def enter_call(self, declaration, environment):
+        """ Called before the body of the function declared by
+        declaration runs in environment """
+
+    def exit_call(self, declaration):
+        """ Called after the body of a function has run, or raised """
+
+
+def install(interpreter, tracer):
+    """ Reports the events of interpreter to tracer by replacing methods
+    of the interpreter instance with versions calling the tracer first.
+    Nothing is checked on the paths of an Interpreter without tracers,
+    and installing several tracers nests their versions. """
+    names = tracer.visits
+    if names is None:
+        names = [name for name in dir(interpreter) if name.startswith("visit")]
+    for name in names:
+        setattr(interpreter, name,
+                traced_visit(tracer, getattr(interpreter, name)))
+    # Calls in tail position are evaluated without visitCall
+    if "visitCall" in names:
+        interpreter.tail_call_value = traced_visit(
+            tracer, interpreter.tail_call_value)
+
+    # Blocks declaring something and calls create a Frame each, loops
+    # reusing the Frame of their body one for all iterations
+    visit_block = interpreter.visitBlockStmt
+
+    def visit_block_traced(ast):
+        if ast.scoped:
+            tracer.environment_created()
+        return visit_block(ast)
+    interpreter.visitBlockStmt = visit_block_traced
+
+    loop_in_frame = interpreter.loop_in_frame
+
+    def loop_in_frame_traced(ast):
+        tracer.environment_created()
+        return loop_in_frame(ast)
+    interpreter.loop_in_frame = loop_in_frame_traced
+
+    # Every function body runs through execute_block, which only knows
+    # the body, so the declarations are recorded as they run, or as
+    # modules and snapshots define the functions they made
+    declarations = {}
+    visit_fun_decl = interpreter.visitFunDecl
+
+    def visit_fun_decl_traced(ast):
+        declarations[ast.body] = ast
+        return visit_fun_decl(ast)
+    interpreter.visitFunDecl = visit_fun_decl_traced
+
+    functions_installed = interpreter.functions_installed
+
+    def functions_installed_traced(functions):
+        for function in functions:
+            declarations[function.body] = function.declaration
+        return functions_installed(functions)
+    interpreter.functions_installed = functions_installed_traced
+
+    execute_block = interpreter.execute_block
+
+    def execute_block_traced(stmt, environment):
+        declaration = declarations[stmt]
+        tracer.environment_created()
+        tracer.enter_call(declaration, environment)
+        try:
+            return execute_block(stmt, environment)
+        finally:
+            tracer.exit_call(declaration)
+    interpreter.execute_block = execute_block_traced
+    return tracer
+
+
+def traced_visit(tracer, visit):
+    def visit_traced(ast):
+        tracer.visit(ast)
+        return visit(ast)
+    return visit_traced
+
+
+class Metrics(Tracer):
+    """ Counts of what an Interpreter did, for sizing """
+    def __init__(self):
+        # Visits by node class name
+        self.nodes = collections.Counter()
+        self.environments = 0
+        self.calls = 0
+        self.depth = 0
+        self.max_depth = 0
+
+    def visit(self, node):
+        self.nodes[node.__class__.__name__] += 1
+
+    def environment_created(self):
+        self.environments += 1
+
+    def enter_call(self, declaration, environment):
+        self.calls += 1
+        self.depth += 1
+        if self.depth > self.max_depth:
+            self.max_depth = self.depth
+
+    def exit_call(self, declaration):
+        self.depth -= 1
+
+    def report(self):
+        lines = ["{:<24}{:>12}".format(name, count)
+                 for name, count in sorted(self.nodes.items())]
+        lines.append("{:<24}{:>12}".format("nodes", sum(self.nodes.values())))
+        lines.append("{:<24}{:>12}".format("environments", self.environments))
+        lines.append("{:<24}{:>12}".format("calls", self.calls))
+        lines.append("{:<24}{:>12}".format("max call depth", self.max_depth))
+        return "\n".join(lines)
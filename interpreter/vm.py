@@ -0,0 +1,432 @@
+from bytecode import OpCodes, Chunk
+from compiler import Compiler, END
+from data_structures import LoxCallable, MAX_PARAMS, STRING_TYPES, concat, \
+    value_type
+from environment import Globals, Frame
+from errors import RuntimeException
+from interpreter import RETURN
+from natives import NATIVES
+
+
+NUMERIC_TYPES = (float, int)
+
+
+class VMFunction(LoxCallable):
+    def __init__(self, proto, closure, memo=None):
+        self.proto = proto
+        self.closure = closure
+        self.memo = memo
+
+    @property
+    def declaration(self):
+        return self.proto.declaration
+
+    def call(self, vm, args):
+        memo = self.memo
+        if memo is not None:
+            key = memo.key(args)
+            value = memo.get(key)
+            if value is not memo.MISSING:
+                return value
+            value = vm.call_function(self, args)
+            memo.put(key, value)
+            return value
+        return vm.call_function(self, args)
+
+
+def memoizing_chunk(memo, key):
+    # A memoized call returns into this chunk, which stores its value
+    chunk = Chunk()
+    chunk.emit(None, OpCodes.MEMOIZE, chunk.add_constant((memo, key)))
+    chunk.emit(None, OpCodes.RETURN)
+    return chunk
+
+
+def numeric_error(op):
+    return RuntimeException(op,
+        "{} operator expected numeric operands".format(op.value))
+
+
+class VM:
+    """ Stack based virtual machine running the bytecode produced by
+    the Compiler. It is a drop-in replacement for the Interpreter and
+    keeps the same globals, output and runtime errors; local scopes are
+    the same Frames so closures capture their environment as before.
+
+    Lox calls push a call frame instead of recursing in Python, and the
+    dispatch loop keeps everything it touches in local variables. """
+    def __init__(self, lox):
+        self.lox = lox
+        self.globals = Globals(NATIVES)
+        self.compiler = Compiler(lox)
+        self.output = lox.output
+        self.debug = lox.debug
+        self.budget = lox.budget
+
+    def reset_globals(self):
+        self.globals = Globals(NATIVES)
+
+    def functions_installed(self, functions):
+        """ Called with the functions another Lox made that a Snapshot
+        defines in the globals """
+
+    def interpret(self, stmts):
+        # Returns RETURN when a return statement ended the program, like
+        # Interpreter.interpret
+        chunk = self.compiler.compile(stmts)
+        try:
+            if self.run(chunk, self.globals) is not END:
+                return RETURN
+        except RuntimeException as error:
+            self.lox.runtime_error(error)
+
+    def call_function(self, function, args):
+        # Used when a function is called from outside of the dispatch
+        # loop, e.g. through LoxCallable.call
+        proto = function.proto
+        if self.budget is not None:
+            self.budget.call(proto.names, (proto.chunk, 0))
+        environment = Frame(function.closure, proto.names)
+        values = environment.values
+        for i in range(len(proto.params)):
+            values[i] = args[i]
+        if self.debug is not None:
+            self.debug.print(environment.sym_table)
+        return self.run(proto.chunk, environment)
+
+    def run(self, chunk, env):
+        CONSTANT = OpCodes.CONSTANT
+        POP = OpCodes.POP
+        DUP = OpCodes.DUP
+        GET_GLOBAL = OpCodes.GET_GLOBAL
+        SET_GLOBAL = OpCodes.SET_GLOBAL
+        DEFINE_GLOBAL = OpCodes.DEFINE_GLOBAL
+        GET_LOCAL = OpCodes.GET_LOCAL
+        SET_LOCAL = OpCodes.SET_LOCAL
+        GET_ENCLOSING = OpCodes.GET_ENCLOSING
+        SET_ENCLOSING = OpCodes.SET_ENCLOSING
+        PUSH_SCOPE = OpCodes.PUSH_SCOPE
+        POP_SCOPE = OpCodes.POP_SCOPE
+        ADD = OpCodes.ADD
+        SUBTRACT = OpCodes.SUBTRACT
+        MULTIPLY = OpCodes.MULTIPLY
+        DIVIDE = OpCodes.DIVIDE
+        EQUAL = OpCodes.EQUAL
+        NOT_EQUAL = OpCodes.NOT_EQUAL
+        GREATER = OpCodes.GREATER
+        GREATER_EQUAL = OpCodes.GREATER_EQUAL
+        LESS = OpCodes.LESS
+        LESS_EQUAL = OpCodes.LESS_EQUAL
+        NOT = OpCodes.NOT
+        NEGATE = OpCodes.NEGATE
+        JUMP = OpCodes.JUMP
+        JUMP_IF_FALSE = OpCodes.JUMP_IF_FALSE
+        JUMP_IF_FALSE_OR_POP = OpCodes.JUMP_IF_FALSE_OR_POP
+        JUMP_IF_TRUE_OR_POP = OpCodes.JUMP_IF_TRUE_OR_POP
+        JUMP_IF_NOT_NIL_OR_POP = OpCodes.JUMP_IF_NOT_NIL_OR_POP
+        MAKE_FUNCTION = OpCodes.MAKE_FUNCTION
+        CALL = OpCodes.CALL
+        RETURN = OpCodes.RETURN
+        MEMOIZE = OpCodes.MEMOIZE
+        PRINT = OpCodes.PRINT
+        IMPORT = OpCodes.IMPORT
+
+        numeric = NUMERIC_TYPES
+        strings = STRING_TYPES
+        gtable = self.globals.sym_table
+        write = self.output.print
+        debug = self.debug
+        budget = self.budget
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        # Saved (chunk, ip, env) of the callers of the current function
+        frames = []
+
+        code = chunk.code
+        constants = chunk.constants
+        values = getattr(env, 'values', None)
+        ip = 0
+
+        while True:
+            op = code[ip]
+
+            if op == GET_LOCAL:
+                push(values[code[ip + 1]])
+                ip += 2
+
+            elif op == CONSTANT:
+                push(constants[code[ip + 1]])
+                ip += 2
+
+            elif op == GET_ENCLOSING:
+                frame = env.enclosing
+                depth = code[ip + 1] - 1
+                while depth:
+                    frame = frame.enclosing
+                    depth -= 1
+                push(frame.values[code[ip + 2]])
+                ip += 3
+
+            elif op == SET_LOCAL:
+                values[code[ip + 1]] = pop()
+                ip += 2
+
+            elif op == GET_GLOBAL:
+                token = constants[code[ip + 1]]
+                if token.value in gtable:
+                    push(gtable[token.value])
+                else:
+                    # Loads the modules imported, or raises the undefined
+                    # variable error
+                    push(self.globals.get(token))
+                ip += 2
+
+            elif op == JUMP_IF_FALSE:
+                val = pop()
+                if val is None or val is False:
+                    ip = code[ip + 1]
+                else:
+                    ip += 2
+
+            elif op == JUMP:
+                if budget is not None and code[ip + 1] < ip:
+                    # Jumping back to the condition of a loop
+                    budget.step((chunk, ip))
+                ip = code[ip + 1]
+
+            elif op == ADD:
+                right = pop()
+                left = stack[-1]
+                if type(left) in numeric and type(right) in numeric:
+                    stack[-1] = left + right
+                elif type(left) in strings and type(right) in strings:
+                    if budget is not None:
+                        stack[-1] = budget.concat(left, right, (chunk, ip))
+                    else:
+                        stack[-1] = concat(left, right)
+                else:
+                    token = chunk.tokens[ip]
+                    raise RuntimeException(token,
+                        "Unsupported operand type(s) {} and {} for {}".format(
+                            value_type(left), value_type(right), token.text
+                        ))
+                ip += 1
+
+            elif op == SUBTRACT:
+                right = pop()
+                left = stack[-1]
+                if type(left) not in numeric or type(right) not in numeric:
+                    raise numeric_error(chunk.tokens[ip])
+                stack[-1] = left - right
+                ip += 1
+
+            elif op == LESS:
+                right = pop()
+                left = stack[-1]
+                if type(left) not in numeric or type(right) not in numeric:
+                    raise numeric_error(chunk.tokens[ip])
+                stack[-1] = left < right
+                ip += 1
+
+            elif op == MULTIPLY:
+                right = pop()
+                left = stack[-1]
+                if type(left) not in numeric or type(right) not in numeric:
+                    raise numeric_error(chunk.tokens[ip])
+                stack[-1] = left * right
+                ip += 1
+
+            elif op == PUSH_SCOPE:
+                env = Frame(env, constants[code[ip + 1]])
+                values = env.values
+                ip += 2
+
+            elif op == POP_SCOPE:
+                env = env.enclosing
+                values = getattr(env, 'values', None)
+                ip += 1
+
+            elif op == CALL:
+                argc = code[ip + 1]
+                ip += 2
+                base = len(stack) - argc
+                callee = stack[base - 1]
+                if type(callee) is VMFunction:
+                    memo = callee.memo
+                    if memo is not None:
+                        key = memo.key(stack[base:])
+                        value = memo.get(key)
+                        if value is not memo.MISSING:
+                            del stack[base - 1:]
+                            push(value)
+                            continue
+                    proto = callee.proto
+                    if budget is not None:
+                        budget.call(proto.names, (chunk, ip - 2))
+                    environment = Frame(callee.closure, proto.names)
+                    frame_values = environment.values
+                    for i in range(len(proto.params)):
+                        frame_values[i] = stack[base + i]
+                    del stack[base - 1:]
+                    if debug is not None:
+                        debug.print(environment.sym_table)
+                    frames.append((chunk, ip, env))
+                    if memo is not None:
+                        frames.append((memoizing_chunk(memo, key), 0, env))
+                    chunk = proto.chunk
+                    code = chunk.code
+                    constants = chunk.constants
+                    env = environment
+                    values = frame_values
+                    ip = 0
+                elif isinstance(callee, LoxCallable):
+                    args = stack[base:]
+                    del stack[base - 1:]
+                    try:
+                        push(callee.call(self, args))
+                    except RuntimeException as error:
+                        # Errors of natives are reported at the call
+                        if error.line is None:
+                            error.line = chunk.line_at(ip - 2)
+                        raise
+                else:
+                    raise Exception("Not a callable")
+
+            elif op == RETURN:
+                if not frames:
+                    return pop()
+                chunk, ip, env = frames.pop()
+                code = chunk.code
+                constants = chunk.constants
+                values = getattr(env, 'values', None)
+
+            elif op == POP:
+                pop()
+                ip += 1
+
+            elif op == SET_ENCLOSING:
+                env.assign_at(code[ip + 1], code[ip + 2], pop())
+                ip += 3
+
+            elif op == SET_GLOBAL:
+                token = constants[code[ip + 1]]
+                if token.value in gtable:
+                    gtable[token.value] = pop()
+                else:
+                    # Loads the modules imported, or raises the undefined
+                    # variable error
+                    self.globals.assign(token, pop())
+                ip += 2
+
+            elif op == DEFINE_GLOBAL:
+                gtable[constants[code[ip + 1]].value] = pop()
+                ip += 2
+
+            elif op == DIVIDE:
+                right = pop()
+                left = stack[-1]
+                if type(left) not in numeric or type(right) not in numeric:
+                    raise numeric_error(chunk.tokens[ip])
+                stack[-1] = left / right
+                ip += 1
+
+            elif op == EQUAL:
+                right = pop()
+                left = stack[-1]
+                stack[-1] = right is None if left is None else left == right
+                ip += 1
+
+            elif op == NOT_EQUAL:
+                right = pop()
+                left = stack[-1]
+                stack[-1] = right is not None if left is None \
+                    else not left == right
+                ip += 1
+
+            elif op == GREATER:
+                right = pop()
+                left = stack[-1]
+                if type(left) not in numeric or type(right) not in numeric:
+                    raise numeric_error(chunk.tokens[ip])
+                stack[-1] = left > right
+                ip += 1
+
+            elif op == GREATER_EQUAL:
+                right = pop()
+                left = stack[-1]
+                if type(left) not in numeric or type(right) not in numeric:
+                    raise numeric_error(chunk.tokens[ip])
+                stack[-1] = left >= right
+                ip += 1
+
+            elif op == LESS_EQUAL:
+                right = pop()
+                left = stack[-1]
+                if type(left) not in numeric or type(right) not in numeric:
+                    raise numeric_error(chunk.tokens[ip])
+                stack[-1] = left <= right
+                ip += 1
+
+            elif op == JUMP_IF_FALSE_OR_POP:
+                val = stack[-1]
+                if val is None or val is False:
+                    ip = code[ip + 1]
+                else:
+                    pop()
+                    ip += 2
+
+            elif op == JUMP_IF_TRUE_OR_POP:
+                val = stack[-1]
+                if val is None or val is False:
+                    pop()
+                    ip += 2
+                else:
+                    ip = code[ip + 1]
+
+            elif op == JUMP_IF_NOT_NIL_OR_POP:
+                if stack[-1] is None:
+                    pop()
+                    ip += 2
+                else:
+                    ip = code[ip + 1]
+
+            elif op == DUP:
+                push(stack[-1])
+                ip += 1
+
+            elif op == NOT:
+                val = stack[-1]
+                stack[-1] = val is None or val is False
+                ip += 1
+
+            elif op == NEGATE:
+                if type(stack[-1]) not in numeric:
+                    raise numeric_error(chunk.tokens[ip])
+                stack[-1] = -stack[-1]
+                ip += 1
+
+            elif op == PRINT:
+                write(pop())
+                ip += 1
+
+            elif op == MAKE_FUNCTION:
+                proto = constants[code[ip + 1]]
+                if len(proto.params) > MAX_PARAMS:
+                    raise RuntimeException(proto.params[-1].var,
+                        "Maximum number of parameters exceeded")
+                push(VMFunction(proto, env,
+                    self.lox.memo_cache(proto.declaration)))
+                ip += 2
+
+            elif op == MEMOIZE:
+                memo, key = constants[code[ip + 1]]
+                memo.put(key, stack[-1])
+                ip += 2
+
+            elif op == IMPORT:
+                self.lox.import_module(constants[code[ip + 1]])
+                ip += 2
+
+            else:
+                raise RuntimeError("Unknown opcode {}".format(op))
@@ -1,15 +1,54 @@
 import unittest
+import asyncio
+import contextlib
+import io
 import os
 import sys
+import tempfile
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
-from interpreter.scanner import Scanner
+from interpreter.scanner import Scanner, FastScanner
 from interpreter.parser import Parser
-from interpreter.lox import Lox
+from interpreter.lox import Lox, save_snapshot, SNAPSHOT_EXIT
+from interpreter.cache import ASTCache
+from interpreter.data_structures import MemoCache, MemoStats, Rope, concat
+from interpreter.profiler import Profiler
+from interpreter.tracing import Metrics, install
+from interpreter.output import Output, FLUSH_ON_EXIT, FLUSH_BY_SIZE
+from interpreter.snapshot import load_snapshot
+from interpreter.batch import find_scripts, run_batch, TIMEOUT_EXIT
+from interpreter.server import LoxPool, serve_stdio, read_message, \
+    write_message
 
 
 EXPRESSION = "var a = 2 + 3;\nvar b = 3 + 4;\n if (a > 3 && b < 10) {print a; print b;}"
+PROGRAM = """
+fun fib(n) {
+  if (n < 3) {
+    return 1;
+  }
+  return fib(n-1) + fib(n-2);
+}
+var total = 0;
+for (var i = 0; i < 5; i = i + 1) {
+  total = total + fib(i + 2);
+}
+print total;
+print "a" + 1;
+"""
+
+
+def run_captured(code, stream=False, **kwargs):
+    """ Run code on a fresh Lox and return everything it printed """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        if stream:
+            Lox(**kwargs).run_stream(code.splitlines(True))
+        else:
+            Lox(**kwargs).run(code)
+    return output.getvalue()
+
 
 class TestLox(unittest.TestCase):
 
@@ -35,6 +74,600 @@ class TestLox(unittest.TestCase):
     def test_interpreter_run(self):
         self.lox.run(self.expression)
 
+    def test_fast_scanner_matches_scanner(self):
+        sources = [
+            PROGRAM, EXPRESSION, "a <= b != c >= d;\n", "print 'x\ny' + 1.5",
+            "var s = \"unterminated;\n", "1 & 2;\n", "12ab;\n", "\u00e9t\u00e9;\n"
+        ]
+        for source in sources:
+            expected = Scanner(self.lox).tokenize(source)
+            tokens = FastScanner(self.lox).tokenize(source)
+            if expected is None:
+                self.assertIsNone(tokens)
+                continue
+            self.assertEqual(
+                [(t.text, t.type, t.line, t.value) for t in tokens],
+                [(t.text, t.type, t.line, t.value) for t in expected]
+            )
+
+    def test_token_array(self):
+        tokens = self.scanner.tokenize(PROGRAM)
+        array = FastScanner(self.lox).tokenize_compact(PROGRAM)
+        self.assertEqual(len(array), len(tokens))
+        self.assertEqual(
+            [(t.text, t.type, t.line, t.value) for t in array],
+            [(t.text, t.type, t.line, t.value) for t in tokens]
+        )
+        self.assertLess(len(array.texts), len(tokens))
+        self.assertFalse(hasattr(tokens[0], "__dict__"))
+        self.assertEqual(
+            run_captured(PROGRAM, compact_tokens=True),
+            run_captured(PROGRAM)
+        )
+
+    def test_stream_matches_run(self):
+        code = PROGRAM.replace('"a"', '"multi\nline"')
+        # Streaming runs every call, without memoization
+        self.assertEqual(
+            run_captured(code, stream=True),
+            run_captured(code, memoize=False)
+        )
+        # A return outside of functions ends the program
+        returning = "print 1;\nif (True) { return 2; }\nprint 3;\n"
+        for engine in ("tree", "closure", "vm", "stack"):
+            self.assertEqual(
+                run_captured(returning, stream=True, engine=engine),
+                "1.0\nExpression evaluates to: None\n")
+        tokens = self.scanner.tokenize_stream(code.splitlines(True))
+        statements = list(self.parser.parse_stream(tokens))
+        self.assertEqual(len(statements), 5)
+        self.assertEqual(len(self.parser.tokens.window), 2)
+
+    def test_ast_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ASTCache(directory)
+            self.assertEqual(
+                run_captured(PROGRAM, cache=cache),
+                run_captured(PROGRAM)
+            )
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+            self.assertEqual(
+                run_captured(PROGRAM, cache=cache),
+                run_captured(PROGRAM)
+            )
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            # A corrupt entry is dropped and parsed again
+            with open(cache.path(PROGRAM), "wb") as f:
+                f.write(b"corrupt")
+            self.assertIsNone(cache.get(PROGRAM))
+            self.assertFalse(os.path.exists(cache.path(PROGRAM)))
+
+            cache.put(PROGRAM, [])
+            size = os.path.getsize(cache.path(PROGRAM))
+            cache.max_size = size
+            os.utime(cache.path(PROGRAM), (0, 0))
+            cache.put(EXPRESSION, [])
+            self.assertFalse(os.path.exists(cache.path(PROGRAM)))
+            self.assertEqual(cache.get(EXPRESSION), [])
+
+    def test_return_from_nested_statements(self):
+        code = """
+fun find(target) {
+  var i = 0;
+  while (True) {
+    { if (i == target) { return i; } }
+    i = i + 1;
+  }
+}
+{
+  var x = "outer";
+  print find(3);
+  print x;
+}
+return 0;
+print "unreachable";
+"""
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.lox.run(code)
+        self.assertIn("3.0\nouter\n", output.getvalue())
+        self.assertNotIn("unreachable", output.getvalue())
+        self.assertFalse(self.lox.has_parsing_error)
+        self.assertIs(self.lox.interpreter.current_env,
+                      self.lox.interpreter.globals)
+        self.assertEqual(run_captured(code, engine="vm"), output.getvalue())
+
+    def test_tail_calls_run_in_constant_stack(self):
+        code = """
+fun count(n, total) {
+  if (n < 1) {
+    return total;
+  }
+  return count(n - 1, total + n);
+}
+print count(5000, 0);
+"""
+        output = run_captured(code)
+        self.assertIn("12502500.0\n", output)
+
+    def test_stack_engine_deep_nesting(self):
+        self.assertEqual(
+            run_captured(PROGRAM, engine="stack"),
+            run_captured(PROGRAM, engine="tree")
+        )
+        depth = 100000
+        code = "print " + "1 + (" * depth + "1" + ")" * depth + ";\n"
+        self.assertIn("100001.0\n", run_captured(code, engine="stack"))
+
+        code = """
+fun sum(n) {
+  if (n < 1) return 0;
+  return n + sum(n - 1);
+}
+print sum(100000);
+"""
+        self.assertIn("5000050000.0\n", run_captured(code, engine="stack"))
+
+    def test_memoize_pure_functions(self):
+        code = """
+var k = 2;
+var counter = 0;
+fun fib(n) { if (n < 3) return 1; return fib(n - 1) + fib(n - 2); }
+fun scaled(n) { return fib(n) * k; }
+fun noisy(n) { print n; return n; }
+fun counting(n) { counter = counter + 1; return n; }
+print scaled(20);
+print noisy(1) + noisy(1);
+print counting(1) + counting(1);
+"""
+        for engine in ("tree", "closure", "vm", "stack"):
+            output = io.StringIO()
+            lox = Lox(engine=engine)
+            with contextlib.redirect_stdout(output):
+                lox.run(code)
+            printed = output.getvalue().splitlines()
+            self.assertEqual(printed[:5],
+                             ["13530.0", "1.0", "1.0", "2.0", "2.0"])
+            stats = dict((declaration.name.text, (stats.hits, stats.misses))
+                         for declaration, stats in lox.memo_stats.items())
+            self.assertEqual(stats, {"fib": (17, 20), "scaled": (0, 1)})
+
+        lox = Lox(memoize=False)
+        with contextlib.redirect_stdout(io.StringIO()):
+            lox.run(code)
+        self.assertEqual(lox.memo_stats, {})
+
+        # A later run on the same Lox can assign what a function reads
+        for engine in ("tree", "closure", "vm", "stack"):
+            output = io.StringIO()
+            lox = Lox(engine=engine, output=Output(output, FLUSH_ON_EXIT))
+            lox.run("var k = 1;\nfun f(n) { return n + k; }\nprint f(1);\n")
+            lox.run("k = 5;\nprint f(1);\nk = 6;\nprint f(1);\n")
+            self.assertEqual(output.getvalue().split("\n")[:4],
+                             ["2.0", "Expression evaluates to: None",
+                              "6.0", "7.0"])
+
+        cache = MemoCache(2, MemoStats())
+        cache.put(cache.key([1.0]), "one")
+        cache.put(cache.key([2.0]), "two")
+        self.assertEqual(cache.get(cache.key([1.0])), "one")
+        cache.put(cache.key([3.0]), "three")
+        self.assertIs(cache.get(cache.key([2.0])), MemoCache.MISSING)
+        self.assertIs(cache.get(cache.key([True])), MemoCache.MISSING)
+        self.assertEqual((cache.stats.hits, cache.stats.misses), (1, 2))
+        self.assertNotEqual(cache.key([1.0, 0.0]), cache.key([1.0, -0.0]))
+
+    def test_profiler(self):
+        lox = Lox(memoize=False)
+        profiler = Profiler()
+        profiler.install(lox.interpreter)
+        with contextlib.redirect_stdout(io.StringIO()):
+            lox.run(PROGRAM)
+        fib, script = sorted(profiler.functions.values(),
+                             key=lambda profile: profile.name, reverse=True)
+        self.assertEqual((fib.calls, script.calls), (57, 1))
+        self.assertLessEqual(fib.inclusive, script.inclusive)
+        # The body of fib and the if statement it starts with
+        self.assertEqual(profiler.lines.most_common(1)[0][1], 2 * 57)
+        stacks = [line.rsplit(" ", 1)[0]
+                  for line in profiler.folded().splitlines()]
+        self.assertIn("<script>;{0};{0}".format(fib.name), stacks)
+        self.assertIn(fib.name, profiler.report())
+
+    def test_tracer_metrics(self):
+        lox = Lox(memoize=False)
+        self.assertEqual(vars(lox.interpreter).keys() & {"visitCall"}, set())
+        metrics = install(lox.interpreter, Metrics())
+        with contextlib.redirect_stdout(io.StringIO()):
+            lox.run(PROGRAM)
+        self.assertEqual(metrics.calls, 57)
+        # fib(7) recurses down to fib(2)
+        self.assertEqual(metrics.max_depth, 6)
+        self.assertEqual(metrics.depth, 0)
+        self.assertEqual(metrics.nodes["Call"], 57)
+        self.assertGreater(metrics.environments, metrics.calls)
+        self.assertIn("max call depth", metrics.report())
+
+        # Calls in tail position are counted too
+        lox = Lox(memoize=False, output=Output(io.StringIO(), FLUSH_ON_EXIT))
+        metrics = install(lox.interpreter, Metrics())
+        lox.run("fun g(n) { return n; }\nfun f(n) { return g(n); }\n"
+                "print f(1);\n")
+        self.assertEqual((metrics.nodes["Call"], metrics.calls), (2, 2))
+
+    def test_buffered_output(self):
+        stream = io.StringIO()
+        debug = io.StringIO()
+        lox = Lox(output=Output(stream, FLUSH_ON_EXIT), debug=Output(debug))
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            lox.run(PROGRAM)
+        self.assertEqual(stdout.getvalue(), "")
+        self.assertEqual(stream.getvalue(), run_captured(PROGRAM))
+        self.assertNotIn("{", stream.getvalue())
+        self.assertIn("{'n': 3.0}", debug.getvalue())
+
+        output = Output(stream, FLUSH_BY_SIZE, buffer_size=8)
+        stream.seek(0)
+        stream.truncate()
+        output.print("abc")
+        self.assertEqual(stream.getvalue(), "")
+        output.print("defg")
+        self.assertEqual(stream.getvalue(), "abc\ndefg\n")
+
+    def test_rope_strings(self):
+        code = """
+var line = "0123456789";
+var s = "";
+var i = 0;
+while (i < 100) { s = s + line; i = i + 1; }
+var t = s + "!";
+var u = s + "?";
+print s == t; print t == s + "!"; print "<" + u;
+"""
+        expected = "False\nTrue\n<" + "0123456789" * 100 + "?\n"
+        for engine in ("tree", "closure", "vm", "stack"):
+            self.assertIn(expected, run_captured(code, engine=engine))
+
+        base = "x" * 300
+        rope = concat(base, "a")
+        self.assertIs(type(rope), Rope)
+        appended = concat(rope, "b")
+        self.assertIs(appended.parts, rope.parts)
+        # Appending to rope again joins its own pieces first
+        branched = concat(rope, "c")
+        self.assertIsNot(branched.parts, appended.parts)
+        self.assertEqual(str(rope), base + "a")
+        self.assertEqual(appended, base + "ab")
+        self.assertEqual(branched, base + "ac")
+        self.assertEqual(hash(branched), hash(base + "ac"))
+        self.assertEqual(concat("a", "b"), "ab")
+        self.assertIs(type(concat("a", "b")), str)
+
+    def test_quickened_operators(self):
+        code = """
+fun add(a, b) { return a + b; }
+print add(1, 2);
+print add("a", "b");
+print add(1, 2);
+print -add(1, 2) + !True;
+"""
+        lox = Lox(memoize=False)
+        stmts = lox.resolver.resolve(lox.parse(code))
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            lox.interpreter.interpret(stmts)
+            lox.flush()
+        self.assertTrue(output.getvalue().startswith("3.0\nab\n3.0\nFile"))
+        self.assertTrue(lox.has_runtime_error)
+        add = stmts[0].body.stmts[0].expr
+        # Specialized for numbers, back to generic for strings, then
+        # specialized again
+        self.assertEqual(add.quick[:2], (float, float))
+        self.assertEqual(add.deopts, 1)
+
+        for value in [1, "a"] * 4:
+            lox.interpreter.binary(add, value, value)
+        self.assertIsNone(add.quick)
+        self.assertEqual(add.deopts, 4)
+        self.assertEqual(lox.interpreter.binary(add, 1.0, 2.0), 3.0)
+        self.assertIsNone(add.quick)
+
+    def test_batch_runner(self):
+        scripts = {
+            "ok.lox": "print 1 + 2;\n",
+            "error.lox": "print 1;\nprint nil + 1;\n",
+            "hang.lox": "while (True) {}\n",
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            for name, code in scripts.items():
+                with open(os.path.join(directory, name), "w") as f:
+                    f.write(code)
+            paths = find_scripts(directory)
+            summary = run_batch(paths, jobs=2, timeout=0.5)
+        results = dict((os.path.basename(result["file"]), result)
+                       for result in summary["results"])
+        self.assertEqual(sorted(results), sorted(scripts))
+        self.assertEqual(results["ok.lox"]["exit_code"], 0)
+        self.assertIn("3.0\n", results["ok.lox"]["stdout"])
+        self.assertEqual(results["error.lox"]["exit_code"], 3)
+        self.assertIn("RuntimeException", results["error.lox"]["stdout"])
+        self.assertEqual(results["hang.lox"]["exit_code"], TIMEOUT_EXIT)
+        self.assertTrue(results["hang.lox"]["timed_out"])
+        self.assertEqual((summary["scripts"], summary["failed"],
+                          summary["timed_out"]), (3, 2, 1))
+
+    def test_execution_budgets(self):
+        spin = "print 1;\nwhile (True) {}\n"
+        build = "var s = \"\";\nwhile (True) { s = s + \"0123456789\"; }\n"
+        for engine in ("tree", "closure", "vm", "stack"):
+            lox = Lox(engine=engine, max_steps=1000)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                lox.run(spin)
+                # Every run gets the whole budget again
+                lox.run("var i = 0;\nwhile (i < 900) i = i + 1;\nprint i;\n")
+            self.assertIn("line 2 in <module>\n"
+                          "BudgetExceeded: Step budget of 1000 exceeded\n",
+                          output.getvalue())
+            self.assertIn("900.0\n", output.getvalue())
+            self.assertTrue(lox.has_runtime_error)
+
+            output = run_captured(build, engine=engine, max_memory=10000)
+            self.assertIn("BudgetExceeded: Memory budget of 10000 bytes "
+                          "exceeded", output)
+
+        code = "fun down(n) { return down(n + 1); }\ndown(0);\n"
+        output = run_captured(code, engine="stack", max_memory=100000)
+        self.assertIn("Memory budget of 100000 bytes exceeded", output)
+        self.assertIsNone(Lox().budget)
+
+        # Tree and closure calls nest on the Python stack, which runs out
+        # before a large memory budget does
+        code = "fun up(n) { return 1 + up(n + 1); }\nprint up(0);\n"
+        for engine in ("tree", "closure"):
+            output = run_captured(code, engine=engine, max_memory=10000000)
+            self.assertIn("line 1 in <module>\nBudgetExceeded: Calls "
+                          "nested deeper than the Python stack allows\n",
+                          output)
+
+    def test_native_arrays(self):
+        code = "var a = array(4);\nvar i = 0;\n" \
+               "while (i < 4) { set(a, i, i); i = i + 1; }\n" \
+               "var b = map_add(a, 1);\n" \
+               "print sum(b) + dot(a, b);\npush(b, 0);\nsort(b);\n" \
+               "print b;\nvar s = array(0);\npush(s, \"b\");\n" \
+               "push(s, \"a\");\nsort(s);\nprint len(s);\nprint s;\n" \
+               "print get(a, 4);\n"
+        for engine in ("tree", "closure", "vm", "stack"):
+            output = run_captured(code, engine=engine)
+            self.assertIn("30.0\n[0.0, 1.0, 2.0, 3.0, 4.0]\n2.0\n[a, b]\n"
+                          "File <stdin>: line 15 in <module>\n"
+                          "NativeError: Index 4.0 out of bounds for array "
+                          "of length 4\n", output)
+
+        output = run_captured("var a = array(100000);\n", max_memory=10000)
+        self.assertIn("Memory budget of 10000 bytes exceeded", output)
+
+    def test_import_modules(self):
+        with tempfile.TemporaryDirectory() as directory:
+            files = {
+                "lib.lox": "print \"lib\";\nfun square(x) { return x * x; }"
+                           "\nfun name() { return \"lib\"; }\n",
+                "unused.lox": "print \"unused\";\n",
+                "main.lox": "import \"unused.lox\";\nimport \"lib.lox\";\n"
+                            "fun name() { return \"main\"; }\n"
+                            "print square(3);\nprint name();\n"
+            }
+            for name, code in files.items():
+                with open(os.path.join(directory, name), "w") as f:
+                    f.write(code)
+            main = os.path.join(directory, "main.lox")
+            outputs = []
+            for engine in ("tree", "vm", "tree"):
+                output = io.StringIO()
+                lox = Lox(engine=engine, output=Output(output, FLUSH_ON_EXIT))
+                lox.run_file(main)
+                outputs.append(output.getvalue())
+            # Traced calls of the functions the module made
+            lox = Lox(output=Output(io.StringIO(), FLUSH_ON_EXIT))
+            metrics = install(lox.interpreter, Metrics())
+            lox.run_file(main)
+            self.assertEqual(metrics.calls, 2)
+        # Run on first use, once per process and engine, and never for
+        # a module nothing is used from
+        self.assertEqual(outputs[0], "lib\n9.0\nmain\n"
+                                     "Expression evaluates to: None\n")
+        self.assertEqual(outputs[1], outputs[0])
+        self.assertEqual(outputs[2], "9.0\nmain\n"
+                                     "Expression evaluates to: None\n")
+
+        output = run_captured("import \"missing.lox\";\nprint 1;\n"
+                              "print missing;\n")
+        self.assertIn("1.0\n", output)
+        self.assertIn("Cannot import", output)
+
+    def test_snapshot_restore(self):
+        prelude = "fun square(x) { return x * x; }\nvar sq = square;\n" \
+                  "var base = 10;\n"
+        template = Lox(output=Output(io.StringIO(), FLUSH_ON_EXIT))
+        template.run(prelude)
+        snapshot = template.snapshot()
+        code = "print square(base) + sq(2);\nbase = 1;\n"
+
+        session = Lox(output=Output(io.StringIO(), FLUSH_ON_EXIT))
+        snapshot.restore(session)
+        table = session.interpreter.globals.sym_table
+        # The functions are shared, the table of names is not
+        self.assertIs(table["square"], snapshot.functions["square"])
+        self.assertIs(table["sq"], table["square"])
+        session.run(code)
+        self.assertTrue(session.output.stream.getvalue().startswith("104.0"))
+        self.assertEqual(template.interpreter.globals.sym_table["base"], 10)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "prelude.snap")
+            snapshot.save(path)
+            loaded = load_snapshot(path)
+        for engine in ("vm", "closure"):
+            session = Lox(engine=engine,
+                          output=Output(io.StringIO(), FLUSH_ON_EXIT))
+            loaded.restore(session)
+            table = session.interpreter.globals.sym_table
+            self.assertIs(table["sq"], table["square"])
+            session.run(code)
+            self.assertTrue(
+                session.output.stream.getvalue().startswith("104.0"))
+
+        template.run("fun make() { fun inner() {} return inner; }\n"
+                     "var made = make();\n")
+        with self.assertRaises(ValueError):
+            template.snapshot()
+        # What --save-snapshot does after running a prelude
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "prelude.snap")
+            with contextlib.redirect_stderr(io.StringIO()) as errors:
+                self.assertEqual(save_snapshot(template, path),
+                                 SNAPSHOT_EXIT)
+            self.assertIn("the function in made is not declared at the "
+                          "top level", errors.getvalue())
+            self.assertFalse(os.path.exists(path))
+
+    def test_server_pool(self):
+        pool = LoxPool(1, engine="vm")
+        result = pool.run("var a = 1;\nprint a + 1;\n")
+        self.assertEqual(result["exit_code"], 0)
+        self.assertTrue(result["stdout"].startswith("2.0\n"))
+        # The same Lox runs the next request, without the globals
+        result = pool.run("print a;\n", "second.lox")
+        self.assertEqual(result["exit_code"], 3)
+        self.assertIn("File <second.lox>", result["stdout"])
+        self.assertEqual(pool.run("print 1 +;\n")["exit_code"], 2)
+
+        requests = io.BytesIO()
+        for source in ("print 1;\n", "print 2;\n"):
+            write_message(requests, {"source": source})
+        requests.seek(0)
+        responses = io.BytesIO()
+        serve_stdio(pool, requests, responses)
+        responses.seek(0)
+        self.assertEqual(read_message(responses)["stdout"][:4], "1.0\n")
+        self.assertEqual(read_message(responses)["stdout"][:4], "2.0\n")
+        self.assertIsNone(read_message(responses))
+
+    def test_run_async_interleaves(self):
+        spin = "var i = 0;\nwhile (i < 5000) i = i + 1;\nprint i;\n"
+        quick = "print 1 + 2;\n"
+        finished = []
+
+        async def run(name, code):
+            lox = Lox(engine="stack", output=Output(io.StringIO(),
+                                                    FLUSH_ON_EXIT))
+            stats = await lox.run_async(code, slice_steps=100)
+            finished.append(name)
+            return lox.output.stream.getvalue(), stats
+
+        async def main():
+            return await asyncio.gather(run("spin", spin),
+                                        run("quick", quick))
+
+        (spin_output, spin_stats), (quick_output, quick_stats) = \
+            asyncio.run(main())
+        # The quick program started second but did not wait for the loop
+        self.assertEqual(finished, ["quick", "spin"])
+        self.assertTrue(spin_output.startswith("5000.0\n"))
+        self.assertTrue(quick_output.startswith("3.0\n"))
+        self.assertGreater(spin_stats.slices, 100)
+        self.assertEqual(quick_stats.slices, 1)
+        self.assertGreater(spin_stats.steps, 5000 * 5)
+        self.assertLessEqual(spin_stats.run_seconds, spin_stats.wall_seconds)
+        with self.assertRaises(ValueError):
+            asyncio.run(Lox().run_async(quick))
+
+    def test_resolver_slots(self):
+        code = "fun f(a) {\n var b = a;\n { print a + b; }\n}\n"
+        tokens = self.scanner.tokenize(code)
+        stmts = self.lox.resolver.resolve(self.parser.parse(tokens))
+        func = stmts[0]
+        self.assertIsNone(func.slot)
+        self.assertEqual(func.names, ["a"])
+        block = func.body
+        self.assertEqual(block.names, ["b"])
+        var_b = block.stmts[0]
+        self.assertEqual((var_b.expr.depth, var_b.expr.slot), (1, 0))
+        # The inner block declares nothing and gets no frame of its own
+        inner = block.stmts[1]
+        self.assertFalse(inner.scoped)
+        binary = inner.stmts[0].expr
+        self.assertEqual((binary.left.depth, binary.left.slot), (1, 0))
+        self.assertEqual((binary.right.depth, binary.right.slot), (0, 0))
+
+    def test_loop_frames(self):
+        code = """
+var i = 0;
+while (i < 3) { var x = i * 2; print x; i = i + 1; }
+var j = 0;
+while (j < 2) { print j; j = j + 1; }
+var get = nil;
+var k = 0;
+while (k < 2) { var z = k; fun f() { return z; } if (k == 0) get = f; k = k + 1; }
+print get();
+"""
+        lox = Lox()
+        stmts = lox.resolver.resolve(lox.parse(code))
+        loops = [stmts[n].body for n in (1, 3, 6)]
+        self.assertEqual([loop.scoped for loop in loops], [True, False, True])
+        self.assertEqual([loop.reuse_frame for loop in loops],
+                         [True, False, False])
+        expected = "0.0\n2.0\n4.0\n0.0\n1.0\n0.0\n"
+        for engine in ("tree", "closure", "vm", "stack"):
+            self.assertIn(expected, run_captured(code, engine=engine))
+
+        lox = Lox()
+        metrics = install(lox.interpreter, Metrics())
+        with contextlib.redirect_stdout(io.StringIO()):
+            lox.run("for (var i = 0; i < 100; i = i + 1) { print i; }\n")
+        # Only the block declaring i gets a Frame
+        self.assertEqual(metrics.environments, 1)
+
+    def test_vm_matches_interpreter(self):
+        self.assertEqual(
+            run_captured(PROGRAM, engine="vm"),
+            run_captured(PROGRAM, engine="tree")
+        )
+
+    def test_compiled_closures_match_interpreter(self):
+        self.assertEqual(
+            run_captured(PROGRAM, engine="closure"),
+            run_captured(PROGRAM, engine="tree")
+        )
+
+    def test_optimizer_passes(self):
+        code = """
+var n = 4;
+var i = 0;
+while (i < n * 2) {
+  if (True) print 1 + 2; else print "dead";
+  i = i + 1;
+}
+"""
+        self.assertEqual(
+            run_captured(code, optimize=["fold_constants",
+                "eliminate_dead_branches", "hoist_invariants"]),
+            run_captured(code)
+        )
+
+        lox = Lox(optimize=["fold_constants", "eliminate_dead_branches"])
+        tokens = lox.scanner.tokenize(code)
+        stmts = lox.optimizer.optimize(lox.parser.parse(tokens))
+        self.assertEqual(lox.optimizer.stats, {
+            "fold_constants": 3,
+            "eliminate_dead_branches": 4,
+            "hoist_invariants": 0
+        })
+        loop = stmts[2]
+        self.assertEqual(loop.body.stmts[0].expr.value, 3)
+
 
 if __name__ == '__main__':
     unittest.main()